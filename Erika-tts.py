@@ -1,49 +1,53 @@
+import json
 import shutil
 import subprocess
 import sys
 import os
 import datetime
-import glob
+import tempfile
 import time
 import yaml
-import simpleaudio as sa
 import wave
 
+import language_id
+import tts_daemon
+from audio_buffer import AudioBuffer
+from audio_cache import AudioCache, LRUFileIndex, make_key, concatenate_wavs
+from audio_encoding import OUTPUT_FORMATS, BackgroundEncoder, format_for_path, with_extension
+from metrics import current_trace, metrics
+from playback_engine import close_engine, get_engine
+from tts_interpreter import split_sentences
+from wav_writer import WavWriter, repair_wav_header
+
 SETTINGS_FILE = "erika_settings.yaml"
 ALLOWED_VOICES = ['alba', 'marius', 'javert', 'jean', 'fantine', 'cosette', 'eponine', 'azelma']
 SUPPORTED_LANGUAGES = ['en', 'nl', 'auto']
 
 
 def detect_language(text):
-    """Detect if text is English or Dutch using langdetect."""
-    try:
-        from langdetect import detect, DetectorFactory
-        # Make detection deterministic
-        DetectorFactory.seed = 0
-
-        # langdetect is unreliable for short texts, require minimum length
-        if len(text.split()) < 4:
-            print("(Text too short for reliable detection, defaulting to English)")
-            return 'en'
-
-        lang = detect(text)
-        # Map detected language to our supported set
-        if lang == 'nl':
-            return 'nl'
-        else:
-            # Default to English for any non-Dutch language
-            return 'en'
-    except Exception as e:
-        print(f"Language detection failed: {e}. Defaulting to English.")
-        return 'en'
+    """
+    Detect if text is English or Dutch.
+
+    Returns:
+        tuple: (language code, confidence)
+    """
+    # Any other language is spoken with the English engine
+    with metrics.span("language_detection"):
+        return language_id.detect_language(text, default="en")
 
 def load_settings(script_dir):
     settings_path = os.path.join(script_dir, SETTINGS_FILE)
     default_settings = {
         "default_voice": "azelma",
         "output_folder_name": "erika_tts_output",
+        "output_format": "wav",
         "max_audio_files": 5,
         "default_language": "auto",
+        "use_daemon": True,
+        "stream": False,
+        "playback_sink": "auto",
+        "voice_state_cache_megabytes": 256,
+        "daemon_socket": None,
         "generation_settings": {
             "temperature": 0.7,
             "lsd_decode_steps": 1,
@@ -54,11 +58,18 @@ def load_settings(script_dir):
         },
         "parkiet_settings": {
             "device": "cuda",
+            "quantization": "none",
+            "fast_decode": False,
             "max_new_tokens": 3072,
             "guidance_scale": 3.0,
             "temperature": 1.8,
             "top_p": 0.90,
             "top_k": 50,
+        },
+        "cache_settings": {
+            "enabled": True,
+            "folder_name": "erika_tts_cache",
+            "max_megabytes": 200,
         }
     }
 
@@ -79,9 +90,12 @@ def load_settings(script_dir):
             # Recursively merge parkiet_settings
             if "parkiet_settings" in user_settings and user_settings["parkiet_settings"] is not None:
                 settings["parkiet_settings"].update(user_settings["parkiet_settings"])
+            # Recursively merge cache_settings
+            if "cache_settings" in user_settings and user_settings["cache_settings"] is not None:
+                settings["cache_settings"].update(user_settings["cache_settings"])
             # Update top-level settings
             for key, value in user_settings.items():
-                if key not in ("generation_settings", "parkiet_settings"):
+                if key not in ("generation_settings", "parkiet_settings", "cache_settings"):
                     settings[key] = value
         
         return settings
@@ -109,19 +123,49 @@ def get_venv_python(script_dir):
     print("Please ensure 'venv312' or 'venv' directory exists in the same location as this script.")
     sys.exit(1)
 
-def clean_old_audio_files(output_dir, max_audio_files):
-    audio_files = sorted(
-        glob.glob(os.path.join(output_dir, "*.wav")),
-        key=os.path.getmtime,
-        reverse=True
-    )
-    if len(audio_files) > max_audio_files:
-        for old_file in audio_files[max_audio_files:]:
-            try:
-                os.remove(old_file)
-                print(f"Removed old audio file: {old_file}")
-            except OSError as e:
-                print(f"Error removing file {old_file}: {e}")
+def register_output_file(output_dir, output_filename, max_audio_files):
+    """Record a new output file and delete the oldest ones beyond max_audio_files."""
+    try:
+        LRUFileIndex(output_dir, max_files=max_audio_files).add(output_filename)
+    except OSError as e:
+        print(f"Error updating output folder index: {e}")
+
+
+def cache_settings_for(settings, lang):
+    """Settings that change the generated audio for an engine (the device and decode path do not)."""
+    group = settings.get("parkiet_settings" if lang == "nl" else "generation_settings", {})
+    return {key: value for key, value in group.items() if key not in ("device", "fast_decode")}
+
+
+def generate_via_daemon(text_to_generate, settings, lang, voice, full_output_path):
+    """
+    Thin client mode: hand the request to a running tts_daemon.
+
+    Returns:
+        bool: Generation result from the daemon, or None if no daemon is running
+              (the caller should then fall back to the local engines).
+    """
+    if not settings.get("use_daemon", True):
+        return None
+
+    try:
+        response = tts_daemon.synthesize(
+            text_to_generate, lang, settings,
+            voice=voice,
+            output_path=full_output_path,
+        )
+    except Exception as e:
+        print(f"TTS daemon request failed: {e}. Falling back to local generation.")
+        return None
+
+    if response is None:
+        return None
+
+    print(f"Engine: TTS daemon ({'Parkiet' if lang == 'nl' else 'Pocket TTS'})")
+    if not response.get("ok"):
+        print(f"TTS daemon error: {response.get('error')}")
+        return False
+    return os.path.exists(full_output_path)
 
 
 def generate_english(text_to_generate, settings, voice, full_output_path, script_dir):
@@ -150,6 +194,64 @@ def generate_english(text_to_generate, settings, voice, full_output_path, script
     result = subprocess.run(command_args, check=True, capture_output=True, text=True)
     if result.stderr:
         print(result.stderr)
+    if not os.path.exists(full_output_path):
+        return False
+    # pocket-tts leaves a bogus frame count; fix the size fields in place
+    try:
+        if repair_wav_header(full_output_path):
+            print("Repaired WAV header")
+    except ValueError as e:
+        print(f"Could not repair WAV header: {e}")
+    return True
+
+
+def stream_english(text_to_generate, settings, voice, full_output_path, play=True):
+    """
+    Generate English speech in-process with Pocket TTS, starting playback on
+    the first audio chunk instead of waiting for the whole utterance.
+    """
+    import tts_engines
+    from audio_playback_handler import play_pcm_stream
+
+    print(f"Engine: Pocket TTS (English, streaming)")
+    stats = tts_engines.StreamStats()
+    sample_rate = tts_engines.get_english_sample_rate(settings)
+    chunks = metrics.timed(tts_engines.stream_english(text_to_generate, settings, voice, stats),
+                           "generation", engine="pocket_tts")
+    trace = current_trace()
+    if trace is not None:
+        chunks = trace.watch(chunks, sample_rate)
+
+    # Chunks go to the output file as they are generated, not after playback
+    writer = WavWriter(full_output_path, sample_rate)
+
+    def recorded(chunks):
+        for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+
+    try:
+        if play:
+            print("Playing audio...")
+            get_engine({"sink": settings.get("playback_sink")})
+            with metrics.span("playback"):
+                play_pcm_stream(recorded(chunks), sample_rate, stats)
+        else:
+            for _ in recorded(chunks):
+                pass
+    finally:
+        writer.close()
+
+    if stats.time_to_first_audio is not None:
+        print(f"Time to first audio: {stats.time_to_first_audio * 1000:.0f} ms")
+    if stats.time_to_first_playback is not None:
+        print(f"Time to first playback: {stats.time_to_first_playback * 1000:.0f} ms")
+    if stats.real_time_factor is not None:
+        print(f"Real-time factor: {stats.real_time_factor:.2f} ({stats.audio_seconds:.2f}s of audio)")
+
+    if writer.frames == 0:
+        os.remove(full_output_path)
+        return False
     return os.path.exists(full_output_path)
 
 
@@ -170,6 +272,110 @@ def generate_dutch(text_to_generate, settings, full_output_path):
     )
 
 
+def generate_audio(text_to_generate, settings, lang, voice, full_output_path, script_dir):
+    """Generate one utterance, through the daemon if it runs or the local engines otherwise."""
+    with metrics.span("generation", engine="parkiet" if lang == "nl" else "pocket_tts"):
+        success = generate_via_daemon(text_to_generate, settings, lang, voice, full_output_path)
+        if success is None:
+            if lang == "nl":
+                success = generate_dutch(text_to_generate, settings, full_output_path)
+            else:
+                success = generate_english(text_to_generate, settings, voice, full_output_path, script_dir)
+    return success
+
+
+def generate_audio_batch(texts, settings, lang, voice, output_paths):
+    """
+    Generate several utterances in one batched pass, through the daemon if it
+    runs or the in-process engines otherwise.
+
+    Returns:
+        bool: True if every output path was written, or None if neither the
+              daemon nor the in-process engines are available (the caller
+              should then fall back to generate_audio).
+    """
+    with metrics.span("generation", engine="parkiet" if lang == "nl" else "pocket_tts"):
+        response = None
+        if settings.get("use_daemon", True):
+            try:
+                response = tts_daemon.synthesize_batch(texts, lang, settings, output_paths, voice=voice)
+            except Exception as e:
+                print(f"TTS daemon request failed: {e}. Falling back to local generation.")
+
+        if response is not None:
+            print(f"Engine: TTS daemon ({'Parkiet' if lang == 'nl' else 'Pocket TTS'}, batch of {len(texts)})")
+            if not response.get("ok"):
+                print(f"TTS daemon error: {response.get('error')}")
+                return False
+        else:
+            try:
+                import tts_engines
+            except ImportError as e:
+                print(f"In-process engines unavailable ({e}).")
+                return None
+            if lang == "nl":
+                tts_engines.generate_dutch_batch(texts, settings, output_paths)
+            else:
+                tts_engines.generate_english_batch(texts, settings, voice, output_paths)
+    return all(os.path.exists(path) for path in output_paths)
+
+
+def generate_with_cache(text_to_generate, settings, lang, voice, full_output_path, script_dir, cache,
+                        cached_only=False):
+    """
+    Assemble the utterance sentence by sentence from the audio cache, generating
+    (and caching) the missing sentences in one batched pass.
+
+    Parkiet picks a new speaker for every generation, so Dutch utterances are
+    cached whole rather than per sentence.
+
+    Returns:
+        bool: True if the output was written. With cached_only=True, returns
+              False without generating anything unless every sentence is cached.
+    """
+    engine = "parkiet" if lang == "nl" else "pocket_tts"
+    segment_voice = voice if lang == "en" else None
+    engine_settings = cache_settings_for(settings, lang)
+
+    if lang == "nl":
+        segments = [text_to_generate]
+    else:
+        segments = split_sentences(text_to_generate) or [text_to_generate]
+    keys = [make_key(engine, segment_voice, segment, engine_settings) for segment in segments]
+    paths = [cache.get(key) for key in keys]
+    hits = sum(1 for path in paths if path)
+    print(f"Cache: {hits}/{len(segments)} sentence(s) cached")
+
+    if cached_only and hits < len(segments):
+        return False
+
+    missing = [i for i, path in enumerate(paths) if not path]
+    if missing:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            segment_paths = [os.path.join(temp_dir, f"segment_{i}.wav") for i in missing]
+            success = generate_audio_batch([segments[i] for i in missing], settings, lang, voice,
+                                           segment_paths)
+            if success is None:
+                # Without a batch engine, one subprocess per sentence would reload
+                # the model each time: generate the utterance in one go, uncached
+                return generate_audio(text_to_generate, settings, lang, voice, full_output_path, script_dir)
+            for i, segment_path in zip(missing, segment_paths):
+                if os.path.exists(segment_path):
+                    paths[i] = cache.put(keys[i], segment_path, move=True)
+            if not success:
+                return False
+
+    if len(paths) == 1:
+        shutil.copyfile(paths[0], full_output_path)
+    else:
+        concatenate_wavs(paths, full_output_path)
+
+    stats = cache.stats()
+    print(f"Cache stats: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate']:.0%} hit rate), {stats['bytes'] / 1e6:.1f} MB")
+    return os.path.exists(full_output_path)
+
+
 def erika_tts_generate(text_to_generate, settings, voice=None, custom_output_filename=None, language=None):
     script_dir = os.path.dirname(os.path.abspath(__file__))
     output_dir = ensure_output_folder_exists(script_dir, settings["output_folder_name"])
@@ -177,10 +383,13 @@ def erika_tts_generate(text_to_generate, settings, voice=None, custom_output_fil
     # Determine language
     lang_setting = language if language else settings.get("default_language", "auto")
     if lang_setting == "auto":
-        detected_lang = detect_language(text_to_generate)
-        print(f"Auto-detected language: {detected_lang}")
+        detected_lang, confidence = detect_language(text_to_generate)
+        print(f"Auto-detected language: {detected_lang} ({confidence:.0%} confidence)")
     else:
         detected_lang = lang_setting
+    trace = current_trace()
+    if trace is not None:
+        trace.labels["engine"] = "parkiet" if detected_lang == "nl" else "pocket_tts"
 
     # If voice is not provided by command line, use default from settings (only for English)
     actual_voice = voice if voice is not None else settings["default_voice"]
@@ -192,44 +401,90 @@ def erika_tts_generate(text_to_generate, settings, voice=None, custom_output_fil
             print(f"Allowed voices are: {', '.join(ALLOWED_VOICES)} OR a valid path to a WAV file.")
             sys.exit(1)
 
+    # The extension of --output picks the format, otherwise output_format from the settings
+    output_format = settings.get("output_format", "wav")
+    if output_format not in OUTPUT_FORMATS:
+        print(f"Error: Invalid output_format '{output_format}'. Supported: {', '.join(OUTPUT_FORMATS)}")
+        sys.exit(1)
+
     # Generate a unique filename if not provided
     if custom_output_filename:
-        # Ensure it's a .wav file
-        if not custom_output_filename.endswith(".wav"):
-            custom_output_filename += ".wav"
-        output_filename = custom_output_filename
+        output_filename = with_extension(custom_output_filename, output_format)
+        output_format = format_for_path(output_filename)
     else:
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         lang_suffix = "nl" if detected_lang == "nl" else "en"
-        output_filename = f"erika_output_{timestamp}_{lang_suffix}.wav"
+        output_filename = with_extension(f"erika_output_{timestamp}_{lang_suffix}", output_format)
 
-    full_output_path = os.path.join(output_dir, output_filename)
+    final_output_path = os.path.join(output_dir, output_filename)
+    # Audio is generated and played as WAV; other formats are encoded from it in the background
+    full_output_path = final_output_path if output_format == "wav" else final_output_path + ".tmp.wav"
 
     print(f"\n--- Generating TTS ---")
     print(f"Text: \"{text_to_generate}\"")
     print(f"Language: {detected_lang}")
     if detected_lang == "en":
         print(f"Voice: {actual_voice if actual_voice else 'Default (from settings)'}")
-    print(f"Output: {full_output_path}")
+    print(f"Output: {final_output_path}")
+
+    playback_enabled = not os.environ.get("ERIKA_NO_PLAYBACK")
+    already_played = False
 
     try:
-        if detected_lang == "nl":
-            success = generate_dutch(text_to_generate, settings, full_output_path)
+        cache = AudioCache.from_config(settings.get("cache_settings"), script_dir)
+        streaming = settings.get("stream") and detected_lang == "en"
+
+        if cache is not None:
+            # When streaming, only use the cache if it can serve the whole text
+            success = generate_with_cache(text_to_generate, settings, detected_lang, actual_voice,
+                                          full_output_path, script_dir, cache, cached_only=streaming)
         else:
-            success = generate_english(text_to_generate, settings, actual_voice, full_output_path, script_dir)
+            success = False
+
+        streamed = False
+        if not success and streaming:
+            success = stream_english(text_to_generate, settings, actual_voice, full_output_path, play=playback_enabled)
+            already_played = playback_enabled
+            streamed = True
+        elif not success and cache is None:
+            success = generate_audio(text_to_generate, settings, detected_lang, actual_voice, full_output_path, script_dir)
 
         if success and os.path.exists(full_output_path):
-            print(f"\nTTS generated successfully at {full_output_path}")
-            clean_old_audio_files(output_dir, settings["max_audio_files"])
-            # Play audio if not disabled
-            if not os.environ.get("ERIKA_NO_PLAYBACK"):
+            if trace is not None and not streamed:
+                # A stream counted its audio as it played
+                trace.first_audio()
+                with wave.open(full_output_path, "rb") as wf:
+                    trace.add_audio(wf.getnframes() / wf.getframerate())
+            encoder = encoding = None
+            if output_format != "wav":
+                encoder = BackgroundEncoder()
+                encoding = encoder.submit(full_output_path, final_output_path, output_format)
+
+            # Play audio if not disabled (streaming already played it)
+            if playback_enabled and not already_played:
                 print("Playing audio...")
                 try:
-                    wave_obj = sa.WaveObject.from_wave_file(full_output_path)
-                    play_obj = wave_obj.play()
-                    play_obj.wait_done()
+                    with metrics.span("playback"):
+                        get_engine({"sink": settings.get("playback_sink")}).play(AudioBuffer.from_file(full_output_path))
                 except Exception as e:
                     print(f"Audio playback failed: {e}")
+
+            if encoding is not None:
+                try:
+                    encoding.result()
+                    wav_bytes = os.path.getsize(full_output_path)
+                    encoded_bytes = os.path.getsize(final_output_path)
+                    print(f"Encoded {output_format.upper()}: {encoded_bytes / 1024:.0f} KB "
+                          f"({encoded_bytes / wav_bytes:.0%} of WAV) in {encoder.stats()['encode_seconds']:.2f}s")
+                except Exception as e:
+                    print(f"Encoding to {output_format} failed: {e}")
+                finally:
+                    encoder.shutdown()
+                    os.remove(full_output_path)
+
+            if os.path.exists(final_output_path):
+                print(f"\nTTS generated successfully at {final_output_path}")
+                register_output_file(output_dir, output_filename, settings["max_audio_files"])
         else:
             print(f"\nError: Expected output file '{full_output_path}' was not created.")
 
@@ -243,6 +498,39 @@ def erika_tts_generate(text_to_generate, settings, voice=None, custom_output_fil
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
+def erika_tts_batch(batch_file, settings, output_folder=None, workers=None, voice=None, language=None):
+    """
+    Render a JSONL file of prompts into a folder (see batch_render.py).
+    `voice` and `language` are the defaults for lines that do not set them.
+    """
+    import batch_render
+
+    settings = dict(settings)
+    if voice is not None:
+        settings["default_voice"] = voice
+    if language is not None:
+        settings["default_language"] = language
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if not os.path.exists(batch_file):
+        print(f"Error: Batch file '{batch_file}' not found.")
+        return False
+
+    # Keep batch output out of the main output folder, whose retention limit would delete it
+    if output_folder is None:
+        output_folder = os.path.join(settings["output_folder_name"], os.path.splitext(os.path.basename(batch_file))[0])
+    output_dir = output_folder if os.path.isabs(output_folder) else os.path.join(script_dir, output_folder)
+
+    print(f"\n--- Batch rendering ---")
+    print(f"Input: {batch_file}")
+    print(f"Output: {output_dir}")
+    try:
+        return batch_render.render_batch(batch_file, settings, output_dir, workers,
+                                         lambda text: detect_language(text)[0])
+    except ValueError as e:
+        print(f"Error: {e}")
+        return False
+
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
     settings = load_settings(script_dir) # Load settings here
@@ -254,6 +542,9 @@ if __name__ == "__main__":
     voice = None # Initialize as None, will default to settings if not provided by CLI
     output_filename = None # User-specified output filename, not full path
     language = None # Language override: en, nl, or auto
+    batch_file = None # JSONL file for bulk rendering
+    workers = None # Batch worker processes (default: one per two cores)
+    show_metrics = False # Print the request's stage timings when done
 
     # Simple argument parsing
     i = 0
@@ -277,6 +568,24 @@ if __name__ == "__main__":
                     print(f"Error: Invalid language '{language}'. Supported: {', '.join(SUPPORTED_LANGUAGES)}")
                     sys.exit(1)
                 i += 1
+        elif args[i] == "--batch":
+            if i + 1 < len(args):
+                batch_file = args[i+1]
+                i += 1
+        elif args[i] == "--workers":
+            if i + 1 < len(args):
+                try:
+                    workers = int(args[i+1])
+                except ValueError:
+                    print(f"Error: --workers expects a number, got '{args[i+1]}'")
+                    sys.exit(1)
+                i += 1
+        elif args[i] == "--no-daemon":
+            settings["use_daemon"] = False
+        elif args[i] == "--stream":
+            settings["stream"] = True
+        elif args[i] == "--metrics":
+            show_metrics = True
         else:
             # If --text was not used, assume the first positional argument is the text
             if text_to_generate is None:
@@ -285,21 +594,44 @@ if __name__ == "__main__":
                 print(f"Warning: Unrecognized argument or duplicate text value '{args[i]}'. Ignoring.")
         i += 1
 
+    if batch_file:
+        sys.exit(0 if erika_tts_batch(batch_file, settings, output_filename, workers, voice, language) else 1)
+
     if text_to_generate is None:
-        print("Usage: python Erika-tts.py --text \"Your text here\" [--voice voice_name] [--output filename.wav] [--lang en|nl|auto]")
+        print("Usage: python Erika-tts.py --text \"Your text here\" [--voice voice_name] [--output filename.wav|.flac|.opus] [--lang en|nl|auto] [--no-daemon] [--stream] [--metrics]")
+        print("       python Erika-tts.py --batch input.jsonl [--output folder] [--workers N]")
         print(f"\nSettings (from {SETTINGS_FILE}):")
         print(f"  Default voice: '{settings['default_voice']}'")
         print(f"  Default language: '{settings.get('default_language', 'auto')}'")
         print(f"  Output folder: '{settings['output_folder_name']}'")
+        print(f"  Output format: '{settings.get('output_format', 'wav')}' (wav, flac or opus; --output's extension wins)")
         print(f"  Max audio files: {settings['max_audio_files']}")
         print("\nLanguage options:")
         print("  --lang en    Force English (Pocket TTS)")
         print("  --lang nl    Force Dutch (Parkiet)")
         print("  --lang auto  Auto-detect language (default)")
+        print("\nDaemon:")
+        print("  Start 'python tts_daemon.py' once to keep the models loaded between calls.")
+        print("  --no-daemon  Always generate locally, even if a daemon is running")
+        print("\nStreaming (English):")
+        print("  --stream     Generate in-process and start playing on the first audio chunk")
+        print("\nMetrics:")
+        print("  --metrics    Print the stage timings, time to first audio and real-time factor as JSON")
+        print("\nBulk rendering:")
+        print("  --batch FILE  Render every line of a JSONL file ({\"text\", \"voice\", \"lang\", \"output\"})")
+        print("                with a process pool; rerun the same command to resume")
+        print("  --workers N  Worker processes (default: one per two CPU cores)")
         print("\nExamples:")
         print("  python Erika-tts.py --text \"Hello, I am Erika.\"")
         print("  python Erika-tts.py --text \"Hallo, ik ben Erika.\" --lang nl")
         print("  python Erika-tts.py --text \"Hello\" --voice azelma --output my_speech.wav")
         sys.exit(1)
 
-    erika_tts_generate(text_to_generate, settings, voice, output_filename, language)
+    try:
+        with metrics.trace("cli") as trace:
+            erika_tts_generate(text_to_generate, settings, voice, output_filename, language)
+    finally:
+        # Play out whatever is still queued or in the device buffer before exiting
+        close_engine()
+    if show_metrics:
+        print(json.dumps(trace.summary(), indent=2))
@@ -0,0 +1,133 @@
+"""
+In-memory audio passed between the engines, the cache and playback.
+
+An AudioBuffer is a mono float32 NumPy array plus its sample rate. Engines
+return one instead of the path of a temporary WAV file, so an utterance goes
+from the model to the speakers without touching disk. A file is only written
+when a caller asks for one (the audio cache, an output path).
+"""
+import io
+import os
+import wave
+
+import numpy as np
+
+from metrics import metrics
+
+READ_BLOCK_FRAMES = 65536
+
+
+def _decode_pcm(data, sample_width, channels):
+    """Interleaved little-endian PCM bytes -> mono float32 in [-1, 1]."""
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        value = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = np.where(value & 0x800000, value - 0x1000000, value).astype(np.float32) / 8388608.0
+    elif sample_width == 4:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width}")
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def _read_wav(source):
+    """(samples, sample_rate) of a PCM WAV path or file object."""
+    try:
+        with wave.open(source, "rb") as wf:
+            channels, sample_width, sample_rate = wf.getnchannels(), wf.getsampwidth(), wf.getframerate()
+            # Read in blocks; pocket-tts may write a bogus frame count
+            blocks = []
+            while True:
+                data = wf.readframes(READ_BLOCK_FRAMES)
+                if not data:
+                    break
+                blocks.append(data)
+        return _decode_pcm(b"".join(blocks), sample_width, channels), sample_rate
+    except wave.Error:
+        # Float or other non-PCM WAV: the wave module cannot read it
+        import soundfile as sf
+
+        if hasattr(source, "seek"):
+            source.seek(0)
+        samples, sample_rate = sf.read(source, dtype="float32", always_2d=True)
+        return samples.mean(axis=1), sample_rate
+
+
+class AudioBuffer:
+    """
+    Args:
+        samples: Mono PCM as floats in [-1, 1] (a (frames, channels) array is downmixed)
+        sample_rate: Samples per second
+    """
+
+    __slots__ = ("samples", "sample_rate")
+
+    def __init__(self, samples, sample_rate):
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim > 1:
+            samples = samples.reshape(len(samples), -1).mean(axis=1)
+        self.samples = samples
+        self.sample_rate = int(sample_rate)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a WAV file (tolerates the bogus frame count pocket-tts writes)."""
+        return cls(*_read_wav(path))
+
+    @classmethod
+    def from_wav_bytes(cls, data):
+        """Decode WAV file contents held in memory."""
+        return cls(*_read_wav(io.BytesIO(data)))
+
+    @classmethod
+    def concatenate(cls, buffers):
+        """Join buffers that share a sample rate."""
+        buffers = [b for b in buffers if b is not None]
+        if not buffers:
+            raise ValueError("Nothing to concatenate")
+        sample_rate = buffers[0].sample_rate
+        if any(b.sample_rate != sample_rate for b in buffers):
+            raise ValueError("Sample rate mismatch")
+        return cls(np.concatenate([b.samples for b in buffers]), sample_rate)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        """Length in seconds."""
+        return len(self.samples) / self.sample_rate
+
+    def to_pcm16(self):
+        """Samples as 16-bit PCM (what playback and the WAV files use)."""
+        return (np.clip(self.samples, -1.0, 1.0) * 32767).astype("<i2")
+
+    def _write_wav(self, target):
+        with metrics.span("wav_write"), wave.open(target, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(self.sample_rate)
+            wf.writeframes(self.to_pcm16().tobytes())
+
+    def to_wav_bytes(self):
+        """The buffer as the contents of a 16-bit mono WAV file."""
+        out = io.BytesIO()
+        self._write_wav(out)
+        return out.getvalue()
+
+    def write(self, path):
+        """Write a 16-bit mono WAV file. Returns `path`."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._write_wav(path)
+        return path
+
+    def __repr__(self):
+        return f"AudioBuffer({self.duration:.2f}s @ {self.sample_rate} Hz)"
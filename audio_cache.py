@@ -0,0 +1,336 @@
+"""
+Content-addressed audio cache and size-bounded file retention.
+
+Synthesized utterances are stored under a hash of (engine, voice, normalized
+text, generation settings), so repeated phrases are played from disk instead
+of being synthesized again. Callers cache per sentence, so partially repeated
+texts still hit. Both the cache and the output folder keep an on-disk index in
+LRU order, which replaces globbing and sorting the whole folder by mtime.
+
+Several processes (the MCP server, the daemon, the CLI) can share one cache
+folder: each save merges the index on disk under a file lock, so entries
+added by other processes are kept and count against the size limit.
+"""
+import atexit
+import collections
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import unicodedata
+import wave
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from audio_buffer import AudioBuffer
+
+INDEX_FILE = "index.json"
+SAVE_INTERVAL_SECONDS = 5.0  # Cache hits only reorder entries; their saves are batched
+AUDIO_PATTERNS = ("*.wav", "*.flac", "*.opus", "*.ogg")
+
+# Voice files are hashed once per (path, mtime, size)
+_voice_hash_cache = {}
+
+
+def normalize_text(text):
+    """Normalization used for cache keys: NFC unicode and collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def voice_identity(voice):
+    """Predefined voice names are used as-is; voice files are identified by content."""
+    if not voice or not os.path.isfile(voice):
+        return voice or ""
+    stat = os.stat(voice)
+    cache_key = (os.path.abspath(voice), stat.st_mtime_ns, stat.st_size)
+    if cache_key not in _voice_hash_cache:
+        digest = hashlib.sha256()
+        with open(voice, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _voice_hash_cache[cache_key] = "file:" + digest.hexdigest()
+    return _voice_hash_cache[cache_key]
+
+
+def make_key(engine, voice, text, settings=None):
+    """Cache key for one utterance."""
+    payload = json.dumps({
+        "engine": engine,
+        "voice": voice_identity(voice),
+        "text": normalize_text(text),
+        "settings": settings or {},
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def concatenate_wavs(paths, output_path):
+    """Join WAV files with identical formats into one file."""
+    params = None
+    with wave.open(output_path, "wb") as out:
+        for path in paths:
+            with wave.open(path, "rb") as wf:
+                if params is None:
+                    params = wf.getparams()
+                    out.setnchannels(params.nchannels)
+                    out.setsampwidth(params.sampwidth)
+                    out.setframerate(params.framerate)
+                elif (wf.getnchannels(), wf.getsampwidth(), wf.getframerate()) != \
+                        (params.nchannels, params.sampwidth, params.framerate):
+                    raise ValueError(f"WAV format mismatch: {path}")
+                # Read in blocks; pocket-tts may write a bogus frame count
+                while True:
+                    data = wf.readframes(65536)
+                    if not data:
+                        break
+                    out.writeframes(data)
+    return output_path
+
+
+@contextlib.contextmanager
+def _locked_file(path):
+    """Exclusive lock on `path` (created if missing), shared by all processes."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class LRUFileIndex:
+    """
+    Tracks files in a directory in least-recently-used order and deletes the
+    oldest ones once `max_files` or `max_bytes` is exceeded.
+
+    The order is persisted in a small JSON index, so enforcing the limits never
+    needs to list or stat the whole directory. Additions are saved right away;
+    hits only reorder entries and are saved at most every
+    SAVE_INTERVAL_SECONDS (and at exit). Each save merges the index on disk
+    under a file lock, ordering entries by their last use across processes.
+    """
+
+    def __init__(self, directory, max_files=None, max_bytes=None, index_name=INDEX_FILE):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, index_name)
+        self.entries = collections.OrderedDict()  # name -> (size, last used), oldest first
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._saved_stats = dict(self.stats)  # Part of `stats` that is already on disk
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._lock, _locked_file(self.index_path + ".lock"):
+            self._load()
+        atexit.register(self.flush)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self.entries
+
+    def _read_index(self):
+        """(entries, stats) from the index on disk, or None if there is none."""
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Audio index unreadable, rebuilding: {e}")
+            return None
+        # Indexes written before last-use times were kept are in LRU order already
+        entries = collections.OrderedDict(
+            (entry[0], (entry[1], entry[2] if len(entry) > 2 else 0.0)) for entry in data.get("entries", []))
+        return entries, data.get("stats", {})
+
+    def _load(self):
+        index = self._read_index()
+        if index is None:
+            self._seed_from_directory()
+            return
+        self.entries, stats = index
+        self.stats.update(stats)
+        self._saved_stats = dict(self.stats)
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+
+    def _seed_from_directory(self):
+        # One-time migration for folders that predate the index
+        files = sorted((path for pattern in AUDIO_PATTERNS for path in glob.glob(os.path.join(self.directory, pattern))),
+                       key=os.path.getmtime)
+        for path in files:
+            self.entries[os.path.basename(path)] = (os.path.getsize(path), os.path.getmtime(path))
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+        if files:
+            self._write(self.stats)
+
+    def _save(self, keep=None):
+        # Called with self._lock held
+        with _locked_file(self.index_path + ".lock"):
+            index = self._read_index()
+            disk_stats = self._saved_stats
+            if index is not None:
+                disk_entries, disk_stats = index
+                # Entries of other processes are kept if their file still exists
+                for name, (size, used) in disk_entries.items():
+                    if name in self.entries:
+                        self.entries[name] = (self.entries[name][0], max(used, self.entries[name][1]))
+                    elif os.path.exists(self.path_for(name)):
+                        self.entries[name] = (size, used)
+                self.entries = collections.OrderedDict(sorted(self.entries.items(), key=lambda item: item[1][1]))
+                self.total_bytes = sum(size for size, _ in self.entries.values())
+            self._evict(keep)
+            # Add this process's counts since its last save to everyone else's
+            stats = {key: disk_stats.get(key, 0) + self.stats[key] - self._saved_stats.get(key, 0)
+                     for key in self.stats}
+            self._write(stats)
+
+    def _write(self, stats):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": [[name, size, used] for name, (size, used) in self.entries.items()],
+                       "stats": stats}, f)
+        os.replace(tmp_path, self.index_path)
+        self.stats = dict(stats)
+        self._saved_stats = dict(stats)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def flush(self):
+        """Save hits that have not been written yet."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def path_for(self, name):
+        return os.path.join(self.directory, name)
+
+    def touch(self, name):
+        """Look up an entry and mark it as used. Returns its path, or None if it is missing."""
+        with self._lock:
+            path = self.path_for(name)
+            if name in self.entries and not os.path.exists(path):
+                self.total_bytes -= self.entries.pop(name)[0]
+            if name not in self.entries:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.entries[name] = (self.entries[name][0], time.time())
+            self.entries.move_to_end(name)
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= SAVE_INTERVAL_SECONDS:
+                self._save()
+            return path
+
+    def add(self, name):
+        """Register a file that was written to the directory, then enforce the limits."""
+        with self._lock:
+            size = os.path.getsize(self.path_for(name))
+            self.total_bytes += size - self.entries.pop(name, (0, 0.0))[0]
+            self.entries[name] = (size, time.time())
+            self._save(keep=name)
+
+    def _evict(self, keep=None):
+        while self.entries and self._over_budget():
+            name = next(iter(self.entries))
+            if name == keep:
+                break
+            size, _ = self.entries.pop(name)
+            self.total_bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self.path_for(name))
+                logging.info(f"Evicted audio file: {name}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Error removing file {name}: {e}")
+
+    def _over_budget(self):
+        if self.max_files is not None and len(self.entries) > self.max_files:
+            return True
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            return True
+        return False
+
+
+class AudioCache:
+    """Persistent utterance cache with byte-budget LRU eviction."""
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024):
+        self.index = LRUFileIndex(cache_dir, max_bytes=max_bytes)
+
+    @classmethod
+    def from_config(cls, cache_config, base_dir):
+        """Build a cache from a {"enabled", "folder_name", "max_megabytes"} block, or None if disabled."""
+        if not cache_config or not cache_config.get("enabled", True):
+            return None
+        cache_dir = os.path.join(base_dir, cache_config.get("folder_name", "tts_cache"))
+        max_bytes = int(cache_config.get("max_megabytes", 200) * 1024 * 1024)
+        return cls(cache_dir, max_bytes)
+
+    def get(self, key):
+        """Path of the cached audio for `key`, or None on a miss."""
+        return self.index.touch(key + ".wav")
+
+    def contains(self, key):
+        """Check for an entry without counting a lookup or touching LRU order."""
+        return key + ".wav" in self.index
+
+    def get_buffer(self, key):
+        """Cached audio for `key` as an AudioBuffer, or None on a miss."""
+        path = self.get(key)
+        return AudioBuffer.from_file(path) if path else None
+
+    def put(self, key, source_path, move=False):
+        """Store `source_path` under `key`. Returns the cached path."""
+        name = key + ".wav"
+        dest = self.index.path_for(name)
+        tmp_dest = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if move:
+            shutil.move(source_path, tmp_dest)
+        else:
+            shutil.copyfile(source_path, tmp_dest)
+        os.replace(tmp_dest, dest)
+        self.index.add(name)
+        return dest
+
+    def put_buffer(self, key, buffer):
+        """Store an in-memory AudioBuffer under `key` (written once, straight into the cache). Returns the cached path."""
+        name = key + ".wav"
+        dest = self.index.path_for(name)
+        tmp_dest = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        buffer.write(tmp_dest)
+        os.replace(tmp_dest, dest)
+        self.index.add(name)
+        return dest
+
+    def stats(self):
+        hits, misses = self.index.stats["hits"], self.index.stats["misses"]
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "evictions": self.index.stats["evictions"],
+            "entries": len(self.index.entries),
+            "bytes": self.index.total_bytes,
+        }
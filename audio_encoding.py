@@ -0,0 +1,138 @@
+"""
+Compressed output formats for archived utterances (FLAC, Ogg/Opus).
+
+Audio is generated and played as PCM; encoding into the archive format
+happens afterwards on a small thread pool (libsndfile releases the GIL while
+it encodes), so it never delays playback. Opus only supports a few sample
+rates, so 44.1 kHz Parkiet audio is resampled to 48 kHz for it.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_buffer import AudioBuffer
+from audio_postprocess import resample
+
+# name -> (extension, libsndfile format, subtype)
+OUTPUT_FORMATS = {
+    "wav": (".wav", "WAV", "PCM_16"),
+    "flac": (".flac", "FLAC", "PCM_16"),
+    "opus": (".opus", "OGG", "OPUS"),
+}
+EXTENSIONS = {".wav": "wav", ".flac": "flac", ".opus": "opus", ".ogg": "opus"}
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+DEFAULT_ENCODER_THREADS = 2
+
+
+def format_for_path(path, default=None):
+    """Output format implied by the extension of `path` (or `default` if it has none we know)."""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), default)
+
+
+def with_extension(filename, output_format):
+    """`filename` unchanged if it already has an audio extension, otherwise with the format's one."""
+    if format_for_path(filename):
+        return filename
+    return filename + OUTPUT_FORMATS[output_format][0]
+
+
+def encode(audio, path, output_format=None, compression_level=None):
+    """
+    Write an AudioBuffer as `output_format` (default: from the extension of `path`).
+
+    Args:
+        compression_level: 0.0 (fastest/largest) to 1.0 (slowest/smallest);
+                           None keeps libsndfile's default
+
+    Returns:
+        str: `path`
+    """
+    import soundfile as sf
+
+    output_format = output_format or format_for_path(path, "wav")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}' (use {', '.join(OUTPUT_FORMATS)})")
+    _, file_format, subtype = OUTPUT_FORMATS[output_format]
+
+    if output_format == "opus" and audio.sample_rate not in OPUS_SAMPLE_RATES:
+        audio = resample(audio, 48000)
+    samples, sample_rate = audio.samples, audio.sample_rate
+
+    kwargs = {}
+    if compression_level is not None and output_format != "wav":
+        kwargs["compression_level"] = compression_level
+    sf.write(path, samples, sample_rate, format=file_format, subtype=subtype, **kwargs)
+    return path
+
+
+class BackgroundEncoder:
+    """
+    Encodes finished utterances on worker threads.
+
+    Args:
+        max_workers: Encoder threads
+        compression_level: Passed to encode()
+    """
+
+    def __init__(self, max_workers=DEFAULT_ENCODER_THREADS, compression_level=None):
+        self.compression_level = compression_level
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="encoder")
+        self._lock = threading.Lock()
+        self.files = 0
+        self.failed = 0
+        self.encode_seconds = 0.0
+        self.audio_seconds = 0.0
+        self.bytes_written = 0
+
+    def submit(self, audio, path, output_format=None, remove_source=None):
+        """
+        Queue `audio` (an AudioBuffer or a WAV path) for encoding to `path`.
+        `remove_source`, if given, is deleted once the file is written.
+        The file appears under `path` only when it is complete.
+
+        Returns:
+            concurrent.futures.Future: Resolves to `path`
+        """
+        return self._executor.submit(self._encode, audio, path, output_format, remove_source)
+
+    def _encode(self, audio, path, output_format, remove_source):
+        start = time.perf_counter()
+        output_format = output_format or format_for_path(path, "wav")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if not isinstance(audio, AudioBuffer):
+                audio = AudioBuffer.from_file(audio)
+            encode(audio, tmp_path, output_format, self.compression_level)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logging.error(f"Encoding {path} failed: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if remove_source and os.path.exists(remove_source):
+            os.remove(remove_source)
+
+        with self._lock:
+            self.files += 1
+            self.encode_seconds += time.perf_counter() - start
+            self.audio_seconds += audio.duration
+            self.bytes_written += os.path.getsize(path)
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": self.files,
+                "failed": self.failed,
+                "encode_seconds": round(self.encode_seconds, 3),
+                "audio_seconds": round(self.audio_seconds, 3),
+                "megabytes": round(self.bytes_written / 1e6, 3),
+            }
+
+    def shutdown(self, wait=True):
+        """Finish (or with wait=False, abandon) the queued files."""
+        self._executor.shutdown(wait=wait)
@@ -6,9 +6,64 @@ import subprocess
 import ctypes
 from ctypes import wintypes
 
+from audio_buffer import AudioBuffer
+from cancellation import Cancelled
+from playback_engine import get_engine
+
+
+def play_pcm(audio, sample_rate):
+    """Play mono float PCM from memory on the shared playback engine and wait until it has finished."""
+    get_engine().play(AudioBuffer(audio, sample_rate))
+
+
+def play_pcm_stream(chunks, sample_rate, stats=None, cancel=None):
+    """
+    Play float PCM chunks as they arrive, starting on the first chunk.
+
+    The chunks are pulled by the playback engine's feeder thread into its
+    ring buffer, so generation keeps running while audio plays and the
+    chunks are played back to back without gaps.
+
+    Args:
+        chunks: Iterable of mono float32 numpy arrays
+        sample_rate: Sample rate of the chunks
+        stats: Optional stats object (e.g. tts_engines.StreamStats); its
+               `time_to_first_playback` is set to the seconds until playback
+               actually started.
+        cancel: Optional cancellation.CancelToken that stops playback (and
+                the chunk source) immediately; Cancelled is raised then
+
+    Returns:
+        numpy.ndarray: All played audio concatenated (for saving to disk)
+    """
+    import numpy as np
+
+    played = []
+
+    def recorded():
+        for chunk in chunks:
+            played.append(chunk)
+            yield chunk
+
+    start_time = time.perf_counter()
+    segment = get_engine().stream(recorded(), sample_rate, cancel)
+    try:
+        segment.wait()
+    finally:
+        if stats is not None and segment.started_at is not None:
+            stats.time_to_first_playback = segment.started_at - start_time
+    return np.concatenate(played) if played else np.zeros(0, dtype=np.float32)
+
+
 class AudioPlaybackHandler:
-    def __init__(self):
+    def __init__(self, playback_config=None):
         self.window_configured = False
+        self.playback_config = playback_config  # {"sink", "buffer_seconds", "block_ms"}
+
+    @property
+    def engine(self):
+        """The long-lived playback engine (created on first use)."""
+        return get_engine(self.playback_config)
 
     def configure_window(self):
         """Configure the console window (Title, Position, Size)."""
@@ -103,12 +158,59 @@ class AudioPlaybackHandler:
         except Exception as e:
             logging.error(f"Failed to display text: {e}")
 
+    def play_stream(self, chunks, sample_rate, stats=None, cancel=None):
+        """
+        Plays streamed PCM chunks, starting as soon as the first one arrives.
+        Raises Cancelled if `cancel` stopped it.
+        """
+        try:
+            self.engine  # Create it from our config before play_pcm_stream uses it
+            start_time = time.time()
+            audio = play_pcm_stream(chunks, sample_rate, stats, cancel)
+            elapsed = time.time() - start_time
+            logging.info(f"Streamed playback finished in {elapsed:.2f}s")
+            return audio
+        except Cancelled:
+            raise
+        except Exception as e:
+            logging.error(f"Streaming playback error: {e}")
+            return None
+
+    def play_buffer(self, audio, wait=True, cancel=None):
+        """
+        Queues an AudioBuffer on the playback engine, right behind whatever
+        is playing. Returns its playback segment (None on error). Cancelling
+        `cancel` stops it; with wait=True, Cancelled is raised then.
+        """
+        try:
+            segment = self.engine.play(audio, wait=wait, cancel=cancel)
+            if wait:
+                logging.info(f"Playback finished ({audio.duration:.2f}s of audio, "
+                             f"{self.engine.underruns} underruns so far)")
+            return segment
+        except Cancelled:
+            raise
+        except Exception as e:
+            logging.error(f"Buffer playback error: {e}")
+            return None
+
+    def stats(self):
+        return self.engine.stats()
+
     def play_audio(self, file_path):
-        """Plays audio using PowerShell."""
+        """Plays an audio file on the playback engine, falling back to PowerShell."""
         if not os.path.exists(file_path):
             logging.error(f"Audio file missing: {file_path}")
             return
-            
+
+        try:
+            audio = AudioBuffer.from_file(file_path)
+        except Exception as e:
+            logging.warning(f"Could not load {file_path} for the playback engine: {e}")
+        else:
+            if self.play_buffer(audio) is not None:
+                return
+
         try:
             logging.info("Attempting playback with Powershell")
             # We use a specific Powershell command that loads the sound player, plays it, and waits.
@@ -0,0 +1,459 @@
+"""
+Post-processing shared by all engines: silence trimming, resampling to one
+output rate and loudness normalization.
+
+Pocket TTS, Parkiet (44.1 kHz) and XTTS (24 kHz) produce different rates and
+levels. Bringing every utterance to the same rate and loudness lets mixed
+engine output be concatenated, cached and queued on one playback device
+without reopening it.
+
+The resampler is a polyphase FIR: the Kaiser-windowed sinc for each rate
+pair is designed once and cached, and every output sample of a chunk is
+computed in one vectorized dot product against its phase. It keeps its
+input history between calls, so streamed chunks resample exactly like the
+whole buffer would. Loudness is an ITU-R BS.1770 style gated measurement
+(400 ms blocks, absolute and relative gates) without the K-weighting
+pre-filter, computed from cumulative sums.
+
+Silence trimming removes leading silence and the dead air engines leave at
+the end (Pocket TTS frames after EOS, Parkiet running to max_new_tokens).
+Frames whose RMS is below an absolute floor, or far below the loudest frame,
+count as silent; a short pad is kept on both sides. Streams hold back long
+pauses until speech resumes and drop them if it does not.
+"""
+import functools
+import math
+import threading
+
+import numpy as np
+
+from audio_buffer import AudioBuffer
+
+TAPS_PER_PHASE = 32        # Input samples each output sample is computed from
+KAISER_BETA = 8.6          # ~80 dB stopband
+ROLLOFF = 0.94             # Passband edge as a fraction of the lower Nyquist frequency
+PHASE_LOOP_MIN_ROWS = 16   # Outputs per phase above which a chunk is processed phase by phase
+
+DEFAULT_SAMPLE_RATE = 48000
+DEFAULT_TARGET_LOUDNESS = -20.0  # dB, gated (close to LUFS for speech)
+MAX_GAIN_DB = 20.0
+PEAK_CEILING = 0.99
+BLOCK_SECONDS = 0.4
+BLOCK_HOP_SECONDS = 0.1
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# Silence trimming defaults (overridable per engine)
+TRIM_DEFAULTS = {
+    "threshold_db": -50.0,   # Frames below this RMS (dBFS) are silent
+    "relative_db": -40.0,    # ... and so are frames this far below the loudest one
+    "frame_ms": 10,
+    "lead_ms": 30,           # Kept before the first voiced frame
+    "tail_ms": 150,          # Kept after the last voiced frame
+}
+
+
+@functools.lru_cache(maxsize=None)
+def polyphase_filter(up, down):
+    """
+    Returns (phases, delay): phases is an (up, taps) matrix whose row p holds
+    the filter taps for output samples with phase p, reversed so it can be
+    dotted with the input window ending at the current sample; delay is the
+    filter's group delay in output samples.
+    """
+    half = TAPS_PER_PHASE * max(1, math.ceil(down / up)) * up // 2
+    cutoff = ROLLOFF * 0.5 / max(up, down)  # Cycles per sample of the upsampled signal
+    t = np.arange(-half, half + 1)
+    h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(len(t), KAISER_BETA) * up
+    # Pad so the centre tap lands on an output sample (an integer delay) and the length splits into phases
+    front = -half % down
+    taps = -(-(front + len(h)) // up)
+    h = np.concatenate([np.zeros(front), h, np.zeros(taps * up - front - len(h))])
+    phases = h.reshape(taps, up).T[:, ::-1]
+    return np.ascontiguousarray(phases, dtype=np.float32), (front + half) // down
+
+
+class Resampler:
+    """
+    Streaming polyphase resampler from `source_rate` to `target_rate`.
+
+    Feed chunks with process() and call flush() at the end; the output is
+    aligned (the filter delay is removed) and has round(n * target / source)
+    samples in total.
+    """
+
+    def __init__(self, source_rate, target_rate):
+        divisor = math.gcd(int(source_rate), int(target_rate))
+        self.up = int(target_rate) // divisor
+        self.down = int(source_rate) // divisor
+        self.source_rate, self.target_rate = int(source_rate), int(target_rate)
+        self.passthrough = self.up == self.down
+        if self.passthrough:
+            return
+        self.phases, self._delay = polyphase_filter(self.up, self.down)
+        self.taps = self.phases.shape[1]
+        self._history = np.zeros(self.taps - 1, dtype=np.float32)
+        self._consumed = 0       # Input samples seen
+        self._produced = 0       # Output samples computed (including the delay)
+        self._emitted = 0        # Output samples returned
+
+    def process(self, samples):
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        if self.passthrough or not len(samples):
+            return samples
+        total = self._consumed + len(samples)
+        end = -(-total * self.up // self.down)  # First output that needs a sample we do not have yet
+        buffer = np.concatenate([self._history, samples])
+        windows = np.lib.stride_tricks.sliding_window_view(buffer, self.taps)
+        count = max(0, end - self._produced)
+        if count >= self.up * PHASE_LOOP_MIN_ROWS:
+            # Outputs `up` apart share a phase and read windows `down` input samples
+            # apart, so each phase is one matrix-vector product over a strided view
+            out = np.empty(count, dtype=np.float32)
+            for offset in range(self.up):
+                position = (self._produced + offset) * self.down
+                row = position // self.up - self._consumed  # Window start, relative to the history
+                rows = len(range(offset, count, self.up))
+                out[offset::self.up] = windows[row::self.down][:rows] @ self.phases[position % self.up]
+        else:
+            # Short chunks with many phases: gather every window and its phase at once
+            position = np.arange(self._produced, end) * self.down
+            rows = position // self.up - self._consumed
+            out = np.einsum("ij,ij->i", windows[rows], self.phases[position % self.up])
+
+        self._history = buffer[len(buffer) - (self.taps - 1):]
+        self._consumed = total
+        self._produced = end
+        skip = max(0, min(len(out), self._delay - self._emitted))
+        self._emitted += len(out)
+        return out[skip:]
+
+    def flush(self):
+        """Push the filter tail out. Returns the remaining samples."""
+        if self.passthrough:
+            return np.zeros(0, dtype=np.float32)
+        expected = int(round(self._consumed * self.up / self.down))
+        returned = max(0, self._emitted - self._delay)
+        tail = self.process(np.zeros(-(-(self._delay + 1) * self.down // self.up) + 1, dtype=np.float32))
+        return tail[:max(0, expected - returned)]
+
+
+def resample(audio, target_rate):
+    """AudioBuffer at `target_rate` (the same object if it already is)."""
+    if audio.sample_rate == target_rate:
+        return audio
+    resampler = Resampler(audio.sample_rate, target_rate)
+    samples = np.concatenate([resampler.process(audio.samples), resampler.flush()])
+    return AudioBuffer(samples, target_rate)
+
+
+# --- Loudness ---
+
+def _block_powers(samples, sample_rate):
+    """Mean square of each 400 ms block (100 ms hop); one block for shorter inputs."""
+    block = int(BLOCK_SECONDS * sample_rate)
+    if len(samples) <= block:
+        return np.array([np.mean(np.square(samples, dtype=np.float64))]) if len(samples) else np.zeros(0)
+    hop = int(BLOCK_HOP_SECONDS * sample_rate)
+    cumulative = np.concatenate([[0.0], np.cumsum(np.square(samples, dtype=np.float64))])
+    starts = np.arange(0, len(samples) - block + 1, hop)
+    return (cumulative[starts + block] - cumulative[starts]) / block
+
+
+def _gated_loudness(powers):
+    """Two-stage gated loudness in dB of a set of block powers (None if all silent)."""
+    with np.errstate(divide="ignore"):
+        levels = 10 * np.log10(powers)
+    powers = powers[levels > ABSOLUTE_GATE]
+    if not len(powers):
+        return None
+    relative = 10 * np.log10(powers.mean()) + RELATIVE_GATE
+    powers = powers[10 * np.log10(powers) > relative]
+    return float(10 * np.log10(powers.mean()))
+
+
+def loudness(samples, sample_rate):
+    """Gated loudness of `samples` in dB (None for silence)."""
+    return _gated_loudness(_block_powers(np.asarray(samples, dtype=np.float32), sample_rate))
+
+
+class LoudnessNormalizer:
+    """
+    Gain towards `target` dB with a peak ceiling.
+
+    normalize() measures a whole buffer. For streams, process() bases the
+    gain on everything seen so far and ramps from the previous gain across
+    each chunk, so the level settles within the first second without clicks.
+    """
+
+    def __init__(self, sample_rate, target=DEFAULT_TARGET_LOUDNESS, max_gain_db=MAX_GAIN_DB):
+        self.sample_rate = sample_rate
+        self.target = target
+        self.max_gain_db = max_gain_db
+        self._powers = np.zeros(0)
+        self._pending = np.zeros(0, dtype=np.float32)  # Tail not yet covered by a full block
+        self._gain = None
+
+    def _gain_for(self, level, peak):
+        if level is None:
+            return 1.0
+        gain_db = float(np.clip(self.target - level, -self.max_gain_db, self.max_gain_db))
+        gain = 10 ** (gain_db / 20)
+        if peak * gain > PEAK_CEILING:
+            gain = PEAK_CEILING / peak
+        return gain
+
+    def normalize(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        if not len(samples):
+            return samples
+        gain = self._gain_for(loudness(samples, self.sample_rate), float(np.abs(samples).max()))
+        return samples * np.float32(gain)
+
+    def process(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        if not len(samples):
+            return samples
+        # Blocks over the stream so far; keep the samples after the last whole hop for next time
+        hop = int(BLOCK_HOP_SECONDS * self.sample_rate)
+        block = int(BLOCK_SECONDS * self.sample_rate)
+        pending = np.concatenate([self._pending, samples])
+        if len(pending) >= block:
+            powers = _block_powers(pending, self.sample_rate)
+            self._powers = np.concatenate([self._powers, powers])
+            self._pending = pending[len(powers) * hop:]
+            level = _gated_loudness(self._powers)
+        else:
+            self._pending = pending
+            level = _gated_loudness(np.concatenate([self._powers, _block_powers(pending, self.sample_rate)]))
+
+        # The ceiling uses this chunk's peak; earlier chunks are already out
+        target_gain = self._gain_for(level, float(np.abs(samples).max()))
+        start_gain = target_gain if self._gain is None else self._gain
+        self._gain = target_gain
+        ramp = np.linspace(start_gain, target_gain, len(samples), dtype=np.float32)
+        return samples * ramp
+
+
+# --- Silence ---
+
+def _frame_levels(samples, frame):
+    """RMS level in dB of each `frame`-sample frame (the last one may be partial)."""
+    count = -(-len(samples) // frame)
+    padded = np.zeros(count * frame, dtype=np.float32)
+    padded[:len(samples)] = samples
+    power = np.square(padded.reshape(count, frame), dtype=np.float64).sum(axis=1)
+    power /= np.minimum(frame, len(samples) - np.arange(count) * frame)
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10(power)
+
+
+def _voiced(levels, threshold_db, relative_db, peak):
+    return levels > max(threshold_db, peak + relative_db)
+
+
+def trim_silence(samples, sample_rate, threshold_db=TRIM_DEFAULTS["threshold_db"],
+                 relative_db=TRIM_DEFAULTS["relative_db"], frame_ms=TRIM_DEFAULTS["frame_ms"],
+                 lead_ms=TRIM_DEFAULTS["lead_ms"], tail_ms=TRIM_DEFAULTS["tail_ms"]):
+    """
+    Remove leading and trailing silence from a whole buffer.
+
+    Returns:
+        tuple: (samples, leading samples removed, trailing samples removed).
+               Audio with no voiced frame at all is returned unchanged.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    if not len(samples):
+        return samples, 0, 0
+    levels = _frame_levels(samples, frame)
+    voiced = np.flatnonzero(_voiced(levels, threshold_db, relative_db, levels.max()))
+    if not len(voiced):
+        return samples, 0, 0
+    start = max(0, voiced[0] * frame - int(sample_rate * lead_ms / 1000))
+    end = min(len(samples), (voiced[-1] + 1) * frame + int(sample_rate * tail_ms / 1000))
+    return samples[start:end], start, len(samples) - end
+
+
+class SilenceTrimmer:
+    """
+    Streaming counterpart of trim_silence(). process() returns the audio that
+    can be released so far; flush() ends the stream and drops the held-back
+    trailing silence. Pauses up to `tail_ms` pass through immediately; longer
+    ones are delayed until speech resumes.
+    """
+
+    def __init__(self, sample_rate, threshold_db=TRIM_DEFAULTS["threshold_db"],
+                 relative_db=TRIM_DEFAULTS["relative_db"], frame_ms=TRIM_DEFAULTS["frame_ms"],
+                 lead_ms=TRIM_DEFAULTS["lead_ms"], tail_ms=TRIM_DEFAULTS["tail_ms"]):
+        self.threshold_db = threshold_db
+        self.relative_db = relative_db
+        self.frame = max(1, int(sample_rate * frame_ms / 1000))
+        self.lead = int(sample_rate * lead_ms / 1000)
+        self.tail = int(sample_rate * tail_ms / 1000)
+        self._peak = -np.inf
+        self._started = False
+        self._partial = np.zeros(0, dtype=np.float32)  # Samples short of a whole frame
+        self._before = np.zeros(0, dtype=np.float32)   # Latest silence before speech (up to `lead`)
+        self._held = []                                # Silence beyond `tail` since the last voiced frame
+        self._silent_run = 0
+        self.leading_removed = 0
+        self.trailing_removed = 0
+
+    def process(self, samples, final=False):
+        data = np.concatenate([self._partial, np.asarray(samples, dtype=np.float32).reshape(-1)])
+        usable = len(data) if final else len(data) - len(data) % self.frame
+        self._partial, data = data[usable:], data[:usable]
+        if not len(data):
+            return data
+        levels = _frame_levels(data, self.frame)
+        self._peak = max(self._peak, float(levels.max()))
+        voiced = np.flatnonzero(_voiced(levels, self.threshold_db, self.relative_db, self._peak))
+
+        out = []
+        if not self._started:
+            if not len(voiced):
+                before = np.concatenate([self._before, data])
+                self.leading_removed += max(0, len(before) - self.lead)
+                self._before = before[len(before) - min(len(before), self.lead):]
+                return np.zeros(0, dtype=np.float32)
+            start = voiced[0] * self.frame
+            before = np.concatenate([self._before, data[:start]])
+            self.leading_removed += max(0, len(before) - self.lead)
+            out.append(before[len(before) - min(len(before), self.lead):])
+            data, voiced = data[start:], voiced - voiced[0]
+            self._started = True
+
+        if len(voiced):
+            speech_end = min(len(data), (voiced[-1] + 1) * self.frame)
+            out.extend(self._held)
+            out.append(data[:speech_end])
+            self._held, self._silent_run = [], 0
+            data = data[speech_end:]
+        # Trailing silence: the first `tail` samples of a pause go out now, the rest waits
+        passed = max(0, min(len(data), self.tail - self._silent_run))
+        out.append(data[:passed])
+        if len(data) > passed:
+            self._held.append(data[passed:])
+        self._silent_run += len(data)
+        return np.concatenate(out)
+
+    def flush(self):
+        """End of stream: returns the last samples and drops the pending silence."""
+        out = self.process(np.zeros(0, dtype=np.float32), final=True)
+        if not self._started:
+            self.leading_removed += len(self._before)
+        self.trailing_removed += sum(len(part) for part in self._held)
+        self._held = []
+        return out
+
+
+# --- Stage ---
+
+class AudioPostprocessor:
+    """
+    Trim silence per engine, resample to `sample_rate` and normalize to
+    `target_loudness` (None to skip either step).
+
+    Args:
+        trim: TRIM_DEFAULTS overrides plus an optional "engines" mapping of
+              per-engine overrides; {"enabled": false} at either level turns
+              trimming off. None disables it everywhere.
+    """
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, target_loudness=DEFAULT_TARGET_LOUDNESS, trim=None):
+        self.sample_rate = sample_rate
+        self.target_loudness = target_loudness
+        self.trim_config = trim
+        self._lock = threading.Lock()
+        self._trim_stats = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from a {"enabled", "sample_rate", "target_loudness", "trim"} block, or None if disabled."""
+        if not config or not config.get("enabled", True):
+            return None
+        return cls(config.get("sample_rate", DEFAULT_SAMPLE_RATE),
+                   config.get("target_loudness", DEFAULT_TARGET_LOUDNESS),
+                   config.get("trim", {}))
+
+    def output_rate(self, sample_rate):
+        return self.sample_rate or sample_rate
+
+    def trim_settings(self, engine):
+        """trim_silence() keyword arguments for `engine`, or None if it is not trimmed."""
+        if self.trim_config is None:
+            return None
+        settings = dict(TRIM_DEFAULTS)
+        for layer in (self.trim_config, (self.trim_config.get("engines") or {}).get(engine, {})):
+            if not layer.get("enabled", True):
+                return None
+            settings.update((key, value) for key, value in layer.items() if key in TRIM_DEFAULTS)
+        return settings
+
+    def _record_trim(self, engine, sample_rate, total, leading, trailing):
+        with self._lock:
+            stats = self._trim_stats.setdefault(engine, {"clips": 0, "input_seconds": 0.0,
+                                                         "leading_seconds": 0.0, "trailing_seconds": 0.0})
+            stats["clips"] += 1
+            stats["input_seconds"] += total / sample_rate
+            stats["leading_seconds"] += leading / sample_rate
+            stats["trailing_seconds"] += trailing / sample_rate
+
+    def trim(self, audio, engine=None):
+        """AudioBuffer without the leading/trailing silence `engine`'s settings allow removing."""
+        settings = self.trim_settings(engine)
+        if audio is None or settings is None:
+            return audio
+        samples, leading, trailing = trim_silence(audio.samples, audio.sample_rate, **settings)
+        self._record_trim(engine, audio.sample_rate, len(audio), leading, trailing)
+        if not leading and not trailing:
+            return audio
+        return AudioBuffer(samples, audio.sample_rate)
+
+    def stats(self):
+        """Per-engine trimming totals: clips, input seconds and seconds removed at each end."""
+        with self._lock:
+            return {
+                engine: {key: round(value, 3) for key, value in stats.items()}
+                for engine, stats in self._trim_stats.items()
+            }
+
+    def process(self, audio):
+        """Whole AudioBuffer in, resampled and normalized AudioBuffer out (call trim() first)."""
+        if audio is None:
+            return None
+        if self.sample_rate:
+            audio = resample(audio, self.sample_rate)
+        if self.target_loudness is not None:
+            normalizer = LoudnessNormalizer(audio.sample_rate, self.target_loudness)
+            audio = AudioBuffer(normalizer.normalize(audio.samples), audio.sample_rate)
+        return audio
+
+    def stream(self, chunks, sample_rate, engine=None):
+        """Generator of trimmed and processed chunks at output_rate(sample_rate)."""
+        settings = self.trim_settings(engine)
+        trimmer = SilenceTrimmer(sample_rate, **settings) if settings is not None else None
+        resampler = Resampler(sample_rate, self.output_rate(sample_rate))
+        normalizer = None
+        if self.target_loudness is not None:
+            normalizer = LoudnessNormalizer(resampler.target_rate, self.target_loudness)
+
+        def finish(samples):
+            out = resampler.process(samples)
+            return normalizer.process(out) if normalizer and len(out) else out
+
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+            out = finish(trimmer.process(chunk) if trimmer else chunk)
+            if len(out):
+                yield out
+        if trimmer:
+            out = finish(trimmer.flush())
+            if len(out):
+                yield out
+            self._record_trim(engine, sample_rate, total, trimmer.leading_removed, trimmer.trailing_removed)
+        tail = resampler.flush()
+        if len(tail):
+            yield normalizer.process(tail) if normalizer else tail
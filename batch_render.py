@@ -0,0 +1,230 @@
+"""
+Bulk offline rendering for Erika-tts.py (--batch input.jsonl).
+
+Each input line is a JSON object:
+    {"text": "...", "voice": "alba", "lang": "en", "output": "greeting.wav"}
+Only "text" is required; voice and lang fall back to the settings and output
+defaults to the line number. The output extension (.wav, .flac, .opus)
+selects the format, otherwise the settings' output_format is used.
+
+Jobs are spread over a process pool. Every worker limits torch to the two
+threads Pocket TTS needs and loads its models once. Finished jobs are
+appended to a manifest in the output folder, so rerunning the same command
+after an interruption only renders what is still missing.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from audio_buffer import AudioBuffer
+from audio_encoding import encode, format_for_path, with_extension
+
+MANIFEST_FILE = "manifest.jsonl"
+THREADS_PER_WORKER = 2  # Pocket TTS runs best on two cores
+
+_worker_settings = None
+
+
+def default_workers():
+    """One worker per THREADS_PER_WORKER cores."""
+    return max(1, (os.cpu_count() or THREADS_PER_WORKER) // THREADS_PER_WORKER)
+
+
+def job_key(job):
+    """Identity of a job's audio; a changed text, voice or language is rendered again."""
+    payload = json.dumps({k: job.get(k) for k in ("text", "voice", "lang")}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def load_jobs(input_path, default_voice, default_lang, detect_language, output_format="wav"):
+    """
+    Parse the JSONL input.
+
+    Returns:
+        list: Job dicts with text, voice, lang ("en"/"nl") and output filename
+    """
+    jobs = []
+    outputs = set()
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{input_path}:{line_number}: invalid JSON ({e})")
+            text = (entry.get("text") or "").strip()
+            if not text:
+                raise ValueError(f"{input_path}:{line_number}: missing text")
+
+            lang = (entry.get("lang") or default_lang or "auto").lower()
+            if lang == "auto":
+                lang = detect_language(text)
+
+            output = with_extension(entry.get("output") or f"line_{line_number:05d}", output_format)
+            if output in outputs:
+                raise ValueError(f"{input_path}:{line_number}: duplicate output name '{output}'")
+            outputs.add(output)
+
+            jobs.append({
+                "text": text,
+                "voice": entry.get("voice") or default_voice,
+                "lang": lang,
+                "output": output,
+            })
+    return jobs
+
+
+def read_manifest(manifest_path):
+    """Map output name -> job key of every job the manifest records as done."""
+    done = {}
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Torn last line from an interrupted run
+            if record.get("status") == "done":
+                done[record["output"]] = record.get("key")
+            else:
+                done.pop(record.get("output"), None)
+    return done
+
+
+def _append_manifest(manifest_file, record):
+    manifest_file.write(json.dumps(record) + "\n")
+    manifest_file.flush()
+    os.fsync(manifest_file.fileno())
+
+
+# --- Worker process ---
+
+def _init_worker(settings, preload_langs):
+    global _worker_settings
+    # Must be set before torch is imported in this process
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(THREADS_PER_WORKER)
+
+    import torch
+    torch.set_num_threads(THREADS_PER_WORKER)
+    torch.set_num_interop_threads(1)
+
+    import tts_engines
+    _worker_settings = settings
+    # Load the models once per worker, not once per job
+    if "en" in preload_langs:
+        tts_engines.get_english_sample_rate(settings)
+    if "nl" in preload_langs:
+        import parkiet_engine
+        if parkiet_engine.is_available():
+            parkiet_settings = settings.get("parkiet_settings", {})
+            parkiet_engine._load_model(parkiet_settings.get("device", "cuda"), parkiet_settings.get("quantization"))
+
+
+def _render_job(job, output_path):
+    import soundfile as sf
+    import tts_engines
+
+    start = time.perf_counter()
+    tmp_path = f"{output_path}.{os.getpid()}.tmp.wav"
+    try:
+        if job["lang"] == "nl":
+            success = tts_engines.generate_dutch(job["text"], _worker_settings, tmp_path)
+        else:
+            success = tts_engines.generate_english(job["text"], _worker_settings, job["voice"], tmp_path)
+        if not success or not os.path.exists(tmp_path):
+            raise RuntimeError("Generation produced no file")
+        audio_seconds = sf.info(tmp_path).duration
+        output_format = format_for_path(output_path, "wav")
+        if output_format != "wav":
+            # The pool already runs jobs in parallel, so encode right here
+            encoded_path = f"{output_path}.{os.getpid()}.tmp"
+            encode(AudioBuffer.from_file(tmp_path), encoded_path, output_format)
+            os.replace(encoded_path, output_path)
+        else:
+            # Only complete files ever appear under the final name
+            os.replace(tmp_path, output_path)
+    finally:
+        for path in (tmp_path, f"{output_path}.{os.getpid()}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+    return {"seconds": round(time.perf_counter() - start, 3), "audio_seconds": round(audio_seconds, 3)}
+
+
+# --- Driver ---
+
+def render_batch(input_path, settings, output_dir, workers=None, detect_language=None):
+    """
+    Render every line of `input_path` into `output_dir`, skipping jobs the
+    manifest already records as done.
+
+    Returns:
+        bool: True if every job is done
+    """
+    jobs = load_jobs(
+        input_path,
+        settings.get("default_voice"),
+        settings.get("default_language", "auto"),
+        detect_language or (lambda text: "en"),
+        settings.get("output_format", "wav"),
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    done = read_manifest(manifest_path)
+
+    pending = [
+        job for job in jobs
+        if done.get(job["output"]) != job_key(job)
+        or not os.path.exists(os.path.join(output_dir, job["output"]))
+    ]
+    print(f"Batch: {len(jobs)} job(s), {len(jobs) - len(pending)} already done, {len(pending)} to render")
+    if not pending:
+        return True
+
+    workers = max(1, min(workers or default_workers(), len(pending)))
+    preload_langs = sorted({job["lang"] for job in pending})
+    print(f"Starting {workers} worker(s), {THREADS_PER_WORKER} threads each")
+
+    failures = 0
+    completed = 0
+    start = time.perf_counter()
+    # Spawned workers start clean instead of inheriting the parent's threads
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                   initializer=_init_worker, initargs=(settings, preload_langs))
+    try:
+        with open(manifest_path, "a", encoding="utf-8") as manifest_file:
+            futures = {
+                executor.submit(_render_job, job, os.path.join(output_dir, job["output"])): job
+                for job in pending
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                completed += 1
+                record = {"output": job["output"], "key": job_key(job), "lang": job["lang"]}
+                try:
+                    record.update(future.result())
+                    record["status"] = "done"
+                    print(f"[{completed}/{len(pending)}] {job['output']} "
+                          f"({record['audio_seconds']:.1f}s audio in {record['seconds']:.1f}s)")
+                except Exception as e:
+                    failures += 1
+                    record.update(status="failed", error=str(e))
+                    print(f"[{completed}/{len(pending)}] {job['output']} FAILED: {e}")
+                _append_manifest(manifest_file, record)
+    except KeyboardInterrupt:
+        print("\nInterrupted. Run the same command again to resume.")
+        executor.shutdown(wait=False, cancel_futures=True)
+        return False
+    executor.shutdown()
+
+    elapsed = time.perf_counter() - start
+    print(f"\nBatch finished: {completed - failures} rendered, {failures} failed in {elapsed:.1f}s")
+    print(f"Manifest: {manifest_path}")
+    return failures == 0
@@ -0,0 +1,179 @@
+"""
+Micro-batching scheduler in front of TTSEngineHandler.
+
+Requests with the same language config (engine, voice and all other
+settings) that arrive within a short window are collected and generated with
+one batched call (see TTSEngineHandler.generate_speech_batch) instead of one
+forward pass each. The first request of a batch waits at most `window_ms` for
+others to join, so a request that ends up alone pays up to `window_ms` of
+added latency (reported as mean/max_added_latency_ms in stats()); a full
+batch is dispatched immediately. With `max_batch_size` 1 batching is off and
+requests go straight to the handler.
+
+Batches run on their own thread, so a cancelled request returns right away
+even when it opened the batch or other requests in it are still generating.
+"""
+import collections
+import contextvars
+import json
+import logging
+import threading
+import time
+
+from cancellation import CancelToken, Cancelled, check as check_cancelled
+from request_scheduler import RequestSchedule
+from tts_engine_handler import BATCHED_ENGINES
+
+
+class _Request:
+    def __init__(self, text, cancel=None, schedule=None):
+        self.text = text
+        self.cancel = cancel
+        self.schedule = schedule
+        self.submitted_at = time.perf_counter()
+        self.result = None
+        self.done = threading.Event()
+
+
+class _Batch:
+    def __init__(self):
+        self.requests = []
+        self.full = threading.Event()
+
+
+class MicroBatchScheduler:
+    """
+    Drop-in wrapper for TTSEngineHandler that batches concurrent generate_speech calls.
+
+    All other handler methods (is_cached, stream_speech, ...) are passed through.
+    """
+
+    def __init__(self, engine_handler, window_ms=20, max_batch_size=8):
+        self.engine_handler = engine_handler
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending = {}  # (base_dir, language config) -> _Batch
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.batch_sizes = collections.Counter()
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @classmethod
+    def from_config(cls, engine_handler, batching_config):
+        """Wrap `engine_handler` per a {"enabled", "window_ms", "max_batch_size"} block, or None if disabled."""
+        if not batching_config or not batching_config.get("enabled", True):
+            return None
+        return cls(
+            engine_handler,
+            window_ms=batching_config.get("window_ms", 20),
+            max_batch_size=batching_config.get("max_batch_size", 8),
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.engine_handler, name)
+
+    def generate_speech(self, text, config, base_dir, cancel=None, schedule=None, fallback=True):
+        """
+        Same contract as TTSEngineHandler.generate_speech; may wait up to the
+        window for a batch. A cancelled request raises Cancelled at once; the
+        batch itself is only stopped once all of its requests are cancelled.
+        A batch is scheduled with the highest priority and earliest deadline
+        of its requests.
+        """
+        engine = config.get("engine")
+        if engine not in BATCHED_ENGINES or self.max_batch_size == 1 or self.engine_handler.is_cached(text, config):
+            return self.engine_handler.generate_speech(text, config, base_dir, cancel, schedule, fallback)
+
+        # Only requests with an identical config share a batch, which runs with that config
+        key = (base_dir, json.dumps(config, sort_keys=True, default=str))
+        request = _Request(text, cancel, schedule)
+        with self._lock:
+            batch = self._pending.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = self._pending[key] = _Batch()
+            batch.requests.append(request)
+            if len(batch.requests) >= self.max_batch_size:
+                del self._pending[key]
+                batch.full.set()
+
+        # The first caller of a batch starts its dispatcher; it keeps the
+        # caller's context so the batch's stage timings go to its trace
+        if is_leader:
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._dispatch, key, batch, config, base_dir),
+                             name="micro-batch", daemon=True).start()
+
+        unregister = cancel.on_cancel(request.done.set) if cancel is not None else None
+        try:
+            request.done.wait()
+        finally:
+            if unregister is not None:
+                unregister()
+        check_cancelled(cancel)
+        # Batches run without fallbacks, so each caller decides on its own
+        if request.result is None and fallback:
+            return self.engine_handler.get_fallback(config, base_dir)
+        return request.result
+
+    def _dispatch(self, key, batch, config, base_dir):
+        # Wait out the window (or until the batch is full), then run it for everyone
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+        self._run_batch(batch, config, base_dir)
+
+    def _run_batch(self, batch, config, base_dir):
+        # Requests cancelled while the window was open are not generated at all
+        for request in batch.requests:
+            if request.cancel is not None and request.cancel.cancelled:
+                request.done.set()
+        requests = [request for request in batch.requests if not request.done.is_set()]
+        if not requests:
+            return
+        cancel = CancelToken.all_of([request.cancel for request in requests])
+        schedule = RequestSchedule.merge([request.schedule for request in requests])
+        dispatched_at = time.perf_counter()
+        waits = [dispatched_at - request.submitted_at for request in requests]
+        with self._lock:
+            self.requests += len(requests)
+            self.batches += 1
+            self.batch_sizes[len(requests)] += 1
+            self.total_wait += sum(waits)
+            self.max_wait = max(self.max_wait, max(waits))
+
+        logging.info(f"Dispatching batch of {len(requests)} for {config.get('engine')} "
+                     f"(waited up to {max(waits) * 1000:.1f} ms)")
+        try:
+            if len(requests) == 1:
+                results = [self.engine_handler.generate_speech(requests[0].text, config, base_dir, cancel, schedule,
+                                                               fallback=False)]
+            else:
+                results = self.engine_handler.generate_speech_batch(
+                    [request.text for request in requests], config, base_dir, cancel, schedule, fallback=False)
+        except Cancelled:
+            logging.info(f"Batch of {len(requests)} cancelled")
+            results = [None] * len(requests)
+        except Exception as e:
+            logging.error(f"Batched generation failed: {e}")
+            results = [None] * len(requests)
+        finally:
+            logging.info(f"Batching stats: {self.stats()}")
+
+        for index, request in enumerate(requests):
+            request.result = results[index] if index < len(results) else None
+            request.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "mean_added_latency_ms": self.total_wait / self.requests * 1000 if self.requests else 0.0,
+                "max_added_latency_ms": self.max_wait * 1000,
+            }
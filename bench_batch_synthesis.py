@@ -0,0 +1,106 @@
+"""
+Throughput benchmark: batched synthesis vs. the one-at-a-time loop.
+
+Usage:
+    python bench_batch_synthesis.py --lang en --count 8
+    python bench_batch_synthesis.py --lang nl --count 4 --device cpu
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import tts_engines
+
+SENTENCES = {
+    "en": [
+        "The quick brown fox jumps over the lazy dog.",
+        "Please remember to water the plants before you leave.",
+        "The meeting has been moved to Thursday afternoon.",
+        "It is going to rain later today, so bring an umbrella.",
+        "Your build finished successfully in forty two seconds.",
+        "I found three results that match your search.",
+        "Dinner is ready, come downstairs.",
+        "The train to Amsterdam departs from platform five.",
+    ],
+    "nl": [
+        "Goedemorgen, dit is een test van het Nederlandse spraaksysteem.",
+        "Vergeet niet de planten water te geven voordat je vertrekt.",
+        "De vergadering is verplaatst naar donderdagmiddag.",
+        "Het gaat later vandaag regenen, dus neem een paraplu mee.",
+        "De trein naar Amsterdam vertrekt van spoor vijf.",
+        "Ik heb drie resultaten gevonden die bij je zoekopdracht passen.",
+        "Het eten is klaar, kom naar beneden.",
+        "Je build is in tweeënveertig seconden geslaagd.",
+    ],
+}
+
+
+def _audio_seconds(path):
+    import soundfile as sf
+    return sf.info(path).duration
+
+
+def run_sequential(texts, lang, settings, voice, output_dir):
+    start = time.perf_counter()
+    audio_seconds = 0.0
+    for index, text in enumerate(texts):
+        path = os.path.join(output_dir, f"seq_{index}.wav")
+        if lang == "nl":
+            ok = tts_engines.generate_dutch(text, settings, path)
+        else:
+            ok = tts_engines.generate_english(text, settings, voice, path)
+        if ok:
+            audio_seconds += _audio_seconds(path)
+    return time.perf_counter() - start, audio_seconds
+
+
+def run_batched(texts, lang, settings, voice, batch_size):
+    start = time.perf_counter()
+    if lang == "nl":
+        results = tts_engines.generate_dutch_batch(texts, settings)
+        sample_rate = 44100
+    else:
+        results = tts_engines.generate_english_batch(texts, settings, voice, max_batch_size=batch_size)
+        sample_rate = tts_engines.get_english_sample_rate(settings)
+    elapsed = time.perf_counter() - start
+    audio_seconds = sum(len(audio) / sample_rate for audio in results if audio is not None)
+    return elapsed, audio_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batched and sequential synthesis throughput")
+    parser.add_argument("--lang", choices=["en", "nl"], default="en")
+    parser.add_argument("--count", type=int, default=8, help="Number of utterances")
+    parser.add_argument("--batch-size", type=int, default=tts_engines.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--voice", default=None, help="Pocket TTS voice (English only)")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    sentences = SENTENCES[args.lang]
+    texts = [sentences[i % len(sentences)] for i in range(args.count)]
+    settings = {
+        "generation_settings": {"device": args.device},
+        "parkiet_settings": {"device": args.device},
+    }
+
+    # Warm up so model loading is not part of either measurement
+    print("Warming up...")
+    with tempfile.TemporaryDirectory() as output_dir:
+        run_sequential(texts[:1], args.lang, settings, args.voice, output_dir)
+
+        print(f"\n=== Sequential ({args.count} utterances) ===")
+        seq_time, seq_audio = run_sequential(texts, args.lang, settings, args.voice, output_dir)
+
+    print(f"\n=== Batched ({args.count} utterances, batch size {args.batch_size}) ===")
+    batch_time, batch_audio = run_batched(texts, args.lang, settings, args.voice, args.batch_size)
+
+    print("\n=== Results ===")
+    print(f"{'mode':<12}{'wall (s)':>10}{'audio (s)':>11}{'utt/s':>8}{'audio s/s':>11}")
+    for name, elapsed, audio in (("sequential", seq_time, seq_audio), ("batched", batch_time, batch_audio)):
+        print(f"{name:<12}{elapsed:>10.2f}{audio:>11.2f}{args.count / elapsed:>8.2f}{audio / elapsed:>11.2f}")
+    print(f"\nSpeedup: {seq_time / batch_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Accuracy and latency benchmark: language_id vs. langdetect vs. the old
+substring heuristic, on the bundled language_id_corpus.tsv.
+
+Usage:
+    python bench_language_id.py
+    python bench_language_id.py --corpus my_corpus.tsv --repeat 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "language_id_corpus.tsv")
+LENGTH_BUCKETS = (("1-3 words", 1, 3), ("4-8 words", 4, 8), ("9+ words", 9, None))
+
+# The trigger list TTSInterpreter used before language_id
+SUBSTRING_TRIGGERS = ["hallo", "ik ben", " goed", " en ", " het ", " de ", " een "]
+
+
+def load_corpus(path):
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            lang, text = line.split("\t", 1)
+            samples.append((lang, text))
+    return samples
+
+
+def substring_detect(text):
+    lowered = text.lower()
+    return "nl" if any(trigger in lowered for trigger in SUBSTRING_TRIGGERS) else "en"
+
+
+def make_langdetect():
+    try:
+        from langdetect import DetectorFactory, detect
+    except ImportError:
+        return None
+    DetectorFactory.seed = 0
+
+    def langdetect_detect(text):
+        try:
+            lang = detect(text)
+        except Exception:
+            return "en"
+        return "nl" if lang in ("nl", "af") else "en"
+    return langdetect_detect
+
+
+def language_id_detect(text):
+    import language_id
+    return language_id.detect_language(text)[0]
+
+
+def cold_start(statement):
+    """Seconds for a fresh interpreter to import, load and classify once."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", statement], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start
+
+
+def evaluate(name, detect, samples, repeat):
+    detect(samples[0][1])  # Warm up (profile/table load)
+    predictions = [detect(text) for _, text in samples]
+
+    latencies = []
+    for _ in range(repeat):
+        for _, text in samples:
+            start = time.perf_counter()
+            detect(text)
+            latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+
+    correct = np.array([pred == lang for pred, (lang, _) in zip(predictions, samples)])
+    word_counts = np.array([len(text.split()) for _, text in samples])
+    row = {"name": name, "accuracy": correct.mean(),
+           "mean_ms": latencies.mean(), "p95_ms": np.percentile(latencies, 95)}
+    for label, low, high in LENGTH_BUCKETS:
+        mask = (word_counts >= low) & (word_counts <= (high or word_counts.max()))
+        row[label] = correct[mask].mean() if mask.any() else float("nan")
+    errors = [(lang, text) for ok, (lang, text) in zip(correct, samples) if not ok]
+    return row, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EN/NL language identification")
+    parser.add_argument("--corpus", default=CORPUS_FILE, help="TSV file with lang<TAB>text lines")
+    parser.add_argument("--repeat", type=int, default=10, help="Timing passes over the corpus")
+    parser.add_argument("--errors", action="store_true", help="List misclassified lines")
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus)
+    print(f"Corpus: {len(samples)} lines ({sum(lang == 'nl' for lang, _ in samples)} nl)\n")
+
+    detectors = [("language_id", language_id_detect,
+                  "import language_id; language_id.detect_language('Hallo')")]
+    langdetect_detect = make_langdetect()
+    if langdetect_detect:
+        detectors.append(("langdetect", langdetect_detect,
+                          "from langdetect import detect; detect('Hallo')"))
+    else:
+        print("langdetect not installed, skipping it\n")
+    detectors.append(("substring", substring_detect, None))
+
+    header = f"{'detector':<12} {'accuracy':>8} " + " ".join(f"{b[0]:>10}" for b in LENGTH_BUCKETS)
+    header += f" {'mean ms':>8} {'p95 ms':>8} {'cold s':>7}"
+    print(header)
+    print("-" * len(header))
+    all_errors = {}
+    for name, detect, statement in detectors:
+        row, all_errors[name] = evaluate(name, detect, samples, args.repeat)
+        cold = f"{cold_start(statement):7.2f}" if statement else f"{'-':>7}"
+        buckets = " ".join(f"{row[b[0]]:>10.1%}" for b in LENGTH_BUCKETS)
+        print(f"{name:<12} {row['accuracy']:>8.1%} {buckets} {row['mean_ms']:>8.3f} {row['p95_ms']:>8.3f} {cold}")
+
+    if args.errors:
+        for name, errors in all_errors.items():
+            print(f"\n{name} errors ({len(errors)}):")
+            for lang, text in errors:
+                print(f"  [{lang}] {text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Output format benchmark: file size and encode time of WAV, FLAC and Ogg/Opus.
+
+Encodes the given WAV files (by default everything in erika_tts_output/) in
+every format. Without input files, a synthetic voiced signal at the Pocket
+TTS (24 kHz) and Parkiet (44.1 kHz) rates is used; real speech compresses
+differently, so prefer real output when you have it.
+
+Usage:
+    python bench_output_formats.py
+    python bench_output_formats.py erika_tts_output/*.wav --runs 5
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from audio_buffer import AudioBuffer
+from audio_encoding import OUTPUT_FORMATS, encode
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_speech(sample_rate, seconds=10.0, seed=0):
+    """Harmonics of a wandering pitch with syllable-rate amplitude modulation and pauses."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t) + 10 * rng.standard_normal(len(t)).cumsum() / sample_rate
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 20))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) * (np.sin(2 * np.pi * 0.25 * t) > -0.5)
+    audio = voiced * envelope + 0.01 * rng.standard_normal(len(t))
+    return AudioBuffer(0.3 * audio / np.abs(audio).max(), sample_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark archive output formats")
+    parser.add_argument("inputs", nargs="*", help="WAV files (default: erika_tts_output/*.wav)")
+    parser.add_argument("--runs", type=int, default=3, help="Timed encodes per file and format")
+    args = parser.parse_args()
+
+    paths = args.inputs or sorted(glob.glob(os.path.join(SCRIPT_DIR, "erika_tts_output", "*.wav")))
+    if paths:
+        clips = [(os.path.basename(p), AudioBuffer.from_file(p)) for p in paths]
+    else:
+        print("No WAV files given or found in erika_tts_output/, using synthetic audio\n")
+        clips = [("synthetic 24 kHz", synthetic_speech(24000)), ("synthetic 44.1 kHz", synthetic_speech(44100))]
+
+    # Totals per (sample rate, format)
+    totals = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, audio in clips:
+            for output_format, (extension, _, _) in OUTPUT_FORMATS.items():
+                path = os.path.join(tmp_dir, "out" + extension)
+                encode(audio, path, output_format)  # Warm-up (library and resampler setup)
+                start = time.perf_counter()
+                for _ in range(args.runs):
+                    encode(audio, path, output_format)
+                seconds = (time.perf_counter() - start) / args.runs
+                row = totals.setdefault((audio.sample_rate, output_format), [0, 0.0, 0.0, 0])
+                row[0] += os.path.getsize(path)
+                row[1] += seconds
+                row[2] += audio.duration
+                row[3] += 1
+
+    print(f"{len(clips)} clip(s), {args.runs} run(s) each")
+    print(f"{'rate':>6} {'format':<6} {'clips':>5} {'KB':>9} {'ratio':>6} {'kbit/s':>7} {'encode ms':>10} {'x realtime':>10}")
+    for sample_rate in sorted({rate for rate, _ in totals}):
+        wav_bytes = totals[(sample_rate, "wav")][0]
+        for output_format in OUTPUT_FORMATS:
+            size, seconds, audio_seconds, count = totals[(sample_rate, output_format)]
+            print(f"{sample_rate:>6} {output_format:<6} {count:>5} {size / 1024:>9.1f} {size / wav_bytes:>6.1%} "
+                  f"{size * 8 / audio_seconds / 1000:>7.1f} {seconds * 1000:>10.1f} {audio_seconds / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Parkiet decode-loop benchmark: eager generation with the default growing KV
+cache vs. the fast_decode path (static KV cache + torch.compile'd step).
+
+Reports decoder steps (audio tokens per codebook) per second. The first fast
+call includes compilation unless ~/.cache/erika-tts/parkiet_compile/
+already holds the kernels, so it is reported separately from the warm runs.
+
+Usage:
+    python bench_parkiet_decode.py --device cpu
+    python bench_parkiet_decode.py --max-new-tokens 512 --runs 3 --quantization int8
+"""
+import argparse
+import time
+
+import parkiet_engine
+
+TEXT = "[S1] Goedemorgen, dit is een test van het Nederlandse spraaksysteem."
+
+
+def timed_generate(model, processor, max_new_tokens, fast):
+    import torch
+
+    inputs = processor(text=[TEXT], padding=True, return_tensors="pt").to(parkiet_engine._device)
+    kwargs = dict(parkiet_engine.DEFAULT_SETTINGS)
+    for key in ("device", "quantization", "fast_decode"):
+        kwargs.pop(key)
+    kwargs["max_new_tokens"] = max_new_tokens
+    if fast:
+        kwargs["cache_implementation"] = "static"
+    parkiet_engine._use_fast_decode(model, fast)
+
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    outputs = model.generate(**inputs, **kwargs)
+    seconds = time.perf_counter() - start
+    # Dia returns decoder audio codes only: (batch, steps, codebooks)
+    return outputs.shape[1], seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Parkiet eager vs. static-cache compiled decoding")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--quantization", default="none", help="none, int8 or bf16")
+    parser.add_argument("--max-new-tokens", type=int, default=1024)
+    parser.add_argument("--runs", type=int, default=2, help="Timed runs per mode after warm-up")
+    args = parser.parse_args()
+
+    if not parkiet_engine.is_available():
+        print("Parkiet dependencies not installed (pip install transformers soundfile torch)")
+        return
+
+    model, processor = parkiet_engine._load_model(args.device, args.quantization)
+    rows = []
+
+    # Eager: one untimed warm-up, then timed runs
+    timed_generate(model, processor, 16, fast=False)
+    eager = [timed_generate(model, processor, args.max_new_tokens, fast=False) for _ in range(args.runs)]
+    rows.append(("eager", None, eager))
+
+    start = time.perf_counter()
+    ready = parkiet_engine._enable_fast_decode(model, processor)
+    compile_seconds = time.perf_counter() - start
+    if ready:
+        fast = [timed_generate(model, processor, args.max_new_tokens, fast=True) for _ in range(args.runs)]
+        rows.append(("fast", compile_seconds, fast))
+    else:
+        print("Fast decode is not available with this model/torch build")
+
+    print(f"\n{args.device}, quantization {parkiet_engine._quantization}, max_new_tokens {args.max_new_tokens}")
+    print(f"{'mode':<6} {'warmup s':>9} {'steps':>6} {'seconds':>8} {'steps/s':>8} {'speedup':>8}")
+    baseline = None
+    for mode, warmup, runs in rows:
+        steps = sum(s for s, _ in runs)
+        seconds = sum(t for _, t in runs)
+        rate = steps / seconds
+        baseline = baseline or rate
+        warmup_text = f"{warmup:>9.1f}" if warmup is not None else f"{'-':>9}"
+        print(f"{mode:<6} {warmup_text} {steps // len(runs):>6} {seconds / len(runs):>8.2f} "
+              f"{rate:>8.1f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
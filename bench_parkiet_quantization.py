@@ -0,0 +1,144 @@
+"""
+Parkiet quantization benchmark: real-time factor of each quantization mode
+and how close its audio stays to the fp32 output.
+
+Sampled generation diverges as soon as one token differs, so the main
+similarity measure compares long-term log spectra (timbre and level). With
+--greedy the decoding is deterministic and the waveform correlation is
+meaningful as well.
+
+Usage:
+    python bench_parkiet_quantization.py --device cpu
+    python bench_parkiet_quantization.py --modes none,int8 --count 2 --greedy
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+import parkiet_engine
+from model_registry import PARKIET, registry as models
+
+SENTENCES = [
+    "Goedemorgen, dit is een test van het Nederlandse spraaksysteem.",
+    "Vergeet niet de planten water te geven voordat je vertrekt.",
+    "De vergadering is verplaatst naar donderdagmiddag.",
+    "Het eten is klaar, kom naar beneden.",
+]
+N_FFT = 2048
+HOP = 512
+BANDS = 64
+
+
+def long_term_spectrum(audio):
+    """Mean power per log-spaced frequency band, in dB."""
+    audio = np.asarray(audio, dtype=np.float32)
+    if len(audio) < N_FFT:
+        audio = np.pad(audio, (0, N_FFT - len(audio)))
+    frames = np.lib.stride_tricks.sliding_window_view(audio, N_FFT)[::HOP] * np.hanning(N_FFT)
+    power = (np.abs(np.fft.rfft(frames, axis=-1)) ** 2).mean(axis=0)
+    # Log-spaced band edges in FFT bins, from ~43 Hz up; unique() drops empty bands
+    edges = np.unique(np.geomspace(2, len(power), BANDS + 1).astype(int))
+    bands = [power[low:high].mean() for low, high in zip(edges[:-1], edges[1:])]
+    return 10 * np.log10(np.asarray(bands) + 1e-10)
+
+
+def spectral_similarity(reference, candidate):
+    """(cosine similarity of mean-removed dB spectra, log-spectral distance in dB)."""
+    a = long_term_spectrum(reference)
+    b = long_term_spectrum(candidate)
+    distance = float(np.sqrt(np.mean((a - b) ** 2)))
+    a, b = a - a.mean(), b - b.mean()
+    cosine = float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-10))
+    return cosine, distance
+
+
+def waveform_correlation(reference, candidate):
+    """Peak normalized cross-correlation over all lags (1.0 = identical up to a shift)."""
+    size = len(reference) + len(candidate) - 1
+    n = 1 << (size - 1).bit_length()
+    spectrum = np.fft.rfft(reference, n) * np.conj(np.fft.rfft(candidate, n))
+    peak = np.abs(np.fft.irfft(spectrum, n)).max()
+    return float(peak / (np.linalg.norm(reference) * np.linalg.norm(candidate) + 1e-10))
+
+
+def run_mode(mode, texts, device, seed, greedy):
+    import torch
+
+    models.unload(PARKIET)
+    cache_hit = mode != "none" and os.path.exists(parkiet_engine._quantized_cache_path(mode))
+    start = time.perf_counter()
+    parkiet_engine._load_model(device, mode)
+    load_seconds = time.perf_counter() - start
+    if parkiet_engine._quantization != mode:
+        return None  # Not supported here; _load_model fell back to full precision
+
+    settings = {"device": device, "quantization": mode}
+    if greedy:
+        settings["do_sample"] = False
+
+    outputs, generate_seconds = [], 0.0
+    for index, text in enumerate(texts):
+        torch.manual_seed(seed + index)
+        start = time.perf_counter()
+        audio = parkiet_engine.generate_dutch_speech_batch([text], settings=settings)[0]
+        generate_seconds += time.perf_counter() - start
+        outputs.append(audio)
+    audio_seconds = sum(len(a) for a in outputs if a is not None) / parkiet_engine.SAMPLE_RATE
+    return {
+        "load_seconds": load_seconds,
+        "cache_hit": cache_hit,
+        "generate_seconds": generate_seconds,
+        "audio_seconds": audio_seconds,
+        "outputs": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Parkiet quantization modes")
+    parser.add_argument("--modes", default="none,int8,bf16", help="Comma-separated modes; 'none' is the reference")
+    parser.add_argument("--count", type=int, default=len(SENTENCES), help="Sentences to generate per mode")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--greedy", action="store_true", help="Deterministic decoding (do_sample=False)")
+    args = parser.parse_args()
+
+    if not parkiet_engine.is_available():
+        print("Parkiet dependencies not installed (pip install transformers soundfile torch)")
+        return
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    if "none" in modes:
+        modes.remove("none")
+    modes.insert(0, "none")
+    texts = (SENTENCES * (args.count // len(SENTENCES) + 1))[:args.count]
+    print(f"{len(texts)} sentence(s) per mode on {args.device}, bf16 CPU support: {parkiet_engine.bf16_supported()}\n")
+
+    results = {}
+    for mode in modes:
+        print(f"--- {mode} ---")
+        results[mode] = run_mode(mode, texts, args.device, args.seed, args.greedy)
+        if results[mode] is None:
+            print(f"{mode} is not supported on this machine, skipped")
+    reference = results["none"]
+
+    print(f"\n{'mode':<6} {'load s':>7} {'cached':>6} {'RTF':>6} {'speedup':>7} "
+          f"{'spec cos':>8} {'LSD dB':>7} {'wave corr':>9}")
+    for mode, result in results.items():
+        if result is None:
+            continue
+        rtf = result["generate_seconds"] / max(result["audio_seconds"], 1e-6)
+        speedup = reference["generate_seconds"] / result["generate_seconds"]
+        pairs = [(r, c) for r, c in zip(reference["outputs"], result["outputs"]) if r is not None and c is not None]
+        cosines, distances = zip(*(spectral_similarity(r, c) for r, c in pairs)) if pairs else ((np.nan,), (np.nan,))
+        correlation = np.mean([waveform_correlation(r, c) for r, c in pairs]) if pairs else np.nan
+        cached = "yes" if result["cache_hit"] else ("-" if mode == "none" else "no")
+        print(f"{mode:<6} {result['load_seconds']:>7.1f} {cached:>6} {rtf:>6.2f} {speedup:>6.2f}x "
+              f"{np.mean(cosines):>8.3f} {np.mean(distances):>7.2f} {correlation:>9.3f}")
+    print("\nRTF = compute seconds per second of audio (lower is faster). "
+          "Run again to measure loads from the quantized cache.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Post-processing benchmark: cost per second of audio of silence trimming,
+resampling and loudness normalization, for whole buffers and for streamed
+chunks.
+
+Covers the engine rates (Pocket TTS 24 kHz, Parkiet 44.1 kHz) to the usual
+output rates. scipy's resample_poly is timed alongside as a reference, and
+the accuracy column is the SNR of our output against it.
+
+Usage:
+    python bench_postprocess.py
+    python bench_postprocess.py --seconds 30 --chunk-ms 80 --target 24000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from audio_postprocess import (AudioPostprocessor, LoudnessNormalizer, Resampler, SilenceTrimmer, loudness,
+                               resample, trim_silence)
+from bench_output_formats import synthetic_speech
+
+SOURCE_RATES = (24000, 44100)
+TARGET_RATES = (48000, 24000, 44100)
+
+
+def timed(function, runs):
+    function()  # Warm-up (filter design is cached after this)
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = function()
+    return (time.perf_counter() - start) / runs, result
+
+
+def stream(function_factory, samples, chunk):
+    processor = function_factory()
+    parts = [processor.process(samples[i:i + chunk]) for i in range(0, len(samples), chunk)]
+    if hasattr(processor, "flush"):
+        parts.append(processor.flush())
+    return np.concatenate(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark resampling and loudness normalization")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Length of the test signal")
+    parser.add_argument("--chunk-ms", type=int, default=80, help="Chunk size for the streaming rows")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target", type=int, nargs="*", default=list(TARGET_RATES), help="Output rates")
+    args = parser.parse_args()
+
+    try:
+        from scipy.signal import resample_poly
+    except ImportError:
+        resample_poly = None
+
+    print(f"{args.seconds:.0f} s synthetic speech, {args.runs} run(s), {args.chunk_ms} ms chunks\n")
+    print(f"{'step':<24} {'mode':<7} {'ms/s audio':>10} {'x realtime':>10} {'scipy ms/s':>10} {'SNR dB':>7}")
+
+    def row(step, mode, seconds, reference=None, snr=None):
+        per_second = seconds / args.seconds * 1000
+        ref = f"{reference / args.seconds * 1000:>10.3f}" if reference is not None else f"{'-':>10}"
+        snr = f"{snr:>7.1f}" if snr is not None else f"{'-':>7}"
+        print(f"{step:<24} {mode:<7} {per_second:>10.3f} {args.seconds / seconds:>10.0f} {ref} {snr}")
+
+    for source_rate in SOURCE_RATES:
+        audio = synthetic_speech(source_rate, args.seconds)
+        chunk = source_rate * args.chunk_ms // 1000
+        for target_rate in args.target:
+            if target_rate == source_rate:
+                continue
+            step = f"resample {source_rate}->{target_rate}"
+            whole, output = timed(lambda: resample(audio, target_rate).samples, args.runs)
+            reference = snr = None
+            if resample_poly is not None:
+                divisor = np.gcd(source_rate, target_rate)
+                reference, expected = timed(lambda: resample_poly(
+                    audio.samples, target_rate // divisor, source_rate // divisor), args.runs)
+                n = min(len(expected), len(output))
+                error = output[:n] - expected[:n]
+                snr = 10 * np.log10(np.mean(np.square(expected[:n])) / max(np.mean(np.square(error)), 1e-20))
+            row(step, "whole", whole, reference, snr)
+            streamed, _ = timed(lambda: stream(lambda: Resampler(source_rate, target_rate), audio.samples, chunk),
+                                args.runs)
+            row(step, "stream", streamed)
+
+    for sample_rate in sorted(set(args.target)):
+        audio = synthetic_speech(sample_rate, args.seconds)
+        chunk = sample_rate * args.chunk_ms // 1000
+        quiet = audio.samples * np.float32(0.1)
+        step = f"loudness {sample_rate}"
+        whole, output = timed(lambda: LoudnessNormalizer(sample_rate).normalize(quiet), args.runs)
+        row(step, "whole", whole)
+        streamed, streamed_output = timed(lambda: stream(lambda: LoudnessNormalizer(sample_rate), quiet, chunk),
+                                          args.runs)
+        row(step, "stream", streamed)
+        print(f"{'':<24} input {loudness(quiet, sample_rate):.1f} dB -> whole {loudness(output, sample_rate):.1f} dB, "
+              f"stream {loudness(streamed_output, sample_rate):.1f} dB")
+
+    for sample_rate in SOURCE_RATES:
+        # Speech followed by a quiet noise tail as long again, like a Parkiet run to max_new_tokens
+        audio = synthetic_speech(sample_rate, args.seconds / 2)
+        tail = np.random.default_rng(1).standard_normal(len(audio)).astype(np.float32) * 1e-4
+        samples = np.concatenate([audio.samples, tail])
+        chunk = sample_rate * args.chunk_ms // 1000
+        step = f"trim {sample_rate}"
+        whole, (trimmed, _, removed) = timed(lambda: trim_silence(samples, sample_rate), args.runs)
+        row(step, "whole", whole)
+        streamed, _ = timed(lambda: stream(lambda: SilenceTrimmer(sample_rate), samples, chunk), args.runs)
+        row(step, "stream", streamed)
+        print(f"{'':<24} removed {removed / sample_rate:.2f}s of {len(samples) / sample_rate:.2f}s")
+
+    postprocessor = AudioPostprocessor(trim={})
+    for source_rate in SOURCE_RATES:
+        audio = synthetic_speech(source_rate, args.seconds)
+        chunk = source_rate * args.chunk_ms // 1000
+        step = f"stage {source_rate}->{postprocessor.sample_rate}"
+        whole, _ = timed(lambda: postprocessor.process(postprocessor.trim(audio)), args.runs)
+        row(step, "whole", whole)
+        chunks = [audio.samples[i:i + chunk] for i in range(0, len(audio), chunk)]
+        streamed, _ = timed(lambda: list(postprocessor.stream(chunks, source_rate)), args.runs)
+        row(step, "stream", streamed)
+
+
+if __name__ == "__main__":
+    main()
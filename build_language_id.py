@@ -0,0 +1,157 @@
+"""
+Build language_id_weights.bin for language_id.py.
+
+Word and character n-gram statistics come from the wordfreq word lists
+(pip install wordfreq; only needed to rebuild, not at runtime; data licensed
+CC-BY-SA 4.0). The scales and bias that turn the weight sums into
+probabilities are fitted by logistic regression on short sentences sampled
+from the same lists, so the confidences hold for 1-word inputs as well as
+long ones.
+
+Usage: python build_language_id.py [--words 50000] [--output language_id_weights.bin]
+"""
+import argparse
+import math
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import language_id
+
+LANGUAGES = ("en", "nl")
+MAX_WEIGHT = 8.0
+MIN_NGRAM_WEIGHT = 0.05
+CALIBRATION_SENTENCES = 20000
+MAX_CALIBRATION_WORDS = 12
+OOV_FRACTION = 0.25  # Share of calibration words drawn from outside the word table
+
+
+def load_word_frequencies(lang, top_words):
+    """Top `top_words` words of `lang` that the tokenizer keeps intact, most frequent first."""
+    from wordfreq import get_frequency_dict
+
+    frequencies = {}
+    for word, freq in sorted(get_frequency_dict(lang).items(), key=lambda item: -item[1]):
+        if language_id.tokenize(word) != [word]:
+            continue
+        frequencies[word] = freq
+        if len(frequencies) >= top_words:
+            break
+    total = sum(frequencies.values())
+    return {word: freq / total for word, freq in frequencies.items()}
+
+
+def word_weights(frequencies):
+    """Log-ratio per word; words missing from one list get that list's floor."""
+    floors = {lang: min(frequencies[lang].values()) / 2 for lang in LANGUAGES}
+    weights = {}
+    for word in set(frequencies["en"]) | set(frequencies["nl"]):
+        p_en = frequencies["en"].get(word, floors["en"])
+        p_nl = frequencies["nl"].get(word, floors["nl"])
+        weights[language_id.word_feature(word)] = float(np.clip(math.log(p_nl / p_en), -MAX_WEIGHT, MAX_WEIGHT))
+    return weights
+
+
+def ngram_weights(frequencies):
+    """Log-ratio per n-gram, counted over the frequency-weighted vocabulary."""
+    counts = {lang: defaultdict(float) for lang in LANGUAGES}
+    for lang in LANGUAGES:
+        for word, freq in frequencies[lang].items():
+            for gram in language_id.ngram_features(word):
+                counts[lang][gram] += freq
+
+    totals = {lang: defaultdict(float) for lang in LANGUAGES}
+    for lang in LANGUAGES:
+        for gram, count in counts[lang].items():
+            totals[lang][len(gram)] += count
+
+    weights = {}
+    for gram in set(counts["en"]) | set(counts["nl"]):
+        order = len(gram)
+        # Add-k smoothing relative to the order's mass keeps rare n-grams near 0
+        smoothing = 1e-6 * (totals["en"][order] + totals["nl"][order])
+        p_en = (counts["en"].get(gram, 0.0) + smoothing) / totals["en"][order]
+        p_nl = (counts["nl"].get(gram, 0.0) + smoothing) / totals["nl"][order]
+        weight = float(np.clip(math.log(p_nl / p_en), -MAX_WEIGHT, MAX_WEIGHT))
+        if abs(weight) >= MIN_NGRAM_WEIGHT:
+            weights[gram] = weight
+    return weights
+
+
+def sample_sentences(frequencies, rare_words, count, rng):
+    """
+    Random 1-MAX_CALIBRATION_WORDS word sentences. Some words come from
+    `rare_words` (not in the word table) so the fit also sees inputs that
+    only the n-grams can decide, like names and compounds.
+    """
+    words = list(frequencies)
+    probabilities = np.array([frequencies[w] for w in words])
+    probabilities /= probabilities.sum()
+    sentences = []
+    for _ in range(count):
+        length = rng.integers(1, MAX_CALIBRATION_WORDS + 1)
+        sentence = [words[i] for i in rng.choice(len(words), size=length, p=probabilities)]
+        for position in np.flatnonzero(rng.random(length) < OOV_FRACTION):
+            sentence[position] = rare_words[rng.integers(len(rare_words))]
+        sentences.append(" ".join(sentence))
+    return sentences
+
+
+def fit_calibration(identifier, sentences, labels, iterations=50):
+    """Logistic regression of the label on [1, word_sum, ngram_sum] (Newton's method)."""
+    features = np.array([[1.0, *identifier.feature_sums(s)[:2]] for s in sentences])
+    labels = np.asarray(labels, dtype=np.float64)
+    coefficients = np.zeros(3)
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-features @ coefficients))
+        gradient = features.T @ (labels - p) - 1e-3 * coefficients
+        hessian = (features * (p * (1 - p))[:, None]).T @ features + 1e-3 * np.eye(3)
+        step = np.linalg.solve(hessian, gradient)
+        coefficients += step
+        if np.abs(step).max() < 1e-6:
+            break
+    return coefficients
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the EN/NL language identification weights")
+    parser.add_argument("--words", type=int, default=50000, help="Words per language (default: 50000)")
+    parser.add_argument("--output", default=language_id.WEIGHTS_FILE, help="Output file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frequencies, rare_words = {}, {}
+    for lang in LANGUAGES:
+        extended = load_word_frequencies(lang, 3 * args.words)
+        ranked = list(extended)
+        frequencies[lang] = {word: extended[word] for word in ranked[:args.words]}
+        rare_words[lang] = ranked[args.words:]
+    weights = word_weights(frequencies)
+    weights.update(ngram_weights(frequencies))
+    print(f"{len(weights)} features from {args.words} words per language")
+
+    # Fit the calibration against the table as it will be stored (float16)
+    language_id.write_weights(args.output, weights)
+    identifier = language_id.LanguageIdentifier(args.output)
+    rng = np.random.default_rng(args.seed)
+    sentences, labels = [], []
+    for label, lang in enumerate(LANGUAGES):  # en -> 0, nl -> 1
+        sampled = sample_sentences(frequencies[lang], rare_words[lang], CALIBRATION_SENTENCES, rng)
+        sentences += sampled
+        labels += [label] * len(sampled)
+    bias, word_scale, ngram_scale = fit_calibration(identifier, sentences, labels)
+    del identifier
+    print(f"Calibration: bias={bias:.3f} word_scale={word_scale:.3f} ngram_scale={ngram_scale:.3f}")
+
+    weights[language_id.BIAS_FEATURE] = bias
+    weights[language_id.WORD_SCALE_FEATURE] = word_scale
+    weights[language_id.NGRAM_SCALE_FEATURE] = ngram_scale
+    language_id.write_weights(args.output, weights)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output) / 1024:.0f} KB) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Cooperative cancellation for speech jobs (barge-in).
+
+A CancelToken travels with a job from the MCP pool through the pipeline into
+the engines and the playback engine. Cancelling it never interrupts a thread
+from outside: the Pocket TTS step loop and Parkiet's stopping criteria check
+it once per decode step, the pipeline checks it between sentences, and
+callbacks registered with on_cancel() stop playback right away.
+"""
+import logging
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """Raised where a cancelled job notices its token."""
+
+
+class CancelToken:
+    """
+    Args:
+        parent: Optional token whose cancellation also cancels this one
+    """
+
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reason = None
+        self.cancelled_at = None
+        self._unlink = parent.on_cancel(lambda: self.cancel(parent.reason)) if parent is not None else None
+
+    @classmethod
+    def all_of(cls, tokens):
+        """Token cancelled once every one of `tokens` is (None if any of them is None)."""
+        if not tokens or any(token is None for token in tokens):
+            return None
+        combined = cls()
+
+        def cancel_if_all():
+            if all(token.cancelled for token in tokens):
+                combined.cancel(tokens[0].reason)
+
+        for token in tokens:
+            token.on_cancel(cancel_if_all)
+        return combined
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """Cancel and run the callbacks. Returns False if it already was cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self.cancelled_at = time.perf_counter()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Cancel callback failed: {e}")
+        return True
+
+    def check(self):
+        """Raise Cancelled if the token has been cancelled."""
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def on_cancel(self, callback):
+        """
+        Call `callback` on cancellation (right away if already cancelled).
+
+        Returns:
+            callable: Unregisters the callback
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def release(self):
+        """Detach from the parent token (for short-lived child tokens)."""
+        if self._unlink is not None:
+            self._unlink()
+            self._unlink = None
+
+    def wait(self, timeout=None):
+        """Block until cancelled. Returns False on timeout."""
+        return self._event.wait(timeout)
+
+
+def check(token):
+    """token.check() for an optional token."""
+    if token is not None:
+        token.check()
@@ -0,0 +1,86 @@
+"""
+Separate "Erika talks" console window for the in-process MCP server.
+
+The MCP server owns stdout (the stdio transport), so the text being spoken
+is shown in a child process with its own console window instead. The pool
+writes one JSON line per utterance to the child's stdin; the child clears
+its window and shows the text with AudioPlaybackHandler.display_text.
+
+Run directly (python console_display.py) it is that child.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+CREATE_NEW_CONSOLE = 0x00000010
+
+
+class ConsoleDisplay:
+    """Feeds the text of each utterance to a separate console window (Windows only)."""
+
+    def __init__(self):
+        self._process = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, display_config):
+        """A ConsoleDisplay if "display": {"enabled": true} is set (Windows only), else None."""
+        if not (display_config or {}).get("enabled", False):
+            return None
+        if os.name != "nt":
+            logging.info("The display window needs a Windows console; not showing it")
+            return None
+        return cls()
+
+    def _start(self):
+        # Started on first use, and again if the user closed the window
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                creationflags=CREATE_NEW_CONSOLE,
+            )
+            logging.info(f"Display window started (pid {self._process.pid})")
+        return self._process
+
+    def display_text(self, text):
+        """Show `text` in the display window. Never raises."""
+        with self._lock:
+            try:
+                process = self._start()
+                process.stdin.write((json.dumps(text) + "\n").encode("utf-8"))
+                process.stdin.flush()
+            except Exception as e:
+                logging.error(f"Failed to update the display window: {e}")
+                self._process = None
+
+    def close(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                try:
+                    self._process.stdin.close()
+                    self._process.wait(timeout=2)
+                except Exception:
+                    self._process.kill()
+            self._process = None
+
+
+def main():
+    from audio_playback_handler import AudioPlaybackHandler
+
+    handler = AudioPlaybackHandler()
+    for line in sys.stdin.buffer:
+        try:
+            text = json.loads(line.decode("utf-8"))
+        except ValueError:
+            continue
+        handler.display_text(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,44 @@
 MCP Server for Gemini CLI Voice Mode
 
 Provides a 'speak' tool that converts text to speech using pocket-tts.
+Speech is synthesized in-process by a small pool of warm workers.
 Add to Gemini with: gemini mcp add voice python gemini_voice_mcp.py
 """
 
 import os
 import sys
-import tempfile
-import subprocess
+import json
 import logging
+from contextlib import asynccontextmanager
 from mcp.server import FastMCP
 
-# Initialize MCP server
-mcp = FastMCP("gemini-voice")
+from console_display import ConsoleDisplay
+from metrics import metrics as speech_metrics, serve_http
+from request_scheduler import PRIORITIES
+from speech_pool import POLICIES, SpeechWorkerPool, QueueFullError
 
 # Configuration
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-VENV_PYTHON = os.path.join(SCRIPT_DIR, ".venv", "Scripts", "python.exe")
 ALLOWED_VOICES = ['alba', 'marius', 'javert', 'jean', 'fantine', 'cosette', 'eponine', 'azelma']
 DEFAULT_VOICE = "azelma"
+POOL_WORKERS = 2      # Warm synthesis workers (each engine still generates one utterance at a time)
+MAX_QUEUED_JOBS = 8   # speak() is rejected once this many jobs are waiting
+DEFAULT_POLICY = "queue"
+
+
+def load_config():
+    """tts_config.json, or {} if it is missing or unreadable."""
+    try:
+        with open(os.path.join(SCRIPT_DIR, "tts_config.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_barge_in_policy(config):
+    """Barge-in policy from the config ("barge_in": {"policy": ...})."""
+    policy = (config.get("barge_in") or {}).get("policy", DEFAULT_POLICY)
+    return policy if policy in POLICIES else DEFAULT_POLICY
 
 
 def get_voice_path(voice: str) -> str:
@@ -31,8 +51,6 @@ def get_voice_path(voice: str) -> str:
     return DEFAULT_VOICE
 
 
-import asyncio
-
 # Set up logging to file
 # Use force=True to override any existing logging config from FastMCP/libraries
 logging.basicConfig(
@@ -42,36 +60,37 @@ logging.basicConfig(
     force=True
 )
 
-def spawn_worker(text: str, voice: str):
-    """Refactored worker spawning logic."""
-    worker_script = os.path.join(SCRIPT_DIR, "speak_worker.py")
-    
-    # Use standard python.exe to allow console window (User request: visible window)
-    cmd = [VENV_PYTHON, worker_script, "--text", text, "--voice", voice]
-    
-    logging.info(f"Spawning worker: {cmd}")
-    
+config = load_config()
+speech_pool = SpeechWorkerPool(num_workers=POOL_WORKERS, max_queue_size=MAX_QUEUED_JOBS,
+                               policy=load_barge_in_policy(config),
+                               display=ConsoleDisplay.from_config(config.get("display")))
+
+
+@asynccontextmanager
+async def lifespan(server):
+    # The stdio transport already holds its own handle on stdout. Engines now run
+    # in-process and print progress, so send their prints to stderr instead.
+    sys.stdout = sys.stderr
+    await speech_pool.start()
+    metrics_port = (config.get("metrics") or {}).get("http_port")
+    metrics_server = serve_http(metrics_port) if metrics_port else None
+    # Spoken notification on startup (also warms up the models)
+    speech_pool.submit("Voice server ready", DEFAULT_VOICE)
     try:
-        # User wants a visible window, top-left.
-        # We need CREATE_NEW_CONSOLE (0x00000010) to force a separate window.
-        # We keep DETACHED_PROCESS/NEW_GROUP to avoid blocking.
-        
-        subprocess.Popen(
-            cmd,
-            stdin=subprocess.DEVNULL,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            close_fds=True,
-            creationflags=0x00000010 | 0x00000200 # CREATE_NEW_CONSOLE | NEW_GROUP
-        )
-        logging.info("Worker spawned successfully (visible console)")
-        return True
-    except Exception as e:
-        logging.error(f"Failed to spawn worker: {e}")
-        return False
+        yield
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        await speech_pool.stop()
+
+
+# Initialize MCP server
+mcp = FastMCP("gemini-voice", lifespan=lifespan)
+
 
 @mcp.tool()
-async def speak(text: str, voice: str = DEFAULT_VOICE) -> str:
+async def speak(text: str, voice: str = DEFAULT_VOICE, policy: str = "", priority: str = "normal",
+                deadline_ms: int = 0) -> str:
     """
     Convert text to speech and play it aloud.
 
@@ -81,20 +100,135 @@ async def speak(text: str, voice: str = DEFAULT_VOICE) -> str:
     Args:
         text: The text to convert to speech and play aloud
         voice: Voice to use (alba, marius, javert, jean, fantine, cosette, eponine, azelma) or path to WAV file
+        policy: What to do with earlier speech: "queue" (play after it), "replace-latest"
+                (drop what has not started) or "interrupt" (stop it now). Default: server setting
+        priority: "high" (e.g. short acknowledgements), "normal" or "low" (long readouts)
+        deadline_ms: Optional soft deadline; the request goes ahead of shorter ones once it would miss it
 
     Returns:
-        Confirmation that the speech generation has started
+        The job id of the queued speech request
     """
     if not text or not text.strip():
         return "Error: No text provided to speak"
 
     logging.info(f"Received speak request for: {text[:50]}...")
-    
-    if spawn_worker(text, voice):
-        return "🔊 Speaking..."
-    else:
+
+    if policy and policy not in POLICIES:
+        return f"Error: Unknown policy '{policy}' (use {', '.join(POLICIES)})"
+    if priority not in PRIORITIES:
+        return f"Error: Unknown priority '{priority}' (use {', '.join(PRIORITIES)})"
+
+    try:
+        job = speech_pool.submit(text, voice, policy or None, priority, deadline_ms / 1000 if deadline_ms else None)
+    except QueueFullError as e:
+        logging.warning(str(e))
+        return f"Error: {e}. Try again shortly."
+    except Exception as e:
+        logging.error(f"Failed to queue speech: {e}")
         return "Error starting speech"
 
+    return f"🔊 Speaking... (job {job.id}, {speech_pool.status()['queue_depth']} queued)"
+
+
+@mcp.tool()
+def stop_speaking(job_id: str = "") -> str:
+    """
+    Stop speech right away: cancel one job, or everything queued and playing.
+
+    Args:
+        job_id: Optional job id returned by speak
+
+    Returns:
+        The jobs that were stopped
+    """
+    cancelled = speech_pool.cancel(job_id or None, reason="stopped")
+    if not cancelled:
+        return "Nothing to stop"
+    return "Stopped " + ", ".join(job.id for job in cancelled)
+
+
+@mcp.tool()
+def status(job_id: str = "") -> str:
+    """
+    Report the speech queue state, or the state of a single job.
+
+    Args:
+        job_id: Optional job id returned by speak
+
+    Returns:
+        Queue depth and worker activity, plus the job state if requested
+    """
+    info = speech_pool.status()
+    lines = [
+        f"Queue depth: {info['queue_depth']}/{info['queue_capacity']}",
+        f"Active workers: {info['active']}/{info['workers']}",
+    ]
+    stop = ""
+    if info["mean_stop_ms"] is not None:
+        stop = f", stopped {info['mean_stop_ms']:.0f} ms after cancel on average"
+    lines.append(f"Barge-in policy: {info['policy']}, {info['cancelled']} job(s) cancelled{stop}")
+    if "batching" in info:
+        batching = info["batching"]
+        lines.append(
+            f"Batching: {batching['batches']} batches, mean size {batching['mean_batch_size']:.2f}, "
+            f"sizes {batching['batch_sizes']}, added latency {batching['mean_added_latency_ms']:.1f} ms avg"
+        )
+    if "coalescing" in info:
+        coalescing = info["coalescing"]
+        lines.append(
+            f"Coalescing: {coalescing['coalesced']} identical request(s) served by another's generation "
+            f"({coalescing['leaders']} ran their own, {coalescing['in_flight']} in flight)"
+        )
+    for engine, lane in info.get("lanes", {}).items():
+        lines.append(
+            f"Lane {engine}: {lane['requests']} request(s), {lane['waiting']} waiting, "
+            f"queue wait {lane['mean_wait_seconds']:.2f}s avg / {lane['max_wait_seconds']:.2f}s max, "
+            f"{lane['reordered']} reordered, RTF {lane['real_time_factor']:.2f}"
+        )
+    models = info.get("models", {})
+    for name, model in models.get("models", {}).items():
+        state = f"resident {model['resident_seconds']:.0f}s" if model["resident"] else "unloaded"
+        load = f"{model['last_load_seconds']:.1f}s" if model["last_load_seconds"] is not None else "n/a"
+        lines.append(
+            f"Model {name}: {state}, {model['megabytes']:.0f} MB, {model['loads']} load(s) "
+            f"(last {load}), {model['evictions']} eviction(s)"
+        )
+    for engine, trim in info.get("trimming", {}).items():
+        lines.append(
+            f"Trimming {engine}: {trim['clips']} clip(s), removed {trim['leading_seconds']:.1f}s leading and "
+            f"{trim['trailing_seconds']:.1f}s trailing of {trim['input_seconds']:.1f}s"
+        )
+    if "playback" in info:
+        playback = info["playback"]
+        lines.append(
+            f"Playback ({playback['sink']}): {playback['segments']} segment(s), "
+            f"{playback['seconds_played']:.1f}s played, {playback['underruns']} underrun(s) "
+            f"({playback['underrun_seconds']:.2f}s of silence)"
+        )
+    if job_id:
+        job = speech_pool.get_job(job_id)
+        lines.append(job.describe() if job else f"job {job_id}: unknown")
+    return "\n".join(lines)
+
+
+@mcp.tool()
+def metrics(format: str = "json") -> str:
+    """
+    Get latency and resource metrics of the speech requests served so far.
+
+    Args:
+        format: "json" (per-stage percentiles, time to first audio, real-time factor)
+                or "prometheus" (text exposition format)
+
+    Returns:
+        The metrics in the requested format
+    """
+    if format == "prometheus":
+        return speech_metrics.to_prometheus()
+    if format != "json":
+        return f"Error: Unknown format '{format}' (use json or prometheus)"
+    return json.dumps(speech_metrics.to_json(), indent=2)
+
 
 @mcp.tool()
 def list_voices() -> str:
@@ -108,6 +242,4 @@ def list_voices() -> str:
 
 
 if __name__ == "__main__":
-    # Spoken notification on startup
-    spawn_worker("Voice server ready", DEFAULT_VOICE)
     mcp.run()
@@ -0,0 +1,382 @@
+"""
+Per-stage timing spans and per-request latency/throughput metrics.
+
+Stages are timed with spans, which go into histograms labelled by stage and
+engine:
+
+    with metrics.span("generation", engine="parkiet"):
+        ...
+
+The stages are language_detection, queue_wait, model_load,
+voice_conditioning, generation, wav_write, wav_header_fix and playback.
+
+A request is followed end to end with a trace. It records the request's
+spans, time to first audio, seconds of audio produced, real-time factor
+(generation seconds per second of audio) and peak RSS. The finished trace is
+logged as one JSON line and added to the histograms:
+
+    with metrics.trace("speech", engine="pocket_tts") as trace:
+        ...
+        trace.first_audio()
+        trace.add_audio(seconds)
+
+Spans are attached to the trace of the thread that runs them (threads started
+with contextvars.copy_context() included). Everything is exported as
+Prometheus text or JSON: metrics.to_prometheus() / metrics.to_json(), over
+HTTP with serve_http(port), from the daemon with `python tts_daemon.py
+--metrics`, and from the MCP `metrics` tool.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PREFIX = "erika"
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 4, 8, 16)
+AUDIO_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+RSS_BUCKETS = tuple(megabytes * 1024 * 1024 for megabytes in (256, 512, 1024, 2048, 4096, 8192, 16384, 32768))
+
+_HISTOGRAMS = {
+    # name: (help, buckets)
+    "stage_seconds": ("Duration of one pipeline stage", STAGE_BUCKETS),
+    "request_seconds": ("End-to-end duration of a request", STAGE_BUCKETS),
+    "request_ttfa_seconds": ("Time from request to first audio", STAGE_BUCKETS),
+    "request_audio_seconds": ("Seconds of audio produced per request", AUDIO_BUCKETS),
+    "request_real_time_factor": ("Generation seconds per second of audio", RTF_BUCKETS),
+    "request_peak_rss_bytes": ("Highest resident set size seen during a request", RSS_BUCKETS),
+}
+
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def rss_bytes():
+    """Current resident set size, or the process peak if psutil is not installed."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Highest resident set size of the process so far (None if unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_trace():
+    """The RequestTrace of the running request, or None."""
+    return _current_trace.get()
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as in Prometheus."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated within its bucket (None if empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower = 0.0
+        for bound, seen, count in zip(self.buckets, self.cumulative(), self.counts):
+            if seen >= rank:
+                return lower + (bound - lower) * ((rank - (seen - count)) / count if count else 1.0)
+            lower = bound
+        return self.buckets[-1]  # Above the last bucket
+
+
+class RequestTrace:
+    """Spans and latency figures of one request; created by Metrics.trace()."""
+
+    def __init__(self, kind, labels):
+        self.kind = kind
+        self.labels = labels
+        self.started_at = time.perf_counter()
+        self.spans = []  # (stage, start offset, seconds, labels)
+        self.time_to_first_audio = None
+        self.audio_seconds = 0.0
+        self.generation_seconds = 0.0
+        self.peak_rss = rss_bytes()
+        self.outcome = "ok"
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, started_at, seconds, labels):
+        with self._lock:
+            self.spans.append((stage, started_at - self.started_at, seconds, labels))
+            if stage == "generation":
+                self.generation_seconds += seconds
+        self.sample_rss()
+
+    def sample_rss(self):
+        rss = rss_bytes()
+        if rss is not None:
+            with self._lock:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def first_audio(self):
+        """Mark the moment the first audio of the request was ready to play."""
+        if self.time_to_first_audio is None:
+            self.time_to_first_audio = time.perf_counter() - self.started_at
+
+    def add_audio(self, seconds):
+        with self._lock:
+            self.audio_seconds += seconds
+
+    def watch(self, chunks, sample_rate):
+        """Pass PCM chunks through, marking the first one and counting audio seconds."""
+        for chunk in chunks:
+            self.first_audio()
+            self.add_audio(len(chunk) / sample_rate)
+            yield chunk
+
+    @property
+    def real_time_factor(self):
+        if not self.audio_seconds or not self.generation_seconds:
+            return None
+        return self.generation_seconds / self.audio_seconds
+
+    def summary(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "kind": self.kind,
+            **self.labels,
+            "outcome": self.outcome,
+            "seconds": round(time.perf_counter() - self.started_at, 4),
+            "ttfa_seconds": round(self.time_to_first_audio, 4) if self.time_to_first_audio is not None else None,
+            "audio_seconds": round(self.audio_seconds, 3),
+            "real_time_factor": round(self.real_time_factor, 3) if self.real_time_factor is not None else None,
+            "peak_rss_bytes": self.peak_rss,
+            "spans": [{"stage": stage, "start": round(start, 4), "seconds": round(seconds, 4), **labels}
+                      for stage, start, seconds, labels in spans],
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._histograms = {}  # (name, sorted label items) -> Histogram
+        self._requests = {}    # (kind, outcome) -> count
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        """Add `value` to histogram `name` (see _HISTOGRAMS) for these labels."""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None)))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(_HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def record(self, stage, started_at, seconds, **labels):
+        """Record a finished span (also on the current trace, if any)."""
+        self.observe("stage_seconds", seconds, stage=stage, **labels)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(stage, started_at, seconds, labels)
+
+    @contextlib.contextmanager
+    def span(self, stage, **labels):
+        """Time the block as one `stage` span."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, started_at, time.perf_counter() - started_at, **labels)
+
+    def timed(self, iterable, stage, **labels):
+        """
+        Iterate `iterable`, recording the time spent waiting for its items as
+        one span (time the consumer spends between items is not counted).
+        The span is attached to the trace current when timed() was called.
+        """
+        # Not a generator itself, so the trace is taken from the caller's thread
+        return self._timed(iterable, stage, _current_trace.get(), labels)
+
+    def _timed(self, iterable, stage, trace, labels):
+        started_at = time.perf_counter()
+        busy = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                resumed = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    busy += time.perf_counter() - resumed
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            self.observe("stage_seconds", busy, stage=stage, **labels)
+            if trace is not None:
+                trace.add_span(stage, started_at, busy, labels)
+
+    @contextlib.contextmanager
+    def trace(self, kind, **labels):
+        """
+        Follow one request; spans run in this context are attached to it.
+
+        Yields:
+            RequestTrace: Call first_audio()/add_audio() on it; set
+                          `labels` entries once they are known.
+        """
+        trace = RequestTrace(kind, dict(labels))
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.outcome = type(e).__name__.lower()
+            raise
+        finally:
+            _current_trace.reset(token)
+            self._finish(trace)
+
+    def _finish(self, trace):
+        trace.sample_rss()
+        summary = trace.summary()
+        labels = {"kind": trace.kind, "engine": trace.labels.get("engine")}
+        self.observe("request_seconds", summary["seconds"], **labels)
+        if trace.time_to_first_audio is not None:
+            self.observe("request_ttfa_seconds", trace.time_to_first_audio, **labels)
+        if trace.audio_seconds:
+            self.observe("request_audio_seconds", trace.audio_seconds, **labels)
+        if trace.real_time_factor is not None:
+            self.observe("request_real_time_factor", trace.real_time_factor, **labels)
+        if trace.peak_rss is not None:
+            self.observe("request_peak_rss_bytes", trace.peak_rss, **labels)
+        with self._lock:
+            key = (trace.kind, trace.outcome)
+            self._requests[key] = self._requests.get(key, 0) + 1
+        logging.info(f"Request trace: {json.dumps(summary)}")
+
+    # --- Export ---
+
+    def to_json(self):
+        with self._lock:
+            histograms = list(self._histograms.items())
+            requests = dict(self._requests)
+        info = {
+            "requests": [{"kind": kind, "outcome": outcome, "count": count}
+                         for (kind, outcome), count in sorted(requests.items())],
+            "histograms": [],
+            "rss_bytes": rss_bytes(),
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+        for (name, labels), histogram in sorted(histograms, key=lambda item: item[0]):
+            info["histograms"].append({
+                "name": name,
+                "labels": dict(labels),
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "mean": histogram.sum / histogram.count if histogram.count else None,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "buckets": dict(zip(map(str, histogram.buckets), histogram.cumulative())),
+            })
+        return info
+
+    def to_prometheus(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            requests = sorted(self._requests.items())
+
+        def label_text(labels, **extra):
+            items = list(labels) + list(extra.items())
+            if not items:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in items)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+        lines = [f"# HELP {PREFIX}_requests_total Finished requests",
+                 f"# TYPE {PREFIX}_requests_total counter"]
+        for (kind, outcome), count in requests:
+            lines.append(f"{PREFIX}_requests_total{label_text([('kind', kind), ('outcome', outcome)])} {count}")
+        previous = None
+        for (name, labels), histogram in histograms:
+            metric = f"{PREFIX}_{name}"
+            if name != previous:
+                lines.append(f"# HELP {metric} {_HISTOGRAMS[name][0]}")
+                lines.append(f"# TYPE {metric} histogram")
+                previous = name
+            for bound, count in zip(histogram.buckets, histogram.cumulative()):
+                lines.append(f"{metric}_bucket{label_text(labels, le=bound)} {count}")
+            lines.append(f"{metric}_bucket{label_text(labels, le='+Inf')} {histogram.count}")
+            lines.append(f"{metric}_sum{label_text(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{label_text(labels)} {histogram.count}")
+        for name, value, help_text in (("rss_bytes", rss_bytes(), "Resident set size"),
+                                       ("peak_rss_bytes", peak_rss_bytes(), "Peak resident set size")):
+            if value is not None:
+                lines += [f"# HELP {PREFIX}_{name} {help_text}", f"# TYPE {PREFIX}_{name} gauge",
+                          f"{PREFIX}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path.split("?")[0] == "/metrics.json":
+            body, content_type = json.dumps(metrics.to_json(), indent=2), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would flood the debug log
+
+
+def serve_http(port, host="127.0.0.1"):
+    """Serve /metrics (Prometheus text) and /metrics.json on a background thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Metrics endpoint on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+metrics = Metrics()
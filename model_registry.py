@@ -0,0 +1,329 @@
+"""
+Process-wide residency manager for the heavy TTS models.
+
+Engines fetch their model with `registry.get(name, loader, unloader)` instead
+of keeping their own singleton. The registry measures each model's RSS
+footprint at load time, keeps the total under a memory budget by unloading
+the least recently used models, unloads models that have been idle too long,
+and can load the engine that usually follows the current one in the
+background. Models in use are pinned (`with registry.pinned(name):`) and are
+never unloaded from under a running generation.
+"""
+import collections
+import contextlib
+import gc
+import logging
+import sys
+import threading
+import time
+
+from metrics import metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+POCKET_TTS = "pocket_tts"
+PARKIET = "parkiet"
+COQUI_XTTS = "coqui-xtts"
+
+
+def _rss_bytes():
+    return psutil.Process().memory_info().rss if psutil else None
+
+
+def _parameter_bytes(model):
+    """Tensor bytes of a torch module (or of the modules in a tuple), 0 if unknown."""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return 0
+    modules = model if isinstance(model, tuple) else (model,)
+    total = 0
+    for module in modules:
+        if not isinstance(module, torch.nn.Module):
+            continue
+        # state_dict() also covers packed (quantized) weights, which are not parameters
+        values = list(module.state_dict().values())
+        while values:
+            value = values.pop()
+            if isinstance(value, (tuple, list)):
+                values.extend(value)
+            elif torch.is_tensor(value):
+                total += value.numel() * value.element_size()
+    return total
+
+
+def _release_memory():
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class _Entry:
+    def __init__(self, name):
+        self.name = name
+        self.model = None
+        self.loader = None
+        self.unloader = None
+        self.footprint = 0      # Bytes, measured at the last load
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+        self.last_load_seconds = None
+        self.total_load_seconds = 0.0
+        self.loaded_at = None
+        self.last_used = None
+        self.pins = 0
+        self.load_lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Args:
+        memory_budget_bytes: Upper bound for the summed footprints (None = no limit)
+        idle_timeout: Seconds after which an unused model is unloaded (None = never)
+        preload_next: Load the engine that usually follows the one just used
+    """
+
+    def __init__(self, memory_budget_bytes=None, idle_timeout=None, preload_next=True):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_timeout = idle_timeout
+        self.preload_next = preload_next
+        self._entries = collections.OrderedDict()  # LRU order, most recent last
+        self._lock = threading.RLock()
+        self._last_requested = None
+        self._successors = collections.defaultdict(collections.Counter)
+        self._reaper = None
+
+    def configure(self, config):
+        """Apply a {"memory_budget_megabytes", "idle_unload_seconds", "preload_next"} block."""
+        if not config:
+            return
+        with self._lock:
+            if "memory_budget_megabytes" in config:
+                budget = config["memory_budget_megabytes"]
+                self.memory_budget_bytes = int(budget * 1024 * 1024) if budget else None
+            if "idle_unload_seconds" in config:
+                self.idle_timeout = config["idle_unload_seconds"] or None
+            self.preload_next = config.get("preload_next", self.preload_next)
+            self._start_reaper()
+            self._enforce_budget(keep=None)
+
+    def _entry(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            entry = self._entries[name] = _Entry(name)
+        return entry
+
+    # --- Access ---
+
+    def get(self, name, loader=None, unloader=None):
+        """
+        Returns the resident model `name`, loading it with `loader()` if needed.
+        `unloader(model)`, if given, is called when the model is unloaded.
+        """
+        model = self._get(name, loader, unloader, from_preload=False)
+        self._maybe_preload_next(name)
+        return model
+
+    def _get(self, name, loader, unloader, from_preload):
+        with self._lock:
+            entry = self._entry(name)
+            if loader is not None:
+                entry.loader = loader
+                entry.unloader = unloader
+            if not from_preload:
+                self._note_request(name)
+            if entry.model is not None:
+                entry.hits += 1
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(name)
+                return entry.model
+            if entry.loader is None:
+                raise KeyError(f"No loader registered for model '{name}'")
+
+        # Load outside the registry lock, so other engines stay usable meanwhile
+        with entry.load_lock:
+            if entry.model is None:
+                self._load(entry)
+            return entry.model
+
+    def _load(self, entry):
+        with self._lock:
+            # Make room for the footprint we saw last time before loading again
+            self._enforce_budget(keep=entry.name, incoming=entry.footprint)
+
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        with metrics.span("model_load", engine=entry.name):
+            model = entry.loader()
+        seconds = time.perf_counter() - start
+        rss_after = _rss_bytes()
+
+        footprint = rss_after - rss_before if rss_before is not None else 0
+        # RSS misses GPU memory and can shrink while other threads free memory
+        footprint = max(footprint, _parameter_bytes(model))
+
+        with self._lock:
+            entry.model = model
+            entry.footprint = footprint
+            entry.loads += 1
+            entry.last_load_seconds = seconds
+            entry.total_load_seconds += seconds
+            entry.loaded_at = entry.last_used = time.monotonic()
+            self._entries.move_to_end(entry.name)
+            self._enforce_budget(keep=entry.name)
+        logging.info(f"Model '{entry.name}' loaded in {seconds:.1f}s ({footprint / 1e6:.0f} MB)")
+
+    @contextlib.contextmanager
+    def pinned(self, name):
+        """Keep `name` resident (once loaded) for the duration of the block."""
+        with self._lock:
+            self._entry(name).pins += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry = self._entries[name]
+                entry.pins -= 1
+                entry.last_used = time.monotonic()
+
+    def is_resident(self, name):
+        entry = self._entries.get(name)
+        return entry is not None and entry.model is not None
+
+    # --- Unloading ---
+
+    def unload(self, name, reason="requested"):
+        """Drop the registry's reference to `name`. Returns False if it is pinned or not loaded."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.model is None or entry.pins:
+                return False
+            model, entry.model = entry.model, None
+            entry.loaded_at = None
+            if reason != "requested":
+                entry.evictions += 1
+        if entry.unloader is not None:
+            try:
+                entry.unloader(model)
+            except Exception as e:
+                logging.error(f"Unloading model '{name}' failed: {e}")
+        del model
+        _release_memory()
+        logging.info(f"Model '{name}' unloaded ({reason})")
+        return True
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(e.footprint for e in self._entries.values() if e.model is not None)
+
+    def _enforce_budget(self, keep, incoming=0):
+        """Unload least recently used, unpinned models until `incoming` more bytes fit."""
+        if not self.memory_budget_bytes:
+            return
+        for name, entry in list(self._entries.items()):
+            if self.resident_bytes() + incoming <= self.memory_budget_bytes:
+                return
+            if name != keep and entry.model is not None and not entry.pins:
+                self.unload(name, reason="memory budget")
+        if self.resident_bytes() + incoming > self.memory_budget_bytes:
+            logging.warning(f"Resident models ({self.resident_bytes() / 1e6:.0f} MB) exceed the "
+                            f"{self.memory_budget_bytes / 1e6:.0f} MB budget; the rest are in use")
+
+    def _start_reaper(self):
+        if self.idle_timeout and self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_idle, name="model-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_idle(self):
+        while True:
+            timeout = self.idle_timeout
+            time.sleep(min(30.0, timeout / 4) if timeout else 30.0)
+            if not timeout:
+                continue
+            now = time.monotonic()
+            with self._lock:
+                idle = [
+                    name for name, entry in self._entries.items()
+                    if entry.model is not None and not entry.pins and now - entry.last_used > timeout
+                ]
+            for name in idle:
+                self.unload(name, reason=f"idle > {timeout:g}s")
+
+    # --- Preloading ---
+
+    def preload(self, name, loader=None, unloader=None):
+        """Load `name` on a background thread. Returns the thread (None if already resident)."""
+        if self.is_resident(name):
+            return None
+
+        def run():
+            try:
+                self._get(name, loader, unloader, from_preload=True)
+            except Exception as e:
+                logging.error(f"Preloading model '{name}' failed: {e}")
+
+        thread = threading.Thread(target=run, name=f"preload-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _note_request(self, name):
+        if self._last_requested is not None and self._last_requested != name:
+            self._successors[self._last_requested][name] += 1
+        self._last_requested = name
+
+    def likely_next(self, name):
+        """The model most often requested after `name` (None if unknown)."""
+        with self._lock:
+            successors = self._successors.get(name)
+            return successors.most_common(1)[0][0] if successors else None
+
+    def _maybe_preload_next(self, name):
+        if not self.preload_next:
+            return
+        next_name = self.likely_next(name)
+        with self._lock:
+            entry = self._entries.get(next_name)
+            if entry is None or entry.model is not None or entry.loader is None:
+                return
+            # Only when it fits without evicting anything
+            if self.memory_budget_bytes and \
+                    self.resident_bytes() + entry.footprint > self.memory_budget_bytes:
+                return
+        logging.info(f"Preloading '{next_name}' (usually follows '{name}')")
+        self.preload(next_name)
+
+    # --- Reporting ---
+
+    def stats(self):
+        """Per-model load times and residency."""
+        now = time.monotonic()
+        with self._lock:
+            models = {
+                name: {
+                    "resident": entry.model is not None,
+                    "megabytes": round(entry.footprint / (1024 * 1024), 1),
+                    "loads": entry.loads,
+                    "hits": entry.hits,
+                    "evictions": entry.evictions,
+                    "last_load_seconds": round(entry.last_load_seconds, 2) if entry.last_load_seconds is not None else None,
+                    "total_load_seconds": round(entry.total_load_seconds, 2),
+                    "resident_seconds": round(now - entry.loaded_at, 1) if entry.model is not None else 0.0,
+                    "idle_seconds": round(now - entry.last_used, 1) if entry.last_used else None,
+                    "pinned": entry.pins > 0,
+                }
+                for name, entry in self._entries.items()
+            }
+            return {
+                "resident_megabytes": round(self.resident_bytes() / (1024 * 1024), 1),
+                "budget_megabytes": round(self.memory_budget_bytes / (1024 * 1024)) if self.memory_budget_bytes else None,
+                "idle_unload_seconds": self.idle_timeout,
+                "models": models,
+            }
+
+
+# Shared by every engine in the process
+registry = ModelRegistry()
@@ -1,116 +1,320 @@
 """
 Parkiet TTS Engine - Dutch text-to-speech using the Parkiet model.
 """
+import hashlib
 import os
+import time
 
-# Lazy-loaded globals to avoid slow imports on startup
-_model = None
-_processor = None
-_device = None
+from cancellation import Cancelled
+from model_registry import PARKIET, registry as models
 
+MODEL_CHECKPOINT = "pevers/parkiet"
+QUANTIZATION_MODES = ("none", "int8", "bf16")
+# Multi-GB model caches go to the per-user cache directory, not the source tree
+USER_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "erika-tts")
+QUANTIZED_CACHE_DIR = os.path.join(USER_CACHE_DIR, "parkiet_quantized")
+COMPILE_CACHE_DIR = os.path.join(USER_CACHE_DIR, "parkiet_compile")
+# Warm-up batches: torch specializes on batch size 1, and one batch of two
+# prompts of different lengths compiles the graph shared by all larger
+# micro-batches and prompt lengths
+WARMUP_BATCHES = (
+    ["[S1] Hallo, dit is een test."],
+    ["[S1] Hallo.", "[S1] Goedemorgen, dit is een wat langere test van de spraak."],
+)
+WARMUP_TOKENS = 16
 
-def _load_model(device="cuda"):
-    """Lazy load the Parkiet model and processor."""
-    global _model, _processor, _device
+_device = None        # Device of the resident model
+_quantization = None  # Quantization mode of the resident model
+
+
+def _resolve_device(device):
     import torch
 
-    if _model is None or _device != device:
-        print("Loading Parkiet model (this may take a moment on first run)...")
-        from transformers import AutoProcessor, DiaForConditionalGeneration
+    # Fall back to CPU if CUDA requested but not available
+    if device == "cuda" and not torch.cuda.is_available():
+        return "cpu"
+    return device
 
-        model_checkpoint = "pevers/parkiet"
 
-        # Fall back to CPU if CUDA requested but not available
-        if device == "cuda" and not torch.cuda.is_available():
-            print("CUDA not available, falling back to CPU (this will be slower)")
-            device = "cpu"
+def bf16_supported():
+    """True if this CPU has native bfloat16 matmuls (AVX512-BF16 or AMX)."""
+    import torch
 
-        _device = device
+    check = getattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", None)
+    return bool(check is not None and check())
 
-        _processor = AutoProcessor.from_pretrained(model_checkpoint)
-        _model = DiaForConditionalGeneration.from_pretrained(model_checkpoint).to(_device)
-        print(f"Parkiet model loaded on {_device}")
 
-    return _model, _processor
+def _resolve_quantization(quantization, device):
+    mode = (quantization or "none").lower()
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown Parkiet quantization '{quantization}' (use one of {', '.join(QUANTIZATION_MODES)})")
+    # int8 dynamic quantization only has CPU kernels; bf16 on CPU needs native support
+    if mode == "int8" and device != "cpu":
+        return "none"
+    if mode == "bf16" and device == "cpu" and not bf16_supported():
+        return "none"
+    return mode
 
 
-def generate_dutch_speech(text, output_path, settings=None):
+def _quantized_cache_path(mode):
+    import torch
+    import transformers
+
+    # Pickled modules are only valid for the library versions that wrote them
+    tag = f"{MODEL_CHECKPOINT}|{mode}|torch {torch.__version__}|transformers {transformers.__version__}"
+    digest = hashlib.sha256(tag.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(QUANTIZED_CACHE_DIR, f"parkiet-{mode}-{digest}.pt")
+
+
+def _quantize(model, mode):
+    import torch
+
+    if mode == "int8":
+        # Dynamic quantization: int8 Linear weights, activations quantized on the fly
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model.to(torch.bfloat16)
+
+
+def _load_quantized_model(mode):
+    """Quantized Dia model, from the on-disk cache when a previous load already built it."""
+    import torch
+    from transformers import DiaForConditionalGeneration
+
+    path = _quantized_cache_path(mode)
+    if os.path.exists(path):
+        try:
+            # Written by this module (see below), so unpickling the full module is safe
+            model = torch.load(path, map_location="cpu", weights_only=False)
+            print(f"Loaded cached {mode} Parkiet weights from {path}")
+            return model
+        except Exception as e:
+            print(f"Ignoring unreadable quantized model cache {path}: {e}")
+
+    model = DiaForConditionalGeneration.from_pretrained(MODEL_CHECKPOINT)
+    start = time.perf_counter()
+    model = _quantize(model.eval(), mode)
+    print(f"Quantized Parkiet to {mode} in {time.perf_counter() - start:.1f}s")
+
+    os.makedirs(QUANTIZED_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        torch.save(model, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not cache quantized Parkiet model: {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return model
+
+
+def _build_model(requested_device, device, requested_quantization, quantization):
+    global _device, _quantization
+    print("Loading Parkiet model (this may take a moment on first run)...")
+    from transformers import AutoProcessor, DiaForConditionalGeneration
+
+    if device != requested_device:
+        print("CUDA not available, falling back to CPU (this will be slower)")
+    if quantization != (requested_quantization or "none").lower():
+        print(f"{requested_quantization} quantization is not supported on this {device}, using full precision")
+
+    processor = AutoProcessor.from_pretrained(MODEL_CHECKPOINT)
+    if quantization == "none":
+        model = DiaForConditionalGeneration.from_pretrained(MODEL_CHECKPOINT)
+    else:
+        model = _load_quantized_model(quantization)
+    model = model.to(device)
+    _device, _quantization = device, quantization
+    print(f"Parkiet model loaded on {device} ({quantization if quantization != 'none' else 'fp32'})")
+    return model, processor
+
+
+def _unload_model(model_and_processor):
+    global _device, _quantization
+    _device = _quantization = None
+
+
+def _load_model(device="cuda", quantization=None):
+    """Lazy load the Parkiet model and processor (resident in model_registry)."""
+    resolved = _resolve_device(device)
+    mode = _resolve_quantization(quantization, resolved)
+    # Asking for another device or quantization replaces the resident model
+    if _device is not None and (_device, _quantization) != (resolved, mode) \
+            and not models.unload(PARKIET, reason=f"switching to {resolved}/{mode}"):
+        print(f"Parkiet model is in use on {_device}/{_quantization}, not switching to {resolved}/{mode}")
+    return models.get(PARKIET, lambda: _build_model(device, resolved, quantization, mode), _unload_model)
+
+
+def _enable_fast_decode(model, processor):
     """
-    Generate Dutch speech using the Parkiet model.
+    Compile the model's forward pass for static-cache decoding, once per
+    resident model, and run short generations so the first real request
+    does not pay for compilation. Batch size and sequence length are
+    compiled as dynamic, so micro-batches of any size and prompts of any
+    length reuse the warmed-up kernels instead of recompiling. Returns False
+    (model stays eager) if the model or this torch build cannot do it.
+    """
+    if hasattr(model, "_compiled_forward"):
+        return model._compiled_forward is not None
+    import torch
+
+    # Inductor's compiled kernels are reused by later processes of this user
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+    model._eager_forward = model.forward
+    model._compiled_forward = None
+    try:
+        model.forward = torch.compile(model._eager_forward, dynamic=True)
+        start = time.perf_counter()
+        # Same grad mode as real requests (generate() runs under no_grad);
+        # warming up under inference_mode would compile graphs they can't reuse
+        for prompts in WARMUP_BATCHES:
+            inputs = processor(text=prompts, padding=True, return_tensors="pt").to(_device)
+            model.generate(**inputs, max_new_tokens=WARMUP_TOKENS, cache_implementation="static")
+        model._compiled_forward = model.forward
+        print(f"Parkiet fast decode ready (compiled and warmed up in {time.perf_counter() - start:.1f}s)")
+    except Exception as e:
+        print(f"Parkiet fast decode unavailable, using eager generation: {e}")
+    model.forward = model._eager_forward
+    return model._compiled_forward is not None
+
+
+def _use_fast_decode(model, enabled):
+    """Switch the resident model between its compiled and eager forward pass."""
+    if getattr(model, "_compiled_forward", None) is not None:
+        model.forward = model._compiled_forward if enabled else model._eager_forward
+
+
+SAMPLE_RATE = 44100  # Parkiet outputs at 44100 Hz
+
+DEFAULT_SETTINGS = {
+    "device": "cuda",
+    "quantization": "none",  # "int8" or "bf16" for faster CPU inference
+    "fast_decode": False,    # Static KV cache + torch.compile'd decode step
+    "max_new_tokens": 3072,
+    "guidance_scale": 3.0,
+    "temperature": 1.8,
+    "top_p": 0.90,
+    "top_k": 50,
+}
+
+
+def _write_audio(output_path, audio_data):
+    import soundfile as sf
+
+    # Ensure output directory exists
+    os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else ".", exist_ok=True)
+    sf.write(output_path, audio_data, SAMPLE_RATE)
+
+
+def _cancel_criteria(cancel):
+    """StoppingCriteria that ends generation at the next decode step once `cancel` is cancelled."""
+    import torch
+    from transformers import StoppingCriteria
+
+    class CancelCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), cancel.cancelled, dtype=torch.bool, device=input_ids.device)
+
+    return CancelCriteria()
+
+
+def generate_dutch_speech_batch(texts, output_paths=None, settings=None, cancel=None):
+    """
+    Generate Dutch speech for several texts in a single generate call.
+
+    The processor right-pads the prompts to a common length and the model
+    stops each item at its own EOS; batch_decode trims every item to its own
+    length, so the results match one-at-a-time generation.
 
     Args:
-        text: The Dutch text to synthesize
-        output_path: Path to save the output audio file
+        texts: List of Dutch texts to synthesize
+        output_paths: Optional list of paths to save each item to
         settings: Dictionary with generation settings (optional)
+        cancel: Optional cancellation.CancelToken; generation stops at the
+                next decode step once it is cancelled and Cancelled is raised
 
     Returns:
-        bool: True if successful, False otherwise
+        list: One float32 numpy array per text, or None for items that failed
     """
-    import soundfile as sf
-
     # Default settings
-    default_settings = {
-        "device": "cuda",
-        "max_new_tokens": 3072,
-        "guidance_scale": 3.0,
-        "temperature": 1.8,
-        "top_p": 0.90,
-        "top_k": 50,
-    }
-
+    generation_settings = dict(DEFAULT_SETTINGS)
     if settings:
-        default_settings.update(settings)
+        generation_settings.update(settings)
 
-    device = default_settings.pop("device")
+    device = generation_settings.pop("device")
+    quantization = generation_settings.pop("quantization")
+    fast_decode = generation_settings.pop("fast_decode")
 
     try:
-        model, processor = _load_model(device)
+        _load_model(device, quantization)  # Load (or switch variants) before pinning
+        with models.pinned(PARKIET):
+            model, processor = _load_model(device, quantization)
 
-        # Use the actual device the model is on (may have fallen back to CPU)
-        actual_device = _device
+            # Parkiet expects speaker tags - add default [S1] if not present
+            prompts = [
+                text if "[S1]" in text or "[S2]" in text else f"[S1] {text}"
+                for text in texts
+            ]
 
-        # Parkiet expects speaker tags - add default [S1] if not present
-        if "[S1]" not in text and "[S2]" not in text:
-            text = f"[S1] {text}"
+            # Process input - use _device which may have fallen back to CPU
+            inputs = processor(text=prompts, padding=True, return_tensors="pt").to(_device)
 
-        # Process input - use actual_device which may have fallen back to CPU
-        inputs = processor(text=text, padding=True, return_tensors="pt").to(actual_device)
+            # Preallocated KV cache instead of one that grows every step, so the
+            # compiled decode step sees the same shapes for all 3072 steps
+            fast_decode = fast_decode and _enable_fast_decode(model, processor)
+            _use_fast_decode(model, fast_decode)
+            if fast_decode:
+                generation_settings["cache_implementation"] = "static"
 
-        # Generate audio
-        print("Generating Dutch speech...")
-        outputs = model.generate(
-            **inputs,
-            **default_settings
-        )
+            if cancel is not None:
+                from transformers import StoppingCriteriaList
+                generation_settings["stopping_criteria"] = StoppingCriteriaList([_cancel_criteria(cancel)])
 
-        # Decode and save
-        audio_outputs = processor.batch_decode(outputs)
+            # Generate audio
+            print(f"Generating Dutch speech ({len(prompts)} items)...")
+            outputs = model.generate(
+                **inputs,
+                **generation_settings
+            )
+            if cancel is not None:
+                cancel.check()
 
-        # The processor returns audio arrays - save the first one
-        if audio_outputs and len(audio_outputs) > 0:
-            audio_data = audio_outputs[0]
+            # Decode - one audio array per input, trimmed at its own EOS
+            audio_outputs = processor.batch_decode(outputs)
 
-            # Ensure output directory exists
-            os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else ".", exist_ok=True)
+    except Cancelled:
+        raise
+    except Exception as e:
+        print(f"Error generating Dutch speech: {e}")
+        return [None] * len(texts)
 
-            # Parkiet outputs at 44100 Hz sample rate
-            sample_rate = 44100
+    results = []
+    for index in range(len(texts)):
+        audio_data = audio_outputs[index] if index < len(audio_outputs) else None
+        if audio_data is None or len(audio_data) == 0:
+            print(f"Error: No audio output generated for item {index}")
+            results.append(None)
+            continue
+        audio_data = audio_data.float().cpu().numpy() if hasattr(audio_data, "cpu") else audio_data
+        results.append(audio_data)
+        if output_paths and output_paths[index]:
+            _write_audio(output_paths[index], audio_data)
+    return results
 
-            # Handle .wav extension (convert if needed)
-            if output_path.endswith(".wav"):
-                sf.write(output_path, audio_data, sample_rate)
-            else:
-                # Default to wav
-                sf.write(output_path, audio_data, sample_rate)
 
-            return True
-        else:
-            print("Error: No audio output generated")
-            return False
+def generate_dutch_speech(text, output_path, settings=None):
+    """
+    Generate Dutch speech using the Parkiet model.
 
-    except Exception as e:
-        print(f"Error generating Dutch speech: {e}")
-        return False
+    Args:
+        text: The Dutch text to synthesize
+        output_path: Path to save the output audio file
+        settings: Dictionary with generation settings (optional)
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    return generate_dutch_speech_batch([text], [output_path], settings)[0] is not None
 
 
 def is_available():
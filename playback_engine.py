@@ -0,0 +1,623 @@
+"""
+Long-lived playback engine: one output sink fed from a ring buffer.
+
+Segments (whole buffers or streams of chunks) are queued and copied into a
+single-producer/single-consumer ring buffer back to back, so consecutive
+segments play without a gap and without starting a new player per clip. A
+feeder thread fills the ring; the output thread drains it in fixed blocks
+into the sink at the sink's pace. If the ring runs dry in the middle of a
+segment (a stream generated slower than real time), the output thread plays
+silence and counts an underrun. Cancelling a segment (barge-in) stops
+feeding it and skips whatever of it is still buffered, so playback stops
+within one block.
+
+Sinks: sounddevice (PortAudio, the default and the only gapless device
+sink), simpleaudio (fallback: one buffer per segment), null (discards the
+audio, at real-time pace or instantly) and file (writes what would have been
+played to a WAV), so the engine also runs headless.
+"""
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from cancellation import Cancelled
+
+DEFAULT_BUFFER_SECONDS = 2.0
+DEFAULT_BLOCK_MS = 20
+IDLE_POLL_SECONDS = 0.05
+
+
+class RingBuffer:
+    """
+    Fixed-size float32 ring for one producer thread and one consumer thread.
+
+    The producer only advances `write_position` and the consumer only
+    `read_position` (both count frames since creation), each after its copy
+    is complete, so neither side needs a lock.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity, dtype=np.float32)
+        self.write_position = 0
+        self.read_position = 0
+
+    def available(self):
+        return self.write_position - self.read_position
+
+    def free(self):
+        return self.capacity - self.available()
+
+    def write(self, samples):
+        """Copy as much of `samples` as fits. Returns the number of frames written."""
+        count = min(len(samples), self.free())
+        start = self.write_position % self.capacity
+        first = min(count, self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[:count - first] = samples[first:count]
+        self.write_position += count
+        return count
+
+    def read(self, out):
+        """Fill the front of `out` with up to len(out) frames. Returns the number of frames read."""
+        count = min(len(out), self.available())
+        start = self.read_position % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self._data[start:start + first]
+        out[first:count] = self._data[:count - first]
+        self.read_position += count
+        return count
+
+
+# --- Sinks ---
+
+class NullSink:
+    """Discards audio. With realtime=True it takes as long as playing would."""
+
+    name = "null"
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.sample_rate = None
+        self.frames = 0
+        self._clock = None
+
+    def open(self, sample_rate):
+        self.sample_rate = sample_rate
+        self._clock = time.perf_counter()
+
+    def write(self, block):
+        self.frames += len(block)
+        if self.realtime:
+            # Sleep until the device clock would have consumed this block
+            self._clock = max(self._clock, time.perf_counter()) + len(block) / self.sample_rate
+            delay = self._clock - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def pending_seconds(self):
+        """Seconds of written audio not heard yet."""
+        if not self.realtime or self._clock is None:
+            return 0.0
+        return max(0.0, self._clock - time.perf_counter())
+
+    def stop(self):
+        """Drop audio handed over but not played yet (nothing is buffered here)."""
+
+    def close(self):
+        pass
+
+
+class FileSink(NullSink):
+    """
+    Writes everything played to a WAV file (a numbered file per sample rate
+    change). Runs instantly unless realtime=True.
+    """
+
+    name = "file"
+
+    def __init__(self, path, realtime=False):
+        super().__init__(realtime)
+        self.path = path
+        self.paths = []
+        self._writer = None
+
+    def open(self, sample_rate):
+        from wav_writer import WavWriter
+
+        super().open(sample_rate)
+        self.close()
+        base, extension = os.path.splitext(self.path)
+        path = self.path if not self.paths else f"{base}_{len(self.paths) + 1}{extension or '.wav'}"
+        self._writer = WavWriter(path, sample_rate)
+        self.paths.append(path)
+
+    def write(self, block):
+        self._writer.write(block)
+        super().write(block)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class SounddeviceSink:
+    """Continuous PortAudio output stream; blocking writes keep the pace."""
+
+    name = "sounddevice"
+
+    def __init__(self):
+        self._stream = None
+        self._written_at = 0.0
+        self.device_underruns = 0
+
+    def open(self, sample_rate):
+        import sounddevice as sd
+
+        self.close()
+        self._stream = sd.OutputStream(samplerate=sample_rate, channels=1, dtype="float32", latency="low")
+        self._stream.start()
+
+    def write(self, block):
+        if self._stream.write(block.reshape(-1, 1)):
+            self.device_underruns += 1
+        self._written_at = time.perf_counter()
+
+    def pending_seconds(self):
+        # A blocking write returns once the block fits in the device buffer,
+        # which then holds about one output latency of audio
+        if self._stream is None:
+            return 0.0
+        return max(0.0, self._stream.latency - (time.perf_counter() - self._written_at))
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.abort()  # Discards the device buffer, unlike stop()
+            self._stream.start()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+
+class SimpleaudioSink:
+    """
+    Fallback device sink for when PortAudio is missing. simpleaudio has no
+    continuous stream and every buffer it starts opens the device anew, so
+    playing blocks back to back leaves a seam after each one. Instead the
+    blocks of a segment are collected and the whole segment is played as one
+    buffer once the engine reports its end: one gap per clip, and a stream
+    starts only once it is fully generated.
+    """
+
+    name = "simpleaudio"
+    realtime = False  # Writes only collect audio; the engine must not pace them
+
+    def __init__(self):
+        self.sample_rate = None
+        self._pending = []
+        self._playing = None
+        self._ends_at = 0.0
+
+    def open(self, sample_rate):
+        self.close()
+        self.sample_rate = sample_rate
+
+    def write(self, block):
+        self._pending.append(block.copy())
+
+    def segment_end(self):
+        """Play everything written since the last segment as one buffer."""
+        import simpleaudio as sa
+
+        if not self._pending:
+            return
+        pcm = (np.clip(np.concatenate(self._pending), -1.0, 1.0) * 32767).astype(np.int16)
+        self._pending = []
+        if self._playing is not None:
+            self._playing.wait_done()
+        self._playing = sa.play_buffer(pcm, 1, 2, self.sample_rate)
+        self._ends_at = time.perf_counter() + len(pcm) / self.sample_rate
+
+    def pending_seconds(self):
+        pending = sum(len(block) for block in self._pending) / self.sample_rate if self._pending else 0.0
+        return max(0.0, self._ends_at - time.perf_counter()) + pending
+
+    def stop(self):
+        self._pending = []
+        self._ends_at = 0.0
+        if self._playing is not None:
+            self._playing.stop()
+            self._playing = None
+
+    def close(self):
+        self.segment_end()
+        if self._playing is not None:
+            self._playing.wait_done()
+            self._playing = None
+
+
+def create_sink(spec="auto"):
+    """
+    Sink from a name: "auto" (sounddevice, or simpleaudio if PortAudio is missing),
+    "sounddevice", "simpleaudio", "null", "null:fast" or "file:PATH".
+    """
+    spec = spec or "auto"
+    if spec == "auto":
+        try:
+            import sounddevice  # noqa: F401
+            return SounddeviceSink()
+        except (ImportError, OSError):
+            return SimpleaudioSink()
+    if spec == "sounddevice":
+        return SounddeviceSink()
+    if spec == "simpleaudio":
+        return SimpleaudioSink()
+    if spec == "null":
+        return NullSink(realtime=True)
+    if spec == "null:fast":
+        return NullSink(realtime=False)
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):])
+    raise ValueError(f"Unknown playback sink '{spec}'")
+
+
+# --- Engine ---
+
+class Segment:
+    """One queued clip or stream. `wait()` blocks until it has been played (or cancelled)."""
+
+    def __init__(self, chunks, sample_rate):
+        self.chunks = chunks
+        self.sample_rate = int(sample_rate)
+        self.frames = 0              # Frames copied into the ring so far
+        self.start_position = None   # Ring position of its first frame
+        self.end_position = None     # Ring position after its last frame, once fully fed
+        self.queued_at = time.perf_counter()
+        self.started_at = None       # When its first frame reached the sink
+        self.heard_at = None         # When the sink will have played its last frame
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+        self._unlink = None          # Unregisters the cancel-token callback
+
+    def wait(self, timeout=None):
+        """
+        Wait until played. Returns False on timeout; raises Cancelled if the
+        segment was cancelled and re-raises a failure of the chunk source.
+        """
+        if not self.done.wait(timeout):
+            return False
+        if self.cancelled:
+            raise Cancelled("playback cancelled")
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def _finish(self):
+        if self._unlink is not None:
+            self._unlink()
+        self.done.set()
+
+
+class PlaybackEngine:
+    """
+    Args:
+        sink: Output sink (see create_sink)
+        buffer_seconds: Ring buffer capacity
+        block_ms: Frames handed to the sink per write (the sink may ask for more)
+    """
+
+    def __init__(self, sink=None, buffer_seconds=DEFAULT_BUFFER_SECONDS, block_ms=DEFAULT_BLOCK_MS):
+        self.sink = sink or create_sink()
+        self.buffer_seconds = buffer_seconds
+        self.block_ms = max(block_ms, getattr(self.sink, "block_ms", 0))
+        self.sample_rate = None       # Rate the ring and the open sink run at
+        self._ring = None
+        self._queue = queue.Queue()   # Segments waiting for the feeder
+        self._active = collections.deque()  # Segments in the ring, oldest first
+        self._feeding = None
+        self._lock = threading.Lock()
+        self._space = threading.Event()
+        self._data = threading.Event()
+        self._closed = False
+        self.segments = 0
+        self.seconds_played = 0.0  # Summed per block, so rate switches are counted right
+        self.underruns = 0
+        self.underrun_seconds = 0.0
+        self.sink_opens = 0
+        self.cancelled = 0
+        self._starved = False
+        self._starved_since = None
+        # Silence for underruns only makes sense when the sink keeps real time
+        self._realtime = getattr(self.sink, "realtime", True)
+        self._feeder = threading.Thread(target=self._feed_loop, name="playback-feeder", daemon=True)
+        self._output = threading.Thread(target=self._output_loop, name="playback-output", daemon=True)
+        self._feeder.start()
+        self._output.start()
+
+    @classmethod
+    def from_config(cls, config):
+        """Engine for a {"sink", "buffer_seconds", "block_ms"} block."""
+        config = config or {}
+        return cls(create_sink(config.get("sink", "auto")),
+                   config.get("buffer_seconds", DEFAULT_BUFFER_SECONDS),
+                   config.get("block_ms", DEFAULT_BLOCK_MS))
+
+    # --- Queueing ---
+
+    def play(self, audio, wait=True, cancel=None):
+        """Queue an AudioBuffer behind whatever is playing. Returns its Segment."""
+        segment = self.stream([audio.samples], audio.sample_rate, cancel)
+        if wait:
+            segment.wait()
+        return segment
+
+    def stream(self, chunks, sample_rate, cancel=None):
+        """
+        Queue an iterable of float32 chunks; playback starts with the first
+        chunk. The iterable is consumed on the feeder thread. Returns its Segment.
+        Cancelling `cancel` (a cancellation.CancelToken) stops the segment.
+        """
+        if self._closed:
+            raise RuntimeError("Playback engine is closed")
+        segment = Segment(chunks, sample_rate)
+        if cancel is not None:
+            segment._unlink = cancel.on_cancel(lambda: self.cancel(segment))
+        self._queue.put(segment)
+        return segment
+
+    def cancel(self, segment):
+        """
+        Stop `segment` now: the feeder stops pulling its chunks (closing the
+        source generator) and the output thread skips what is buffered.
+        """
+        with self._lock:
+            if segment.done.is_set() or segment.cancelled:
+                return
+            segment.cancelled = True
+        self._space.set()
+        self._data.set()
+
+    def wait_idle(self, timeout=None):
+        """Block until everything queued so far has been played."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self._queue.empty() or self._feeding is not None or self._active:
+            if deadline is not None and time.perf_counter() > deadline:
+                return False
+            time.sleep(IDLE_POLL_SECONDS / 5)
+        return True
+
+    # --- Feeder thread ---
+
+    def _feed_loop(self):
+        while True:
+            segment = self._queue.get()
+            if segment is None:
+                return
+            if segment.cancelled:
+                self._close_source(segment)
+                with self._lock:
+                    self.cancelled += 1
+                segment._finish()
+                continue
+            if segment.sample_rate != self.sample_rate:
+                self._switch_rate(segment.sample_rate)
+            with self._lock:
+                segment.start_position = self._ring.write_position
+                self._feeding = segment
+                self._active.append(segment)
+            try:
+                for chunk in segment.chunks:
+                    if segment.cancelled:
+                        break
+                    chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+                    self._write(chunk, segment)
+                    segment.frames += len(chunk)
+            except Exception as e:
+                if not segment.cancelled:
+                    logging.error(f"Playback source failed: {e}")
+                    segment.error = e
+            if segment.cancelled:
+                self._close_source(segment)
+            with self._lock:
+                segment.end_position = self._ring.write_position
+                self._feeding = None
+            self._data.set()
+
+    @staticmethod
+    def _close_source(segment):
+        # Stops a generator source (and the generation behind it) right away
+        close = getattr(segment.chunks, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                logging.warning(f"Closing a cancelled playback source failed: {e}")
+
+    def _write(self, samples, segment):
+        while len(samples) and not segment.cancelled:
+            written = self._ring.write(samples)
+            samples = samples[written:]
+            self._data.set()
+            if len(samples):
+                self._space.clear()
+                if not self._ring.free():
+                    self._space.wait(IDLE_POLL_SECONDS)
+
+    def _switch_rate(self, sample_rate):
+        # Let the output thread play out the old rate, then resize the ring for the new one
+        while self._active:
+            time.sleep(IDLE_POLL_SECONDS / 5)
+        with self._lock:
+            self._ring = RingBuffer(max(1, int(sample_rate * self.buffer_seconds)))
+            self.sample_rate = sample_rate
+
+    # --- Output thread ---
+
+    def _output_loop(self):
+        block = None
+        sink_rate = None
+        while not self._closed:
+            with self._lock:
+                ring, sample_rate = self._ring, self.sample_rate
+            if ring is not None and self._skip_cancelled(ring) and sink_rate is not None:
+                self.sink.stop()
+            if ring is None or not ring.available():
+                self._data.clear()
+                self._finish_segments(ring)
+                if ring is None or not (self._realtime and self._mid_segment()):
+                    self._end_starvation()
+                    self._data.wait(IDLE_POLL_SECONDS)
+                    continue
+
+            if sample_rate != sink_rate:
+                self.sink.open(sample_rate)
+                self.sink_opens += 1
+                sink_rate = sample_rate
+                block = np.zeros(max(1, sample_rate * self.block_ms // 1000), dtype=np.float32)
+
+            count = ring.read(block)
+            self._space.set()
+            ran_dry_at = None
+            if count < len(block) and self._realtime and self._mid_segment():
+                # Give the source until this block is due before calling it an underrun
+                ran_dry_at = time.perf_counter()
+                self._data.clear()
+                self._data.wait(len(block) / sample_rate)
+                count += ring.read(block[count:])
+                self._space.set()
+            if count < len(block) and self._realtime and self._mid_segment():
+                # The source is behind real time: fill the block with silence
+                block[count:] = 0.0
+                if not self._starved:
+                    self.underruns += 1
+                    self._starved = True
+                    self._starved_since = ran_dry_at or time.perf_counter()
+                self._mark_started(ring)
+                self.sink.write(block)
+            elif count:
+                self._end_starvation()
+                self._mark_started(ring)
+                self.sink.write(block[:count])
+            self.seconds_played += count / sample_rate
+            self._finish_segments(ring)
+
+    def _end_starvation(self):
+        # Underrun time is wall-clock time from the ring running dry to the next data
+        if self._starved:
+            self.underrun_seconds += time.perf_counter() - self._starved_since
+            self._starved = False
+
+    def _mid_segment(self):
+        """True while a segment that has already produced audio is still being fed."""
+        feeding = self._feeding
+        return feeding is not None and feeding.frames > 0 and not feeding.cancelled
+
+    def _skip_cancelled(self, ring):
+        """
+        Drop the buffered audio of cancelled segments at the head of the ring
+        (only this thread moves the read position). Returns True if a segment
+        that had started playing was cut off.
+        """
+        cut = False
+        with self._lock:
+            while self._active and self._active[0].cancelled:
+                segment = self._active[0]
+                end = segment.end_position if segment.end_position is not None else ring.write_position
+                if ring.read_position < end:
+                    cut = cut or segment.started_at is not None
+                    ring.read_position = end
+                    self._space.set()
+                if segment.end_position is None:
+                    break  # Still being fed; the feeder stops it at its next chunk
+                self._active.popleft()
+                self.cancelled += 1
+                segment._finish()
+        return cut
+
+    def _mark_started(self, ring):
+        now = time.perf_counter()
+        for segment in list(self._active):
+            if segment.started_at is None and segment.start_position is not None \
+                    and ring.read_position > segment.start_position:
+                segment.started_at = now
+
+    def _finish_segments(self, ring):
+        # A segment is done once the sink has played its last frame, not when
+        # that frame was handed over (the sink still holds up to its latency)
+        while True:
+            with self._lock:
+                if not self._active or ring is None:
+                    return
+                segment = self._active[0]
+                if segment.end_position is None or ring.read_position < segment.end_position:
+                    return
+                if segment.heard_at is not None:
+                    if time.perf_counter() < segment.heard_at:
+                        return
+                    self._active.popleft()
+                    self.segments += 1
+                    segment._finish()
+                    continue
+            # Outside the lock: the simpleaudio sink waits for its previous buffer here
+            segment_end = getattr(self.sink, "segment_end", None)
+            if segment_end is not None:
+                segment_end()
+            segment.heard_at = time.perf_counter() + self.sink.pending_seconds()
+
+    # --- Reporting / shutdown ---
+
+    def stats(self):
+        return {
+            "sink": self.sink.name,
+            "sample_rate": self.sample_rate,
+            "segments": self.segments,
+            "queued": self._queue.qsize() + len(self._active),
+            "seconds_played": round(self.seconds_played, 2),
+            "buffered_seconds": round(self._ring.available() / self.sample_rate, 3) if self._ring else 0.0,
+            "underruns": self.underruns,
+            "underrun_seconds": round(self.underrun_seconds, 3),
+            "sink_opens": self.sink_opens,
+            "cancelled": self.cancelled,
+        }
+
+    def close(self, drain=True):
+        """Stop the engine, by default after playing everything queued."""
+        if drain:
+            self.wait_idle()
+        self._closed = True
+        self._queue.put(None)
+        self._data.set()
+        self._output.join(timeout=1.0)
+        self.sink.close()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(config=None):
+    """The process-wide playback engine, created from `config` on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PlaybackEngine.from_config(config)
+        return _engine
+
+
+def close_engine():
+    """Play out and close the process-wide engine, if one was created (call before exiting)."""
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine is not None:
+        engine.close()
@@ -0,0 +1,284 @@
+"""
+Pool of Pocket TTS replicas, one process per disjoint set of CPU cores.
+
+Pocket TTS only uses about two cores, so a single model instance leaves most
+of a large host idle. Each replica is a spawned process pinned to its own
+cores, with torch limited to that many threads, and holds its own model.
+Requests go to the replica with the fewest outstanding jobs; batches are
+split across replicas.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from audio_buffer import AudioBuffer
+
+THREADS_PER_REPLICA = 2  # Pocket TTS runs best on two cores
+START_TIMEOUT = 300      # Seconds for a replica to load its model
+
+
+def available_cores():
+    """CPU ids this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def default_replicas(threads_per_replica=THREADS_PER_REPLICA):
+    """One replica per `threads_per_replica` available cores."""
+    return max(1, len(available_cores()) // threads_per_replica)
+
+
+def _pin_to_cores(cores):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+        return True
+    try:
+        import psutil
+        psutil.Process().cpu_affinity(list(cores))
+        return True
+    except (ImportError, AttributeError, OSError):
+        return False  # No affinity API on this platform; thread limits still apply
+
+
+# --- Replica process ---
+
+def _replica_main(index, cores, threads, settings, conn):
+    # Must be set before torch is imported in this process
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    pinned = _pin_to_cores(cores)
+
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    import tts_engines
+    try:
+        tts_engines.get_english_sample_rate(settings)  # Load the model before taking requests
+    except Exception as e:
+        conn.send(("failed", str(e)))
+        return
+    conn.send(("ready", {"pid": os.getpid(), "pinned": pinned}))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        job_id, op, kwargs = message
+        start = time.perf_counter()
+        try:
+            if op == "synthesize" and kwargs.get("output_path"):
+                result = tts_engines.generate_english(
+                    kwargs["text"], kwargs["settings"], kwargs.get("voice"), kwargs["output_path"])
+            elif op == "synthesize":
+                result = tts_engines.synthesize_english(kwargs["text"], kwargs["settings"], kwargs.get("voice"))
+            elif op == "synthesize_batch":
+                output_paths = kwargs.get("output_paths")
+                audio = tts_engines.generate_english_batch(
+                    kwargs["texts"], kwargs["settings"], kwargs.get("voice"), output_paths)
+                if output_paths:
+                    result = [a is not None for a in audio]  # The audio itself stays on disk
+                else:
+                    sample_rate = tts_engines.get_english_sample_rate(kwargs["settings"])
+                    result = [AudioBuffer(a, sample_rate) if a is not None else None for a in audio]
+            else:
+                raise ValueError(f"Unknown replica op: {op}")
+            conn.send((job_id, True, result, time.perf_counter() - start))
+        except Exception as e:
+            logging.error(f"Replica {index}: {op} failed: {e}")
+            conn.send((job_id, False, str(e), time.perf_counter() - start))
+
+
+# --- Parent side ---
+
+class _Replica:
+    def __init__(self, index, cores):
+        self.index = index
+        self.cores = cores
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.pinned = False
+        self.alive = False
+        self.send_lock = threading.Lock()
+        self.pending = {}  # job id -> Future
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+
+
+class PocketReplicaPool:
+    """
+    Args:
+        settings: Settings dict the replicas load the model with (generation_settings)
+        replicas: Number of processes (None = one per `threads_per_replica` cores)
+        threads_per_replica: Torch threads and pinned cores per replica
+    """
+
+    def __init__(self, settings, replicas=None, threads_per_replica=THREADS_PER_REPLICA):
+        cores = available_cores()
+        self.threads_per_replica = threads_per_replica
+        count = replicas or default_replicas(threads_per_replica)
+        if count * threads_per_replica > len(cores):
+            logging.warning(f"{count} replicas x {threads_per_replica} threads exceed the {len(cores)} "
+                            f"available cores; core sets will overlap")
+        self.replicas = []
+        for i in range(count):
+            replica_cores = {cores[(i * threads_per_replica + j) % len(cores)] for j in range(threads_per_replica)}
+            self.replicas.append(_Replica(i, sorted(replica_cores)))
+        self._settings = settings
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closing = False
+        self._start()
+
+    def _start(self):
+        context = multiprocessing.get_context("spawn")
+        for replica in self.replicas:
+            parent_conn, child_conn = context.Pipe()
+            replica.conn = parent_conn
+            replica.process = context.Process(
+                target=_replica_main,
+                args=(replica.index, replica.cores, self.threads_per_replica, self._settings, child_conn),
+                name=f"pocket-replica-{replica.index}",
+                daemon=True,
+            )
+            replica.process.start()
+            child_conn.close()
+
+        # Replicas load their models in parallel
+        for replica in self.replicas:
+            if not replica.conn.poll(START_TIMEOUT):
+                logging.error(f"Pocket replica {replica.index} did not start within {START_TIMEOUT}s")
+                replica.process.terminate()
+                continue
+            status, info = replica.conn.recv()
+            if status != "ready":
+                logging.error(f"Pocket replica {replica.index} failed to load: {info}")
+                continue
+            replica.pid, replica.pinned = info["pid"], info["pinned"]
+            replica.alive = True
+            replica.started_at = time.monotonic()
+            threading.Thread(target=self._receive, args=(replica,), daemon=True,
+                             name=f"pocket-replica-{replica.index}-results").start()
+            logging.info(f"Pocket replica {replica.index} ready (pid {replica.pid}, cores {replica.cores})")
+
+        if not any(r.alive for r in self.replicas):
+            raise RuntimeError("No Pocket TTS replica could be started")
+
+    def _receive(self, replica):
+        while True:
+            try:
+                job_id, ok, result, seconds = replica.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = replica.pending.pop(job_id, None)
+                replica.busy_seconds += seconds
+                if ok:
+                    replica.completed += 1
+                else:
+                    replica.failed += 1
+            if future is not None:
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(result))
+
+        # The process exited: fail whatever it still had queued
+        with self._lock:
+            replica.alive = False
+            orphans, replica.pending = replica.pending, {}
+        if not self._closing:
+            logging.error(f"Pocket replica {replica.index} (pid {replica.pid}) exited")
+        for future in orphans.values():
+            future.set_exception(RuntimeError(f"Pocket replica {replica.index} exited"))
+
+    def _least_loaded(self):
+        live = [r for r in self.replicas if r.alive]
+        if not live:
+            raise RuntimeError("All Pocket TTS replicas have exited")
+        # Fewest outstanding jobs first, then the one that has worked least
+        return min(live, key=lambda r: (len(r.pending), r.busy_seconds))
+
+    def submit(self, op, **kwargs):
+        """Queue `op` on the least-loaded replica. Returns a Future."""
+        future = Future()
+        with self._lock:
+            replica = self._least_loaded()
+            job_id = next(self._job_ids)
+            replica.pending[job_id] = future
+        with replica.send_lock:
+            replica.conn.send((job_id, op, kwargs))
+        return future
+
+    def synthesize(self, text, settings, voice, output_path=None):
+        """
+        Blocking single-utterance generation. Returns True on success when
+        writing to `output_path`, otherwise the AudioBuffer itself.
+        """
+        return self.submit("synthesize", text=text, settings=settings, voice=voice,
+                           output_path=output_path).result()
+
+    def synthesize_batch(self, texts, settings, voice, output_paths=None):
+        """
+        Split the batch evenly over the live replicas and run the parts in
+        parallel. Returns one bool per text when writing to `output_paths`,
+        otherwise one AudioBuffer (or None) per text.
+        """
+        live = max(1, sum(r.alive for r in self.replicas))
+        size = -(-len(texts) // live)
+        parts = [
+            (start, self.submit("synthesize_batch", texts=texts[start:start + size], settings=settings,
+                                voice=voice, output_paths=output_paths[start:start + size] if output_paths else None))
+            for start in range(0, len(texts), size)
+        ]
+        results = [False if output_paths else None] * len(texts)
+        for start, future in parts:
+            part = future.result()
+            results[start:start + len(part)] = part
+        return results
+
+    def stats(self):
+        """Per-replica load and utilization (busy time / time since start)."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "replica": r.index,
+                    "pid": r.pid,
+                    "cores": r.cores,
+                    "pinned": r.pinned,
+                    "alive": r.alive,
+                    "in_flight": len(r.pending),
+                    "completed": r.completed,
+                    "failed": r.failed,
+                    "busy_seconds": round(r.busy_seconds, 2),
+                    "utilization": round(r.busy_seconds / (now - r.started_at), 3) if r.started_at else 0.0,
+                }
+                for r in self.replicas
+            ]
+
+    def close(self):
+        self._closing = True
+        for replica in self.replicas:
+            if replica.alive:
+                try:
+                    with replica.send_lock:
+                        replica.conn.send(None)
+                except OSError:
+                    pass
+        for replica in self.replicas:
+            if replica.process is not None:
+                replica.process.join(timeout=5)
+                if replica.process.is_alive():
+                    replica.process.terminate()
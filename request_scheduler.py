@@ -0,0 +1,237 @@
+"""
+Priority and deadline-aware scheduling of engine work.
+
+Each engine has its own lane that runs one generation at a time (the models
+are not thread-safe), so a minute-long Parkiet paragraph never holds up
+English requests. When a lane frees up, the waiting request that goes next
+is chosen by:
+
+1. priority ("high" before "normal" before "low");
+2. requests that are urgent, earliest first: their soft deadline would be
+   missed at the expected generation time, or they have waited longer than
+   `max_wait_seconds` (so long jobs are not starved);
+3. otherwise shortest expected job first, from the estimated audio length
+   of the text and the lane's measured real-time factor.
+
+Callers describe a job with a RequestSchedule, which also collects how long
+it waited in each queue. Use the process-wide `scheduler`:
+
+    with scheduler.lane("parkiet", texts, schedule, cancel):
+        ...generate...
+"""
+import contextlib
+import logging
+import threading
+import time
+
+from cancellation import check as check_cancelled
+from metrics import metrics
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+WORDS_PER_SECOND = 2.5       # Speaking rate used to estimate audio length
+CHARS_PER_WORD = 6           # For texts without spaces
+MAX_WAIT_SECONDS = 30.0      # A request waiting this long goes before shorter ones
+RTF_SMOOTHING = 0.2          # Weight of the newest measurement in the running RTF
+# Initial generation seconds per second of audio, until measured
+DEFAULT_REAL_TIME_FACTORS = {"pocket_tts": 0.3, "parkiet": 4.0, "coqui-xtts": 1.0, "system_tts": 0.1}
+MAX_TRACKED_WAITS = 200
+
+
+def estimate_seconds(text):
+    """Expected audio length of `text` in seconds."""
+    words = max(len(text.split()), len(text) / CHARS_PER_WORD)
+    return words / WORDS_PER_SECOND
+
+
+class RequestSchedule:
+    """
+    Priority, soft deadline and measured queue waits of one speech job.
+
+    Args:
+        priority: "high", "normal" or "low"
+        deadline: Soft deadline in seconds from now (None: no deadline)
+    """
+
+    def __init__(self, priority="normal", deadline=None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}' (use {', '.join(PRIORITIES)})")
+        self.priority = priority
+        self.deadline = time.perf_counter() + deadline if deadline else None
+        self.waits = {}  # Queue ("pool", engine lanes) -> seconds waited
+        self._members = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def merge(cls, schedules):
+        """Schedule for one batch serving several jobs: best priority, earliest deadline."""
+        schedules = [schedule for schedule in schedules if schedule is not None]
+        if not schedules:
+            return None
+        merged = cls(min((schedule.priority for schedule in schedules), key=PRIORITIES.get))
+        deadlines = [schedule.deadline for schedule in schedules if schedule.deadline is not None]
+        merged.deadline = min(deadlines) if deadlines else None
+        merged._members = schedules
+        return merged
+
+    def record(self, queue, seconds):
+        with self._lock:
+            self.waits[queue] = self.waits.get(queue, 0.0) + seconds
+        for member in self._members:
+            member.record(queue, seconds)
+
+    def describe(self):
+        waits = ", ".join(f"{queue} {seconds:.2f}s" for queue, seconds in self.waits.items())
+        return f"{self.priority} priority" + (f", waited {waits}" if waits else "")
+
+
+class _Ticket:
+    def __init__(self, sequence, audio_seconds, schedule):
+        self.sequence = sequence
+        self.audio_seconds = audio_seconds
+        self.priority = PRIORITIES[schedule.priority] if schedule is not None else PRIORITIES["normal"]
+        self.deadline = schedule.deadline if schedule is not None else None
+        self.submitted_at = time.perf_counter()
+        self.granted = False
+
+
+class _Lane:
+    def __init__(self, name, real_time_factor):
+        self.name = name
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.running = False
+        self.real_time_factor = real_time_factor
+        self.requests = 0
+        self.waits = []  # Recent queue waits in seconds
+        self.reordered = 0  # Grants that went to someone other than the oldest waiter
+
+
+class RequestScheduler:
+    def __init__(self, max_wait_seconds=MAX_WAIT_SECONDS, real_time_factors=None):
+        self.max_wait = max_wait_seconds
+        self.real_time_factors = dict(DEFAULT_REAL_TIME_FACTORS, **(real_time_factors or {}))
+        self._lanes = {}
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+    def configure(self, config):
+        """Apply a {"max_wait_seconds", "real_time_factors"} block."""
+        if not config:
+            return
+        with self._lock:
+            self.max_wait = config.get("max_wait_seconds", self.max_wait)
+            self.real_time_factors.update(config.get("real_time_factors") or {})
+
+    def _lane(self, engine):
+        with self._lock:
+            lane = self._lanes.get(engine)
+            if lane is None:
+                lane = self._lanes[engine] = _Lane(engine, self.real_time_factors.get(engine, 1.0))
+            return lane
+
+    def _order(self, lane, ticket):
+        # Sort key for the waiting tickets of a lane (smallest goes next)
+        expected = ticket.audio_seconds * lane.real_time_factor
+        urgent_at = ticket.submitted_at + self.max_wait
+        if ticket.deadline is not None:
+            urgent_at = min(urgent_at, ticket.deadline - expected)
+        if time.perf_counter() >= urgent_at:
+            return ticket.priority, 0, urgent_at, ticket.sequence
+        return ticket.priority, 1, expected, ticket.sequence
+
+    def _grant(self, lane):
+        # Called with lane.condition held
+        if lane.running or not lane.waiting:
+            return
+        ticket = min(lane.waiting, key=lambda waiting: self._order(lane, waiting))
+        if ticket is not lane.waiting[0]:
+            lane.reordered += 1
+        lane.waiting.remove(ticket)
+        ticket.granted = True
+        lane.running = True
+        lane.condition.notify_all()
+
+    @contextlib.contextmanager
+    def lane(self, engine, texts, schedule=None, cancel=None, measure=True):
+        """
+        Wait for the turn of a job on `engine`'s lane and hold the lane while it runs.
+
+        Args:
+            texts: The text (or texts, for a batch) to generate, for the length estimate
+            schedule: Optional RequestSchedule of the job; the wait is recorded on it
+            measure: Update the lane's real-time factor from this run (not for
+                     streams, whose pace is set by playback)
+
+        Raises:
+            Cancelled: If `cancel` is cancelled while waiting
+        """
+        texts = [texts] if isinstance(texts, str) else texts
+        audio_seconds = sum(estimate_seconds(text) for text in texts)
+        lane = self._lane(engine)
+        with self._lock:
+            self._sequence += 1
+            ticket = _Ticket(self._sequence, audio_seconds, schedule)
+
+        def wake():
+            with lane.condition:
+                lane.condition.notify_all()
+
+        unregister = cancel.on_cancel(wake) if cancel is not None else None
+        try:
+            with lane.condition:
+                lane.waiting.append(ticket)
+                self._grant(lane)
+                while not ticket.granted and not (cancel is not None and cancel.cancelled):
+                    lane.condition.wait()
+                cancelled = cancel is not None and cancel.cancelled
+                if not ticket.granted:
+                    lane.waiting.remove(ticket)
+                elif cancelled:
+                    # Granted and cancelled at once (cancelled on entry, or a
+                    # cancel racing the grant): pass the lane on
+                    lane.running = False
+                    self._grant(lane)
+        finally:
+            if unregister is not None:
+                unregister()
+        if cancelled:
+            check_cancelled(cancel)
+
+        started_at = time.perf_counter()
+        wait = started_at - ticket.submitted_at
+        metrics.record("queue_wait", ticket.submitted_at, wait, engine=engine)
+        if schedule is not None:
+            schedule.record(engine, wait)
+        if wait >= 0.1:
+            logging.info(f"Waited {wait:.2f}s for the {engine} lane ({len(lane.waiting)} still waiting)")
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with lane.condition:
+                lane.requests += 1
+                lane.waits = (lane.waits + [wait])[-MAX_TRACKED_WAITS:]
+                if measure and audio_seconds > 0:
+                    lane.real_time_factor += RTF_SMOOTHING * (elapsed / audio_seconds - lane.real_time_factor)
+                lane.running = False
+                self._grant(lane)
+
+    def stats(self):
+        with self._lock:
+            lanes = list(self._lanes.values())
+        info = {}
+        for lane in lanes:
+            with lane.condition:
+                info[lane.name] = {
+                    "requests": lane.requests,
+                    "running": lane.running,
+                    "waiting": len(lane.waiting),
+                    "mean_wait_seconds": sum(lane.waits) / len(lane.waits) if lane.waits else 0.0,
+                    "max_wait_seconds": max(lane.waits, default=0.0),
+                    "reordered": lane.reordered,
+                    "real_time_factor": lane.real_time_factor,
+                }
+        return info
+
+
+scheduler = RequestScheduler()
@@ -0,0 +1,116 @@
+"""
+Single-flight coalescing of identical concurrent generations.
+
+When an agent retries, or several clients ask for the same phrase at the same
+time, only the first request (the leader) generates; identical requests that
+arrive while it is running wait for it and get the same result. Keys are the
+audio cache keys (engine, voice, text, settings), so "identical" means the
+same thing as a cache hit.
+
+A waiting request can still be cancelled on its own. If the leader is
+cancelled, the requests waiting on it start over and one of them leads.
+"""
+import threading
+
+from cancellation import Cancelled, check as check_cancelled
+
+
+class _Flight:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.finished = False
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0  # Requests that ran their own call
+        self.coalesced = 0  # Requests served by another request's generation
+
+    def run(self, key, function, cancel=None):
+        """
+        Call `function()` unless an identical call is in flight; then wait for its result.
+
+        Raises:
+            Cancelled: If `cancel` is cancelled while waiting
+        """
+        while True:
+            flight, is_leader = self.claim(key)
+            if is_leader:
+                try:
+                    result = function()
+                except BaseException as e:
+                    self.release(key, flight, error=e)
+                    raise
+                self.release(key, flight, result)
+                return result
+            done, result = self.wait(flight, cancel)
+            if done:
+                return result
+
+    def claim(self, key):
+        """
+        Join the flight for `key`, starting it if there is none.
+
+        Returns:
+            tuple: (flight, is_leader). The leader must call release() exactly once.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+                return flight, True
+            return flight, False
+
+    def release(self, key, flight, result=None, error=None):
+        """Publish the leader's result (or exception) to everyone waiting on `flight`."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.condition:
+            flight.finished = True
+            flight.result = result
+            flight.error = error
+            flight.condition.notify_all()
+
+    def wait(self, flight, cancel=None):
+        """
+        Wait for a flight claimed as a follower.
+
+        Returns:
+            tuple: (done, result). done is False if the leader was cancelled
+                   and the caller should claim the key again.
+        """
+        def wake():
+            with flight.condition:
+                flight.condition.notify_all()
+
+        unregister = cancel.on_cancel(wake) if cancel is not None else None
+        try:
+            with flight.condition:
+                while not flight.finished and not (cancel is not None and cancel.cancelled):
+                    flight.condition.wait()
+        finally:
+            if unregister is not None:
+                unregister()
+        check_cancelled(cancel)
+
+        if isinstance(flight.error, Cancelled):
+            return False, None
+        if flight.error is not None:
+            raise flight.error
+        with self._lock:
+            self.coalesced += 1
+        return True, flight.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+            }
@@ -1,32 +1,182 @@
 import argparse
+import contextlib
+import contextvars
+import queue
 import sys
 import os
 import logging
+import threading
+import time
 import traceback
 
 # Import new modules
-from tts_interpreter import TTSInterpreter
+from tts_interpreter import TTSInterpreter, split_sentences
 from tts_engine_handler import TTSEngineHandler
 from audio_playback_handler import AudioPlaybackHandler
+from audio_cache import AudioCache
+from audio_postprocess import AudioPostprocessor
+from cancellation import Cancelled, check as check_cancelled
+from batch_scheduler import MicroBatchScheduler
+from metrics import metrics
+from model_registry import registry as models
+from request_scheduler import scheduler
 
 # Configuration
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 VENV_PYTHON = os.path.join(SCRIPT_DIR, ".venv", "Scripts", "python.exe")
+DEFAULT_LOOKAHEAD = 1  # Segments synthesized ahead of the one playing
+_END_OF_SEGMENTS = object()  # Queued by the producer once it has stopped
 
-# Setup logging
-logging.basicConfig(
-    filename=os.path.join(SCRIPT_DIR, "worker_debug.log"),
-    level=logging.INFO,
-    format='%(asctime)s - WORKER - %(levelname)s - %(message)s',
-    force=True
-)
 
-def perform_speech(text, voice, input_file=None):
+def setup_logging():
+    logging.basicConfig(
+        filename=os.path.join(SCRIPT_DIR, "worker_debug.log"),
+        level=logging.INFO,
+        format='%(asctime)s - WORKER - %(levelname)s - %(message)s',
+        force=True
+    )
+
+def create_handlers():
+    """Build the interpreter/engine/playback handlers. Reuse them to keep models warm."""
+    interpreter = TTSInterpreter(os.path.join(SCRIPT_DIR, "tts_config.json"))
+    cache = AudioCache.from_config(interpreter.config.get("cache"), SCRIPT_DIR)
+    postprocessor = AudioPostprocessor.from_config(interpreter.config.get("postprocess"))
+    engine_handler = TTSEngineHandler(VENV_PYTHON, cache=cache, postprocessor=postprocessor)
+    # Memory budget / idle unloading for the engine models, and warm-up at startup
+    models_config = interpreter.config.get("models") or {}
+    models.configure(models_config)
+    for engine in models_config.get("preload", []):
+        engine_handler.preload_engine(engine)
+    # Per-engine lanes: priority, soft deadlines, shortest job first
+    scheduler.configure(interpreter.config.get("scheduling"))
+    # Concurrent requests for the same engine/voice share one batched generation
+    engine_handler = MicroBatchScheduler.from_config(engine_handler, interpreter.config.get("batching")) or engine_handler
+    playback_handler = AudioPlaybackHandler(interpreter.config.get("playback"))
+    return interpreter, engine_handler, playback_handler
+
+def play_pipelined(segments, lang_config, engine_handler, playback_handler,
+                   lookahead=DEFAULT_LOOKAHEAD, playback_guard=None, cancel=None, schedule=None, trace=None):
+    """
+    Producer/consumer loop: a generator thread keeps up to `lookahead`
+    finished segments queued behind the one currently playing. Each segment
+    is handed to the playback engine before the previous one ends, so they
+    play back to back without gaps.
+    `playback_guard` (a lock) is taken once the first segment is ready.
+    Segments that fail to generate are skipped; the language's error clip
+    is played only if none could be generated.
+    Returns True if at least one segment was played; raises Cancelled if
+    `cancel` stopped generation and playback. First audio and audio seconds
+    are recorded on `trace` (a metrics.RequestTrace).
+    """
+    ready = queue.Queue(maxsize=max(1, lookahead))
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for index, segment in enumerate(segments):
+                if stop.is_set() or (cancel is not None and cancel.cancelled):
+                    break
+                audio = engine_handler.generate_speech(segment, lang_config, SCRIPT_DIR, cancel, schedule,
+                                                       fallback=False)
+                if audio is None:
+                    logging.error(f"Segment {index + 1}/{len(segments)} could not be generated, skipping it")
+                    continue
+                ready.put(audio)
+        except Cancelled:
+            pass
+        except Exception as e:
+            logging.error(f"Segment generation failed: {e}")
+        finally:
+            ready.put(_END_OF_SEGMENTS)
+
+    start_time = time.time()
+    # The producer's spans belong to this request's trace
+    producer = threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True)
+    producer.start()
+
+    played = 0
+    try:
+        audio = ready.get()
+        if audio is _END_OF_SEGMENTS:
+            # Nothing could be generated: play the language's error clip instead
+            check_cancelled(cancel)
+            audio = engine_handler.get_fallback(lang_config, SCRIPT_DIR)
+            if audio is None:
+                audio = _END_OF_SEGMENTS
+            else:
+                ready.put(_END_OF_SEGMENTS)  # The producer has stopped, so the queue is empty
+        if audio is not _END_OF_SEGMENTS:
+            logging.info(f"First segment ready after {time.time() - start_time:.2f}s "
+                         f"({len(segments)} segments, lookahead {lookahead})")
+            if trace is not None:
+                trace.first_audio()
+            with playback_guard if playback_guard is not None else contextlib.nullcontext(), \
+                    metrics.span("playback"):
+                previous = None
+                while audio is not _END_OF_SEGMENTS:
+                    check_cancelled(cancel)
+                    segment = playback_handler.play_buffer(audio, wait=False, cancel=cancel)
+                    if segment is not None:
+                        played += 1
+                        if trace is not None:
+                            trace.add_audio(audio.duration)
+                    if previous is not None:
+                        previous.wait()
+                    previous = segment
+                    audio = ready.get()
+                if previous is not None:
+                    previous.wait()
+        check_cancelled(cancel)
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting for queue space
+        while producer.is_alive():
+            try:
+                ready.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    if not played:
+        logging.error("Failed to obtain audio.")
+    return played > 0
+
+def perform_speech(text, voice, input_file=None, handlers=None, display=True, playback_lock=None, cancel=None,
+                   schedule=None):
+    """
+    Run the interpret -> generate -> display -> play pipeline.
+    Text is split into sentences and the next one is generated while the
+    current one plays, so the user only waits for the first sentence.
+    Returns True if audio was played, False otherwise.
+    Each call is traced as one request: stage timings, time to first audio,
+    real-time factor and peak RSS go to the metrics and to the log.
+
+    Args:
+        handlers: Optional (interpreter, engine_handler, playback_handler) tuple
+                  from create_handlers(). Pass it in from long-lived callers.
+        display: Show the text in the console window. In-process callers that
+                 own stdout (e.g. the MCP server) must disable this, or pass an
+                 object with a display_text(text) method (e.g. a
+                 console_display.ConsoleDisplay) to show it elsewhere.
+        playback_lock: Optional lock (or speech_pool playback turn) held while
+                       playing, so concurrent callers do not talk over each other.
+        cancel: Optional cancellation.CancelToken. Cancelling it stops
+                generation within one decode step and playback at once;
+                Cancelled is raised to the caller then.
+        schedule: Optional request_scheduler.RequestSchedule (priority and
+                  soft deadline); it also collects the job's queue waits.
+    """
+    with metrics.trace("speech") as trace:
+        played = _perform_speech(text, voice, input_file, handlers, display, playback_lock, cancel, schedule, trace)
+        if not played:
+            trace.outcome = "failed"
+        return played
+
+def _perform_speech(text, voice, input_file=None, handlers=None, display=True, playback_lock=None, cancel=None,
+                    schedule=None, trace=None):
+    # Body of perform_speech; `trace` is its metrics.RequestTrace
     try:
         # Initialize Handlers
-        interpreter = TTSInterpreter(os.path.join(SCRIPT_DIR, "tts_config.json"))
-        engine_handler = TTSEngineHandler(VENV_PYTHON)
-        playback_handler = AudioPlaybackHandler()
+        interpreter, engine_handler, playback_handler = handlers or create_handlers()
 
         # Step 1: Interpret Input
         # Note: If input_file is provided, we might skip interpretation or use it for text display
@@ -39,28 +189,53 @@ def perform_speech(text, voice, input_file=None):
         # We can merge them.
         
         logging.info(f"Interpreted Language Config: {lang_config}")
+        if trace is not None:
+            trace.labels["engine"] = lang_config.get("engine")
         
-        # Step 2: Generate Audio (if no input file)
-        audio_path = input_file
-        if not audio_path:
-            audio_path = engine_handler.generate_speech(clean_text, lang_config, SCRIPT_DIR)
-        
-        if not audio_path:
-            logging.error("Failed to obtain audio path.")
-            return
+        if display:
+            (playback_handler if display is True else display).display_text(clean_text)
 
-        # Step 3: Playback & Display
-        # Display the text provided (or defaults)
-        playback_handler.display_text(clean_text)
-        
-        # Play the audio
-        playback_handler.play_audio(audio_path)
+        # Playback lock is held for a whole utterance so concurrent callers
+        # never interleave their sentences.
+        playback_guard = playback_lock if playback_lock is not None else contextlib.nullcontext()
+
+        # Pre-rendered audio: just play it
+        if input_file:
+            with playback_guard, metrics.span("playback"):
+                playback_handler.play_audio(input_file)
+            return True
+
+        segments = split_sentences(clean_text) or [clean_text]
+        fully_cached = all(engine_handler.is_cached(segment, lang_config) for segment in segments)
+
+        # Step 2a: Stream Audio (engines that support it start playing on the first chunk)
+        stream = None if fully_cached else engine_handler.stream_speech(clean_text, lang_config, cancel, schedule)
+        if stream:
+            chunks, sample_rate, stats = stream
+            if trace is not None:
+                chunks = trace.watch(chunks, sample_rate)
+            with playback_guard, metrics.span("playback"):
+                audio = playback_handler.play_stream(chunks, sample_rate, stats, cancel)
+            if audio is not None:
+                logging.info(f"Streaming finished: {stats}")
+                return True
+            logging.warning("Streaming failed, falling back to full generation.")
+
+        # Step 2b: Generate sentence N+1 while sentence N plays (cached sentences are instant)
+        lookahead = interpreter.config.get("pipeline_lookahead", DEFAULT_LOOKAHEAD)
+        return play_pipelined(segments, lang_config, engine_handler, playback_handler, lookahead,
+                              playback_guard, cancel, schedule, trace)
 
+    except Cancelled:
+        logging.info("Speech cancelled.")
+        raise
     except Exception as e:
         logging.critical(f"Pipeline failed: {e}")
         traceback.print_exc()
+        return False
 
 if __name__ == "__main__":
+    setup_logging()
     try:
         parser = argparse.ArgumentParser()
         parser.add_argument("--text", default="Playing audio...")
@@ -0,0 +1,335 @@
+"""
+In-process speech worker pool for the MCP server.
+
+Instead of spawning a new speak_worker.py process (fresh torch import and
+model load) for every request, the pool keeps a fixed number of warm workers
+that share one set of handlers and pull jobs from a bounded asyncio queue.
+
+What happens to older jobs when a new request arrives is the barge-in policy:
+"queue" plays everything in order, "replace-latest" drops jobs that have not
+started yet (the one speaking finishes), and "interrupt" also cancels the
+running job, stopping its generation within one decode step and its
+playback at once.
+
+Jobs leave the queue by priority, oldest first within a priority. With more
+than one worker, an English job does not wait for a Dutch job to finish;
+their generations are ordered per engine by request_scheduler. Playback
+still follows the order in which jobs left the queue, so jobs are spoken in
+the same order as with a single worker, whichever finishes generating first.
+"""
+import asyncio
+import collections
+import itertools
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import model_registry
+from cancellation import CancelToken, Cancelled, check as check_cancelled
+from request_scheduler import PRIORITIES, RequestSchedule, scheduler
+
+MAX_TRACKED_JOBS = 100  # Finished jobs kept around for status queries
+POLICIES = ("queue", "replace-latest", "interrupt")
+
+
+class QueueFullError(Exception):
+    """Raised when the request queue is at capacity (backpressure)."""
+
+
+class SpeechJob:
+    def __init__(self, text, voice, priority="normal", deadline=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.text = text
+        self.voice = voice
+        self.schedule = RequestSchedule(priority, deadline)
+        self.state = "queued"  # queued -> running -> done | failed | cancelled
+        self.error = None
+        self.cancel_token = CancelToken()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def describe(self):
+        info = f"job {self.id}: {self.state}"
+        if self.started_at:
+            info += f" (waited {self.started_at - self.created_at:.2f}s"
+            if self.finished_at:
+                info += f", ran {self.finished_at - self.started_at:.2f}s"
+            info += ")"
+        info += f" [{self.schedule.describe()}]"
+        if self.error:
+            info += f" - {self.error}"
+        elif self.state == "cancelled":
+            info += f" - {self.cancel_token.reason}"
+        return info
+
+    def cancel(self, reason):
+        if self.state in ("queued", "running") and self.cancel_token.cancel(reason):
+            if self.state == "queued":
+                self.state = "cancelled"
+                self.finished_at = time.time()
+            return True
+        return False
+
+
+class _PlaybackTurn:
+    """A running job's place in line for the playback device (see PlaybackTurns)."""
+
+    def __init__(self, turns, cancel):
+        self._turns = turns
+        self._cancel = cancel
+
+    def __enter__(self):
+        self._turns.wait(self, self._cancel)
+        return self
+
+    def __exit__(self, *exc_info):
+        return False  # The turn is held until the job finishes (see PlaybackTurns.release)
+
+
+class PlaybackTurns:
+    """
+    Hands out the playback device to running jobs in the order they started.
+
+    A job's turn is used as the playback lock: entering it waits until every
+    job that started earlier has finished. Turns are taken when a job leaves
+    the queue rather than when it is submitted, so a job never waits for one
+    that no worker has picked up yet.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._turns = collections.deque()
+
+    def take(self, cancel=None):
+        with self._condition:
+            turn = _PlaybackTurn(self, cancel)
+            self._turns.append(turn)
+            return turn
+
+    def wait(self, turn, cancel=None):
+        """
+        Block until `turn` is first in line.
+
+        Raises:
+            Cancelled: If `cancel` is cancelled while waiting
+        """
+        def wake():
+            with self._condition:
+                self._condition.notify_all()
+
+        unregister = cancel.on_cancel(wake) if cancel is not None else None
+        try:
+            with self._condition:
+                while self._turns[0] is not turn and not (cancel is not None and cancel.cancelled):
+                    self._condition.wait()
+        finally:
+            if unregister is not None:
+                unregister()
+        check_cancelled(cancel)
+
+    def release(self, turn):
+        with self._condition:
+            self._turns.remove(turn)
+            self._condition.notify_all()
+
+
+class SpeechWorkerPool:
+    """
+    Fixed-size pool of warm synthesis workers fed by a bounded queue.
+
+    Args:
+        policy: Barge-in policy for new requests (see POLICIES)
+        display: Optional console_display.ConsoleDisplay that shows the text
+                 of each job in a separate console window
+    """
+
+    def __init__(self, num_workers=1, max_queue_size=8, policy="queue", display=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown barge-in policy '{policy}' (use {', '.join(POLICIES)})")
+        self.num_workers = max(1, num_workers)
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.display = display
+        self._queue = None
+        self._tasks = []
+        self._executor = None
+        self._handlers = None
+        self._handlers_lock = threading.Lock()
+        self._playback_turns = PlaybackTurns()
+        self._jobs = collections.OrderedDict()
+        self._sequence = itertools.count()  # FIFO order within a priority
+        self._active = 0
+        self.cancelled = 0
+        self._stop_latencies = []  # Seconds from cancel to the running job letting go
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="speech-worker")
+        self._tasks = [asyncio.create_task(self._worker_loop(i)) for i in range(self.num_workers)]
+        logging.info(f"Speech pool started ({self.num_workers} workers, queue size {self.max_queue_size})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.display is not None:
+            self.display.close()
+
+    def submit(self, text, voice, policy=None, priority="normal", deadline=None):
+        """
+        Queue a speech job without waiting for it.
+
+        Args:
+            policy: Barge-in policy for this request (default: the pool's)
+            priority: "high", "normal" or "low"
+            deadline: Optional soft deadline in seconds from now
+
+        Returns:
+            SpeechJob: The queued job.
+
+        Raises:
+            QueueFullError: If the queue is full.
+        """
+        if self._queue is None:
+            raise RuntimeError("Speech pool is not started")
+        policy = policy or self.policy
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown barge-in policy '{policy}' (use {', '.join(POLICIES)})")
+
+        if policy != "queue":
+            self.cancel(reason=f"superseded ({policy})", include_running=policy == "interrupt")
+
+        job = SpeechJob(text, voice, priority, deadline)
+        try:
+            self._queue.put_nowait((PRIORITIES[priority], next(self._sequence), job))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Speech queue is full ({self.max_queue_size} pending)")
+
+        self._jobs[job.id] = job
+        while len(self._jobs) > MAX_TRACKED_JOBS:
+            self._jobs.popitem(last=False)
+        return job
+
+    def get_job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id=None, reason="cancelled", include_running=True):
+        """
+        Cancel one job, or every queued (and, with include_running, running) job.
+
+        Returns:
+            list: The jobs that were cancelled
+        """
+        if job_id:
+            jobs = [self._jobs[job_id]] if job_id in self._jobs else []
+        else:
+            jobs = list(self._jobs.values())
+        cancelled = [
+            job for job in jobs
+            if (include_running or job.state == "queued") and job.cancel(reason)
+        ]
+        self.cancelled += len(cancelled)
+        if cancelled:
+            logging.info(f"Cancelled {len(cancelled)} job(s): {reason}")
+            self._drop_cancelled()
+        return cancelled
+
+    def _drop_cancelled(self):
+        # Free the queue slots of cancelled jobs right away (called on the event loop)
+        if self._queue is None:
+            return
+        kept = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            self._queue.task_done()
+            if not item[-1].cancel_token.cancelled:
+                kept.append(item)
+        for item in kept:
+            self._queue.put_nowait(item)
+
+    def status(self):
+        info = {
+            "workers": self.num_workers,
+            "active": self._active,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.max_queue_size,
+            "policy": self.policy,
+            "cancelled": self.cancelled,
+            "mean_stop_ms": (sum(self._stop_latencies) / len(self._stop_latencies) * 1000
+                             if self._stop_latencies else None),
+        }
+        engine_handler = self._handlers[1] if self._handlers else None
+        if engine_handler is not None and hasattr(engine_handler, "batch_sizes"):
+            info["batching"] = engine_handler.stats()
+        single_flight = getattr(engine_handler, "single_flight", None)
+        if single_flight is not None:
+            info["coalescing"] = single_flight.stats()
+        info["lanes"] = scheduler.stats()
+        info["models"] = model_registry.registry.stats()
+        postprocessor = getattr(engine_handler, "postprocessor", None)
+        if postprocessor is not None:
+            info["trimming"] = postprocessor.stats()
+        if self._handlers is not None:
+            info["playback"] = self._handlers[2].stats()
+        return info
+
+    def _get_handlers(self):
+        # Imported lazily so the MCP server starts answering before torch is loaded
+        with self._handlers_lock:
+            if self._handlers is None:
+                import speak_worker
+                self._handlers = speak_worker.create_handlers()
+            return self._handlers
+
+    def _run_job(self, job, playback_turn):
+        import speak_worker
+        if not speak_worker.perform_speech(
+            job.text, job.voice,
+            handlers=self._get_handlers(),
+            display=self.display or False,  # stdout belongs to the MCP stdio transport
+            playback_lock=playback_turn,
+            cancel=job.cancel_token,
+            schedule=job.schedule,
+        ):
+            raise RuntimeError("Speech pipeline failed (see log)")
+
+    async def _worker_loop(self, worker_id):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self._queue.get()
+            if job.cancel_token.cancelled:
+                self._queue.task_done()
+                continue
+            job.state = "running"
+            job.started_at = time.time()
+            job.schedule.record("pool", job.started_at - job.created_at)
+            self._active += 1
+            playback_turn = self._playback_turns.take(job.cancel_token)
+            logging.info(f"Worker {worker_id} picked up job {job.id}")
+            try:
+                await loop.run_in_executor(self._executor, self._run_job, job, playback_turn)
+                job.state = "done"
+            except Cancelled:
+                job.state = "cancelled"
+                stop_latency = time.perf_counter() - job.cancel_token.cancelled_at
+                self._stop_latencies = (self._stop_latencies + [stop_latency])[-MAX_TRACKED_JOBS:]
+                logging.info(f"Speech job {job.id} stopped {stop_latency * 1000:.0f} ms after cancellation")
+            except Exception as e:
+                job.state = "failed"
+                job.error = str(e)
+                logging.error(f"Speech job {job.id} failed: {e}")
+            finally:
+                self._playback_turns.release(playback_turn)
+                job.finished_at = time.time()
+                logging.info(f"Speech job {job.id} {job.state} ({job.schedule.describe()})")
+                self._active -= 1
+                self._queue.task_done()
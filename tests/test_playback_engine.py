@@ -0,0 +1,24 @@
+import time
+
+import numpy as np
+
+from playback_engine import NullSink, PlaybackEngine
+
+RATE = 24000
+
+
+def test_underrun_seconds_measure_the_stall():
+    engine = PlaybackEngine(NullSink(realtime=True))
+
+    def chunks():
+        yield np.zeros(RATE // 10, dtype=np.float32)  # 100 ms of audio
+        time.sleep(0.3)  # Generation stalls for 300 ms
+        yield np.zeros(RATE // 10, dtype=np.float32)
+
+    engine.stream(chunks(), RATE).wait(5.0)
+    stats = engine.stats()
+    engine.close()
+
+    # The device ran dry for about 200 ms (the stall minus the buffered audio)
+    assert stats["underruns"] == 1
+    assert 0.15 <= stats["underrun_seconds"] <= 0.3
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from cancellation import CancelToken, Cancelled
+from request_scheduler import RequestScheduler
+
+
+def _lane_is_free(scheduler, engine, timeout=2.0):
+    # A new request gets the lane (and returns) instead of hanging
+    done = threading.Event()
+
+    def run():
+        with scheduler.lane(engine, "next"):
+            done.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    return done.wait(timeout)
+
+
+def test_cancelled_on_entry_releases_lane():
+    scheduler = RequestScheduler()
+    cancel = CancelToken()
+    cancel.cancel("gone")
+
+    with pytest.raises(Cancelled):
+        with scheduler.lane("pocket_tts", "hello", cancel=cancel):
+            pass
+
+    assert scheduler.stats()["pocket_tts"]["running"] is False
+    assert _lane_is_free(scheduler, "pocket_tts")
+
+
+def test_cancel_racing_grant_releases_lane():
+    scheduler = RequestScheduler()
+    lane = scheduler._lane("parkiet")
+    with lane.condition:
+        lane.running = True  # Held by an earlier job
+    cancel = CancelToken()
+    outcome = []
+
+    def waiter():
+        try:
+            with scheduler.lane("parkiet", "hallo", cancel=cancel):
+                outcome.append("ran")
+        except Cancelled:
+            outcome.append("cancelled")
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while not lane.waiting:
+        time.sleep(0.01)
+
+    # The earlier job releases the lane (granting it to the waiter) while the
+    # waiter's token is being cancelled
+    with lane.condition:
+        canceller = threading.Thread(target=cancel.cancel, args=("barge-in",))
+        canceller.start()
+        while not cancel.cancelled:
+            time.sleep(0.01)
+        lane.running = False
+        scheduler._grant(lane)
+    thread.join(2.0)
+    canceller.join(2.0)
+
+    assert outcome == ["cancelled"]
+    assert scheduler.stats()["parkiet"]["running"] is False
+    assert _lane_is_free(scheduler, "parkiet")
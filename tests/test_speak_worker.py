@@ -0,0 +1,52 @@
+import numpy as np
+
+import speak_worker
+from audio_buffer import AudioBuffer
+
+RATE = 24000
+
+
+class FakeEngine:
+    def __init__(self, failing):
+        self.failing = failing
+        self.fallbacks = 0
+
+    def generate_speech(self, text, config, base_dir, cancel=None, schedule=None, fallback=True):
+        if text in self.failing:
+            return None
+        return AudioBuffer(np.zeros(RATE // 100, dtype=np.float32), RATE)
+
+    def get_fallback(self, config, base_dir):
+        self.fallbacks += 1
+        return AudioBuffer(np.ones(RATE // 100, dtype=np.float32), RATE)
+
+
+class FakePlayback:
+    def __init__(self):
+        self.played = []
+
+    def play_buffer(self, audio, wait=True, cancel=None):
+        self.played.append(audio)
+        return None if wait else _Done()
+
+
+class _Done:
+    def wait(self):
+        pass
+
+
+def test_failed_segment_is_skipped():
+    engine, playback = FakeEngine({"b"}), FakePlayback()
+
+    assert speak_worker.play_pipelined(["a", "b", "c"], {}, engine, playback)
+    assert len(playback.played) == 2
+    assert engine.fallbacks == 0
+
+
+def test_fallback_plays_only_when_every_segment_failed():
+    engine, playback = FakeEngine({"a", "b"}), FakePlayback()
+
+    assert speak_worker.play_pipelined(["a", "b"], {}, engine, playback)
+    assert engine.fallbacks == 1
+    assert len(playback.played) == 1
+    assert playback.played[0].samples[0] == 1
@@ -0,0 +1,437 @@
+"""
+Erika TTS daemon - keeps the engines from tts_engines.py loaded and serves
+synthesis requests over a local Unix socket.
+
+Start it once with:  python tts_daemon.py [--socket PATH] [--memory-budget-mb MB] [--idle-unload SECONDS]
+                                          [--pocket-replicas N|auto] [--metrics-port PORT]
+Show its state with: python tts_daemon.py --status
+Dump its metrics:    python tts_daemon.py --metrics [prometheus|json]
+
+Models are loaded on first use and managed by model_registry: with a memory
+budget the least recently used engine is unloaded to make room, and engines
+idle for longer than --idle-unload seconds are released. With
+--pocket-replicas, English requests run in parallel on a pool of Pocket TTS
+processes pinned to disjoint cores (see pocket_replicas.py) instead of on the
+daemon's own model. "ping" reports per-model residency and load times and
+per-replica utilization. Identical requests from several clients that overlap
+share one generation (see single_flight.py). Every request is traced (see
+metrics.py); "metrics" returns the histograms, also with `--metrics`, or over
+HTTP with --metrics-port.
+
+Protocol: the client sends one JSON line, the daemon answers with one JSON
+line. If the request asked for the audio bytes (or gave no output path), the
+response line is followed by exactly `audio_size` raw bytes of WAV data; for
+batches, `audio_sizes` lists the size of each item's WAV in that order. Audio
+that is only returned is generated and encoded in memory, never via a file.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+
+from audio_buffer import AudioBuffer
+from audio_cache import make_key
+from metrics import metrics, serve_http
+from single_flight import SingleFlight
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "erika-tts.sock")
+CONNECT_TIMEOUT = 0.5      # Seconds to wait for the daemon to accept a connection
+REQUEST_TIMEOUT = 600      # Parkiet on CPU can take minutes for a paragraph
+
+
+def get_socket_path(settings=None):
+    """Resolve the daemon socket path from settings, falling back to the default."""
+    if settings and settings.get("daemon_socket"):
+        return settings["daemon_socket"]
+    return DEFAULT_SOCKET_PATH
+
+
+def is_supported():
+    """Unix sockets are not available on every platform (e.g. most Windows builds)."""
+    return hasattr(socket, "AF_UNIX")
+
+
+# --- Client ---
+
+def _recv_line(sock):
+    data = bytearray()
+    while b"\n" not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _recv_exact(sock, size, initial=b""):
+    data = bytearray(initial)
+    while len(data) < size:
+        chunk = sock.recv(min(65536, size - len(data)))
+        if not chunk:
+            raise ConnectionError("Daemon closed the connection while sending audio")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def send_request(request, socket_path=None):
+    """
+    Send one request to the daemon.
+
+    Returns:
+        dict: The daemon response (with an `audio` key holding bytes if requested),
+              or None if the daemon is not running.
+    """
+    if not is_supported():
+        return None
+
+    socket_path = socket_path or DEFAULT_SOCKET_PATH
+    if not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError, socket.timeout):
+            return None
+
+        sock.settimeout(REQUEST_TIMEOUT)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+        raw = _recv_line(sock)
+        if not raw:
+            return None
+        header, _, rest = raw.partition(b"\n")
+        response = json.loads(header.decode("utf-8"))
+
+        audio_size = response.get("audio_size")
+        if audio_size:
+            response["audio"] = _recv_exact(sock, audio_size, rest)
+        audio_sizes = response.get("audio_sizes")
+        if audio_sizes is not None:
+            data = _recv_exact(sock, sum(audio_sizes), rest) if sum(audio_sizes) else b""
+            response["audio"], offset = [], 0
+            for size in audio_sizes:
+                response["audio"].append(data[offset:offset + size] or None)
+                offset += size
+        return response
+    finally:
+        sock.close()
+
+
+def ping(socket_path=None):
+    """Check whether a daemon is listening."""
+    response = send_request({"op": "ping"}, socket_path)
+    return bool(response and response.get("ok"))
+
+
+def fetch_metrics(socket_path=None, prometheus=False):
+    """The daemon's metrics as a JSON dict, or as Prometheus text (None if no daemon)."""
+    response = send_request({"op": "metrics", "format": "prometheus" if prometheus else "json"}, socket_path)
+    if not response or not response.get("ok"):
+        return None
+    return response.get("text") if prometheus else response.get("metrics")
+
+
+def synthesize(text, lang, settings, voice=None, output_path=None, return_audio=False, socket_path=None):
+    """
+    Ask the daemon to synthesize `text`.
+
+    Args:
+        text: Text to synthesize
+        lang: 'en' (Pocket TTS) or 'nl' (Parkiet)
+        settings: Settings dict (generation_settings / parkiet_settings are forwarded)
+        voice: Voice name or WAV path (English only)
+        output_path: Where the daemon should write the WAV. If omitted nothing is
+                     written and the WAV bytes are returned instead.
+        return_audio: If True, the WAV bytes are returned in the `audio` key
+                      even when an output path is given.
+        socket_path: Override the socket location.
+
+    Returns:
+        dict: {"ok": bool, "output_path": str, "error": str, "audio": bytes}
+              or None if the daemon is not running.
+    """
+    request = {
+        "op": "synthesize",
+        "text": text,
+        "lang": lang,
+        "voice": voice,
+        "output_path": os.path.abspath(output_path) if output_path else None,
+        "return_audio": return_audio,
+        "settings": {
+            "generation_settings": settings.get("generation_settings", {}),
+            "parkiet_settings": settings.get("parkiet_settings", {}),
+        },
+    }
+    return send_request(request, socket_path or get_socket_path(settings))
+
+
+def synthesize_batch(texts, lang, settings, output_paths=None, voice=None, return_audio=False, socket_path=None):
+    """
+    Ask the daemon to synthesize several texts in one batched pass.
+
+    Without `output_paths` (or with return_audio=True) the `audio` key holds
+    one bytes object of WAV data (or None) per text.
+
+    Returns:
+        dict: {"ok": bool, "output_paths": [str or None, ...], "error": str, "audio": [bytes or None, ...]}
+              or None if the daemon is not running.
+    """
+    request = {
+        "op": "synthesize_batch",
+        "texts": list(texts),
+        "lang": lang,
+        "voice": voice,
+        "output_paths": [os.path.abspath(path) for path in output_paths] if output_paths else None,
+        "return_audio": return_audio,
+        "settings": {
+            "generation_settings": settings.get("generation_settings", {}),
+            "parkiet_settings": settings.get("parkiet_settings", {}),
+        },
+    }
+    return send_request(request, socket_path or get_socket_path(settings))
+
+
+# --- Server ---
+
+class _SynthesisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+            if not line:
+                return
+            request = json.loads(line.decode("utf-8"))
+            response, audio = self.server.dispatch(request)
+        except Exception as e:
+            logging.error(f"Bad daemon request: {e}")
+            response, audio = {"ok": False, "error": str(e)}, None
+
+        if isinstance(audio, list):
+            # Batch: one WAV per item (empty for failed items), sent back to back
+            response["audio_sizes"] = [len(item or b"") for item in audio]
+            audio = b"".join(item or b"" for item in audio)
+        elif audio is not None:
+            response["audio_size"] = len(audio)
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        if audio:
+            self.wfile.write(audio)
+
+
+class TTSDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server that owns the warm engine instances."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, models_config=None, pocket_replicas=0,
+                 pocket_threads=None):
+        super().__init__(socket_path, _SynthesisHandler)
+        import tts_engines  # Heavy import (torch, pocket_tts) - done once here
+        from model_registry import registry
+        self.engines = tts_engines
+        self.models = registry
+        self.models.configure(models_config)
+        # The models are not thread-safe, so synthesis is serialized
+        self.synthesis_lock = threading.Lock()
+        self.single_flight = SingleFlight()
+        # English replica pool, started on the first English request (it needs its settings)
+        self.pocket_replicas = pocket_replicas
+        self.pocket_threads = pocket_threads
+        self.pocket_pool = None
+        self._pocket_pool_lock = threading.Lock()
+
+    def _get_pocket_pool(self, settings):
+        if not self.pocket_replicas:
+            return None
+        with self._pocket_pool_lock:
+            if self.pocket_pool is None:
+                from pocket_replicas import PocketReplicaPool, THREADS_PER_REPLICA
+                replicas = None if self.pocket_replicas == "auto" else int(self.pocket_replicas)
+                self.pocket_pool = PocketReplicaPool(settings, replicas, self.pocket_threads or THREADS_PER_REPLICA)
+            return self.pocket_pool
+
+    def dispatch(self, request):
+        op = request.get("op")
+        if op == "ping":
+            response = {"ok": True, "pid": os.getpid(), "models": self.models.stats(),
+                        "coalescing": self.single_flight.stats()}
+            if self.pocket_pool is not None:
+                response["pocket_replicas"] = self.pocket_pool.stats()
+            return response, None
+        if op == "metrics":
+            if request.get("format") == "prometheus":
+                return {"ok": True, "text": metrics.to_prometheus()}, None
+            return {"ok": True, "metrics": metrics.to_json()}, None
+        if op in ("synthesize", "synthesize_batch"):
+            engine = "parkiet" if request.get("lang") == "nl" else "pocket_tts"
+            with metrics.trace(op, engine=engine) as trace:
+                if op == "synthesize":
+                    response, audio = self._synthesize(request, trace)
+                else:
+                    response, audio = self._synthesize_batch(request, trace)
+                if not response.get("ok"):
+                    trace.outcome = "failed"
+                return response, audio
+        return {"ok": False, "error": f"Unknown op: {op}"}, None
+
+    def _synthesize(self, request, trace):
+        text = request.get("text")
+        if not text:
+            return {"ok": False, "error": "No text provided"}, None
+
+        settings = request.get("settings") or {}
+        # Clients asking for the same utterance at the same time share one generation
+        key = make_key(request.get("lang"), request.get("voice"), text, settings)
+        buffer = self.single_flight.run(key, lambda: self._generate(text, request.get("lang"), settings,
+                                                                    request.get("voice")))
+
+        if buffer is None or not len(buffer):
+            return {"ok": False, "error": "Generation produced no audio"}, None
+        trace.first_audio()
+        trace.add_audio(buffer.duration)
+
+        # Only touch disk when the client asked for a file
+        output_path = request.get("output_path")
+        if output_path:
+            buffer.write(output_path)
+        audio = buffer.to_wav_bytes() if request.get("return_audio") or not output_path else None
+        return {"ok": True, "output_path": output_path}, audio
+
+    def _generate(self, text, lang, settings, voice):
+        pool = self._get_pocket_pool(settings) if lang != "nl" else None
+        if pool is not None:
+            with metrics.span("generation", engine="pocket_tts"):
+                return pool.synthesize(text, settings, voice)
+        with self.synthesis_lock, metrics.span("generation", engine="parkiet" if lang == "nl" else "pocket_tts"):
+            if lang == "nl":
+                return self.engines.synthesize_dutch(text, settings)
+            return self.engines.synthesize_english(text, settings, voice)
+
+    def _synthesize_batch(self, request, trace):
+        texts = request.get("texts") or []
+        output_paths = request.get("output_paths")
+        if not texts or (output_paths and len(texts) != len(output_paths)):
+            return {"ok": False, "error": "Need one output path per text"}, None
+
+        settings = request.get("settings") or {}
+        pool = self._get_pocket_pool(settings) if request.get("lang") != "nl" else None
+        if pool is not None:
+            with metrics.span("generation", engine=trace.labels["engine"]):
+                buffers = pool.synthesize_batch(texts, settings, request.get("voice"))
+        else:
+            with self.synthesis_lock, metrics.span("generation", engine=trace.labels["engine"]):
+                if request.get("lang") == "nl":
+                    audio = self.engines.generate_dutch_batch(texts, settings)
+                    sample_rate = self.engines.parkiet_engine.SAMPLE_RATE
+                else:
+                    audio = self.engines.generate_english_batch(texts, settings, request.get("voice"))
+                    sample_rate = self.engines.get_english_sample_rate(settings)
+            buffers = [AudioBuffer(a, sample_rate) if a is not None else None for a in audio]
+        if any(buffer is not None for buffer in buffers):
+            trace.first_audio()
+            trace.add_audio(sum(buffer.duration for buffer in buffers if buffer is not None))
+
+        written = [None] * len(texts)
+        if output_paths:
+            for index, (buffer, path) in enumerate(zip(buffers, output_paths)):
+                if buffer is not None:
+                    written[index] = buffer.write(path)
+        audio = None
+        if request.get("return_audio") or not output_paths:
+            audio = [buffer.to_wav_bytes() if buffer is not None else None for buffer in buffers]
+        return {"ok": any(b is not None for b in buffers), "output_paths": written}, audio
+
+
+def print_status(socket_path=DEFAULT_SOCKET_PATH):
+    """Print model residency and replica utilization of a running daemon."""
+    info = send_request({"op": "ping"}, socket_path)
+    if info is None:
+        print(f"No daemon listening on {socket_path}")
+        return
+    print(f"Daemon pid {info['pid']} on {socket_path}")
+    models = info.get("models", {})
+    print(f"Resident models: {models.get('resident_megabytes', 0):.0f} MB "
+          f"(budget: {models.get('budget_megabytes') or 'none'})")
+    for name, model in models.get("models", {}).items():
+        state = "resident" if model["resident"] else "unloaded"
+        print(f"  {name}: {state}, {model['megabytes']:.0f} MB, {model['loads']} load(s), "
+              f"{model['evictions']} eviction(s)")
+    coalescing = info.get("coalescing")
+    if coalescing:
+        print(f"Coalesced requests: {coalescing['coalesced']} ({coalescing['in_flight']} in flight)")
+    for replica in info.get("pocket_replicas", []):
+        state = "up" if replica["alive"] else "down"
+        print(f"  pocket replica {replica['replica']} (pid {replica['pid']}, cores {replica['cores']}, {state}): "
+              f"{replica['utilization']:.0%} busy, {replica['completed']} done, "
+              f"{replica['failed']} failed, {replica['in_flight']} in flight")
+
+
+def serve(socket_path=DEFAULT_SOCKET_PATH, models_config=None, pocket_replicas=0, pocket_threads=None,
+          metrics_port=None):
+    if not is_supported():
+        print("Error: Unix sockets are not supported on this platform.")
+        sys.exit(1)
+
+    if os.path.exists(socket_path):
+        if ping(socket_path):
+            print(f"A daemon is already listening on {socket_path}")
+            sys.exit(1)
+        os.remove(socket_path)  # Stale socket from a crashed daemon
+
+    server = TTSDaemon(socket_path, models_config, pocket_replicas, pocket_threads)
+    print(f"Erika TTS daemon listening on {socket_path}")
+    if metrics_port:
+        serve_http(metrics_port)
+        print(f"Metrics on http://127.0.0.1:{metrics_port}/metrics (and /metrics.json)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server.pocket_pool is not None:
+            server.pocket_pool.close()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - DAEMON - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH)
+    parser.add_argument("--memory-budget-mb", type=float, default=None,
+                        help="Unload least recently used models above this total (default: no limit)")
+    parser.add_argument("--idle-unload", type=float, default=None, metavar="SECONDS",
+                        help="Unload models that have not been used for this long (default: never)")
+    parser.add_argument("--pocket-replicas", default="0", metavar="N|auto",
+                        help="Run English on N Pocket TTS processes pinned to their own cores "
+                             "('auto' = one per --pocket-threads cores; default: 0, in-process)")
+    parser.add_argument("--pocket-threads", type=int, default=None,
+                        help="Cores and torch threads per replica (default: 2)")
+    parser.add_argument("--status", action="store_true", help="Print the running daemon's state and exit")
+    parser.add_argument("--metrics", nargs="?", const="prometheus", choices=("prometheus", "json"),
+                        help="Print the running daemon's metrics and exit (default format: prometheus)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Also serve /metrics and /metrics.json on this localhost port")
+    args = parser.parse_args()
+    if args.status:
+        print_status(args.socket)
+        sys.exit(0)
+    if args.metrics:
+        result = fetch_metrics(args.socket, prometheus=args.metrics == "prometheus")
+        if result is None:
+            print(f"No daemon listening on {args.socket}")
+            sys.exit(1)
+        print(result if args.metrics == "prometheus" else json.dumps(result, indent=2))
+        sys.exit(0)
+    replicas = args.pocket_replicas if args.pocket_replicas == "auto" else int(args.pocket_replicas)
+    serve(args.socket, {
+        "memory_budget_megabytes": args.memory_budget_mb,
+        "idle_unload_seconds": args.idle_unload,
+    }, replicas, args.pocket_threads, args.metrics_port)
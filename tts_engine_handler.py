@@ -1,9 +1,10 @@
+import contextlib
 import sys
 import os
 import subprocess
 import logging
 import tempfile
-import wave
+import threading
 import torch
 
 # Monkey-patch torch.load to bypass weights_only=True default in torch 2.4+
@@ -38,6 +39,28 @@ try:
 except Exception as e:
     logging.warning(f"Failed to patch torchaudio: {e}")
 
+import tts_daemon
+from audio_buffer import AudioBuffer
+from audio_cache import make_key
+from cancellation import Cancelled, check as check_cancelled
+from metrics import metrics
+from model_registry import COQUI_XTTS, registry as models
+from request_scheduler import scheduler
+from single_flight import SingleFlight
+
+# Generation settings used for Pocket TTS (mirrors the CLI flags below)
+POCKET_TTS_SETTINGS = {
+    "generation_settings": {
+        "device": "cpu",
+        "temperature": 0.7,
+        "lsd_decode_steps": 1,
+        "eos_threshold": -4.0,
+    }
+}
+
+# Engines with a batched generation path (see generate_speech_batch)
+BATCHED_ENGINES = ("pocket_tts", "parkiet")
+
 # Try to import parkiet_engine (assume it's in the same dir)
 try:
     import parkiet_engine
@@ -45,32 +68,90 @@ except ImportError:
     parkiet_engine = None
 
 class TTSEngineHandler:
-    _coqui_model = None  # Singleton for the heavy model
+    # Models are shared class-wide and are not thread-safe, so each engine
+    # runs one generation at a time even when several handlers are in use.
+    _engine_locks = {}
+    _engine_locks_guard = threading.Lock()
 
-    def __init__(self, venv_python_path):
+    def __init__(self, venv_python_path, cache=None, postprocessor=None):
         self.venv_python = venv_python_path
-        
-    def _generate_coqui_tts(self, text, voice_path):
-        """Generates speech using Coqui XTTS v2."""
-        try:
-            from TTS.api import TTS
-            import torch
-        except ImportError:
-            logging.error("Coqui TTS not installed.")
-            return None
+        self.cache = cache  # Optional audio_cache.AudioCache
+        # Optional audio_postprocess.AudioPostprocessor: silence is trimmed
+        # before audio is cached, and every engine's output leaves at one
+        # sample rate and loudness. The cache keeps audio at the engine's rate.
+        self.postprocessor = postprocessor
+        # Identical requests (same cache key) that overlap share one generation
+        self.single_flight = SingleFlight()
+
+    def _trim(self, audio, engine):
+        if self.postprocessor is None or audio is None or not len(audio):
+            return audio
+        return self.postprocessor.trim(audio, engine)
+
+    def _postprocess(self, audio):
+        if self.postprocessor is None or audio is None:
+            return audio
+        return self.postprocessor.process(audio)
+
+    def _cache_key(self, text, config):
+        engine = config.get("engine")
+        settings = {}
+        if engine == "pocket_tts":
+            settings = {k: v for k, v in POCKET_TTS_SETTINGS["generation_settings"].items() if k != "device"}
+        return make_key(engine, config.get("voice"), text, settings)
+
+    def is_cached(self, text, config):
+        """True if generate_speech would be served from the cache."""
+        return self.cache is not None and self.cache.contains(self._cache_key(text, config))
 
-        # Lazy load model
-        if TTSEngineHandler._coqui_model is None:
+    @staticmethod
+    def _load_coqui_model():
+        """The resident Coqui XTTS v2 model (see model_registry)."""
+        from TTS.api import TTS
+
+        def build():
             logging.info("Loading Coqui XTTS v2 model (this may take a while)...")
             device = "cuda" if torch.cuda.is_available() else "cpu"
             logging.info(f"Using device: {device}")
             # Multilingual XTTS v2
-            TTSEngineHandler._coqui_model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
-            
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-            output_path = f.name
-        os.remove(output_path)  # Ensure clean path for generation
-            
+            return TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+
+        return models.get(COQUI_XTTS, build)
+
+    def preload_engine(self, engine):
+        """Load the model of `engine` on a background thread so its first request does not wait."""
+        if engine == "pocket_tts":
+            import tts_engines
+            load = lambda: tts_engines.get_english_sample_rate(POCKET_TTS_SETTINGS)
+        elif engine == "parkiet" and parkiet_engine and parkiet_engine.is_available():
+            load = lambda: parkiet_engine._load_model(parkiet_engine.DEFAULT_SETTINGS["device"],
+                                                      parkiet_engine.DEFAULT_SETTINGS["quantization"])
+        elif engine == "coqui-xtts":
+            load = self._load_coqui_model
+        else:
+            return None
+
+        def run():
+            try:
+                load()
+            except Exception as e:
+                logging.error(f"Preloading {engine} failed: {e}")
+
+        thread = threading.Thread(target=run, name=f"preload-{engine}", daemon=True)
+        thread.start()
+        return thread
+
+    def _generate_coqui_tts(self, text, voice_path, cancel=None):
+        """
+        Generates speech using Coqui XTTS v2. XTTS has no step hook, so
+        `cancel` is only checked before and after the whole utterance.
+        """
+        try:
+            import TTS.api
+        except ImportError:
+            logging.error("Coqui TTS not installed.")
+            return None
+
         logging.info(f"Generating Coqui XTTS audio... Voice: {voice_path}")
         try:
             # Check if voice file exists
@@ -78,120 +159,331 @@ class TTSEngineHandler:
                  logging.error(f"Voice sample not found: {voice_path}")
                  return None
 
-            # Use direct generation and manual save for stability
-            wav = TTSEngineHandler._coqui_model.tts(
-                text=text,
-                speaker_wav=voice_path,
-                language="nl"
-            )
-            
-            import soundfile as sf
-            # XTTS v2 is 24000Hz
-            sf.write(output_path, wav, 24000)
-            
-            if os.path.exists(output_path):
-                return output_path
-            else:
-                logging.error("Coqui generation produced no file.")
+            check_cancelled(cancel)
+            with models.pinned(COQUI_XTTS):
+                wav = self._load_coqui_model().tts(
+                    text=text,
+                    speaker_wav=voice_path,
+                    language="nl"
+                )
+            check_cancelled(cancel)
+
+            if wav is None or not len(wav):
+                logging.error("Coqui generation produced no audio.")
                 return None
-        except Exception as e:
-            logging.error(f"Coqui generation failed: {e}")
-            return None
+            # XTTS v2 is 24000Hz
+            return AudioBuffer(wav, 24000)
+        except Cancelled:
+            raise
         except Exception as e:
             logging.error(f"Coqui generation failed: {e}")
             return None
         
-    def _generate_parkiet_tts(self, text, voice="default"):
+    def _generate_parkiet_tts(self, text, voice="default", cancel=None):
         """Generates Dutch speech using Parkiet engine."""
         if not parkiet_engine:
             logging.error("parkiet_engine module not found.")
             return None
             
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-            output_path = f.name
-            
         logging.info("Running Parkiet generation...")
         try:
             # Parkiet might take time to load model
-            success = parkiet_engine.generate_dutch_speech(text, output_path)
-            if success and os.path.exists(output_path):
-                return output_path
+            audio = parkiet_engine.generate_dutch_speech_batch([text], cancel=cancel)[0]
+            if audio is not None:
+                return AudioBuffer(audio, parkiet_engine.SAMPLE_RATE)
             else:
-                logging.error("Parkiet generation returned failure or no file.")
+                logging.error("Parkiet generation returned failure or no audio.")
                 return None
+        except Cancelled:
+            raise
         except Exception as e:
             logging.error(f"Parkiet generation raised exception: {e}")
             return None
 
-    def generate_speech(self, text, config, base_dir):
+    def _generate_parkiet_tts_batch(self, texts, cancel=None):
+        """Generates several Dutch utterances in one Parkiet generate call."""
+        if not parkiet_engine:
+            logging.error("parkiet_engine module not found.")
+            return [None] * len(texts)
+
+        logging.info(f"Running batched Parkiet generation ({len(texts)} items)...")
+        try:
+            results = parkiet_engine.generate_dutch_speech_batch(texts, cancel=cancel)
+        except Cancelled:
+            raise
+        except Exception as e:
+            logging.error(f"Parkiet batch generation raised exception: {e}")
+            results = [None] * len(texts)
+        return [AudioBuffer(audio, parkiet_engine.SAMPLE_RATE) if audio is not None else None
+                for audio in results]
+
+    def generate_speech(self, text, config, base_dir, cancel=None, schedule=None, fallback=True):
         """
-        Generates speech using the configured engine.
-        Returns path to audio file (generated or fallback).
+        Generates speech using the configured engine, checking the audio cache first.
+        Returns an AudioBuffer (cached, generated or, with `fallback`, the
+        language's error clip), or None.
+        Nothing is written to disk except the cache entry; call
+        `audio.write(path)` when a file is needed.
+        Raises Cancelled once `cancel` (a cancellation.CancelToken) is cancelled.
+        A request identical to one already generating waits for that one instead.
+        `schedule` (a request_scheduler.RequestSchedule) sets the job's place
+        in the engine's queue.
         """
+        audio = self.single_flight.run(
+            self._cache_key(text, config),
+            lambda: self._postprocess(self._generate_speech(text, config, base_dir, cancel, schedule)),
+            cancel,
+        )
+        if audio is None and fallback:
+            audio = self.get_fallback(config, base_dir)
+        return audio
+
+    def _generate_speech(self, text, config, base_dir, cancel=None, schedule=None):
         engine = config.get("engine")
         voice = config.get("voice")
-        output_path = None
-        
+        audio = None
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self._cache_key(text, config)
+            cached = self.cache.get_buffer(cache_key)
+            if cached is not None:
+                logging.info(f"Audio cache hit: {cache_key}")
+                return cached
+
         try:
-            if engine == "pocket_tts":
-                output_path = self._generate_pocket_tts(text, voice)
-            elif engine == "system_tts":
-                output_path = self._generate_system_tts(text, voice)
-            elif engine == "parkiet":
-                output_path = self._generate_parkiet_tts(text, voice)
-            elif engine == "coqui-xtts":
-                output_path = self._generate_coqui_tts(text, voice)
-            else:
-                logging.warning(f"Unknown engine: {engine}")
-                return self._get_fallback(config, base_dir)
+            with self._engine_turn(engine, text, schedule, cancel):
+                check_cancelled(cancel)
+                if engine == "pocket_tts":
+                    audio = self._generate_pocket_tts(text, voice, cancel)
+                elif engine == "system_tts":
+                    audio = self._generate_system_tts(text, voice, cancel)
+                elif engine == "parkiet":
+                    audio = self._generate_parkiet_tts(text, voice, cancel)
+                elif engine == "coqui-xtts":
+                    audio = self._generate_coqui_tts(text, voice, cancel)
+                else:
+                    logging.warning(f"Unknown engine: {engine}")
+                    return None
 
-            if output_path and os.path.exists(output_path):
-                return output_path
+            audio = self._trim(audio, engine)
+            if audio is not None and len(audio):
+                if cache_key:
+                    self.cache.put_buffer(cache_key, audio)
+                    logging.info(f"Audio cache stats: {self.cache.stats()}")
+                return audio
             else:
-                logging.error("Generation produced no file.")
-                return self._get_fallback(config, base_dir)
+                logging.error("Generation produced no audio.")
+                return None
 
+        except Cancelled:
+            raise
         except Exception as e:
             logging.error(f"Generation failed: {e}")
-            return self._get_fallback(config, base_dir)
+            return None
+
+    def generate_speech_batch(self, texts, config, base_dir, cancel=None, schedule=None, fallback=True):
+        """
+        Generates several utterances for the same engine and voice.
+        Pocket TTS and Parkiet run one batched generation for all uncached
+        texts; other engines fall back to one call per text.
+        Returns one AudioBuffer (or, with `fallback`, the error clip; else None) per text.
+        """
+        engine = config.get("engine")
+        if engine not in BATCHED_ENGINES:
+            return [self.generate_speech(text, config, base_dir, cancel, schedule, fallback) for text in texts]
+
+        results = [None] * len(texts)
+        cache_keys = [self._cache_key(text, config) for text in texts]
+        missing = []
+        for index, text in enumerate(texts):
+            if self.cache is not None:
+                cached = self.cache.get_buffer(cache_keys[index])
+                if cached is not None:
+                    logging.info(f"Audio cache hit: {cache_keys[index]}")
+                    results[index] = cached
+                    continue
+            missing.append(index)
+
+        results = [self._postprocess(audio) for audio in results]
+        # Texts repeated within the batch, or already generating for another
+        # request, wait for that generation (see single_flight.py)
+        flights = {}
+        waiting = {}
+        for index in missing:
+            flight, is_leader = self.single_flight.claim(cache_keys[index])
+            (flights if is_leader else waiting)[index] = flight
+        missing = list(flights)
+
+        if missing:
+            batch_texts = [texts[index] for index in missing]
+            failure = None
+            try:
+                generated = self._generate_batch(engine, batch_texts, config, cancel, schedule)
+                for index, audio in zip(missing, generated):
+                    audio = self._trim(audio, engine)
+                    if audio is not None and len(audio):
+                        if self.cache is not None:
+                            self.cache.put_buffer(cache_keys[index], audio)
+                        results[index] = self._postprocess(audio)
+                    else:
+                        logging.error("Generation produced no audio.")
+            except BaseException as e:
+                failure = e
+                raise
+            finally:
+                for index in missing:
+                    self.single_flight.release(cache_keys[index], flights[index], results[index], failure)
+            if self.cache is not None:
+                logging.info(f"Audio cache stats: {self.cache.stats()}")
+
+        for index, flight in waiting.items():
+            done, audio = self.single_flight.wait(flight, cancel)
+            results[index] = audio if done else \
+                self.generate_speech(texts[index], config, base_dir, cancel, schedule, fallback=False)
+        if fallback:
+            results = [audio if audio is not None else self.get_fallback(config, base_dir) for audio in results]
+        return results
+
+    def _generate_batch(self, engine, texts, config, cancel=None, schedule=None):
+        try:
+            with self._engine_turn(engine, texts, schedule, cancel):
+                check_cancelled(cancel)
+                if engine == "pocket_tts":
+                    return self._generate_pocket_tts_batch(texts, config.get("voice"), cancel)
+                return self._generate_parkiet_tts_batch(texts, cancel)
+        except Cancelled:
+            raise
+        except Exception as e:
+            logging.error(f"Batch generation failed: {e}")
+            return [None] * len(texts)
+
+    def stream_speech(self, text, config, cancel=None, schedule=None):
+        """
+        Starts streaming generation if the configured engine supports it
+        (currently Pocket TTS with "stream": true in the language config).
+        Returns (chunk_iterator, sample_rate, stats) or None; with a
+        postprocessor the chunks are trimmed, resampled and normalized on
+        the fly.
+        """
+        engine = config.get("engine")
+        if engine != "pocket_tts" or not config.get("stream"):
+            return None
+
+        try:
+            import tts_engines
+            stats = tts_engines.StreamStats()
+            sample_rate = tts_engines.get_english_sample_rate(POCKET_TTS_SETTINGS)
+        except Exception as e:
+            logging.warning(f"Streaming unavailable, using file generation: {e}")
+            return None
+
+        chunks = tts_engines.stream_english(text, POCKET_TTS_SETTINGS, config.get("voice"), stats, cancel)
+        # Only the time spent waiting for the model counts as generation, not playback
+        chunks = metrics.timed(chunks, "generation", engine=engine)
+        chunks = self._locked_stream(engine, chunks, text, schedule, cancel)
+        if self.postprocessor is not None:
+            chunks = self.postprocessor.stream(chunks, sample_rate, engine)
+            sample_rate = self.postprocessor.output_rate(sample_rate)
+        return chunks, sample_rate, stats
 
-    def _get_fallback(self, config, base_dir):
+    def _locked_stream(self, engine, chunks, text, schedule=None, cancel=None):
+        # Hold the engine's turn for as long as the model is producing chunks
+        with self._engine_turn(engine, text, schedule, cancel, measure=False):
+            yield from chunks
+
+    @contextlib.contextmanager
+    def _engine_turn(self, engine, texts, schedule=None, cancel=None, measure=True):
+        # The engine's lane orders waiting requests by priority, deadline and
+        # expected length (see request_scheduler.py)
+        span = metrics.span("generation", engine=engine) if measure else contextlib.nullcontext()
+        with scheduler.lane(engine, texts, schedule, cancel, measure), self._get_engine_lock(engine), span:
+            yield
+
+    @classmethod
+    def _get_engine_lock(cls, engine):
+        with cls._engine_locks_guard:
+            if engine not in cls._engine_locks:
+                cls._engine_locks[engine] = threading.Lock()
+            return cls._engine_locks[engine]
+
+    def get_fallback(self, config, base_dir):
+        """The language's pre-recorded error clip (post-processed), or None."""
         fallback_dir = os.path.join(base_dir, "fallback_audio")
         fallback_file = config.get("fallback_file")
         if fallback_file:
             path = os.path.join(fallback_dir, fallback_file)
             if os.path.exists(path):
                 logging.info(f"Using fallback audio: {path}")
-                return path
+                return self._postprocess(AudioBuffer.from_file(path))
         logging.error("No fallback audio available.")
         return None
 
-    def _generate_pocket_tts(self, text, voice):
+    def _generate_pocket_tts(self, text, voice, cancel=None):
+        # Prefer the warm daemon; it avoids a fresh interpreter and model load per call.
+        # Without an output path it sends the WAV back over the socket, no file involved.
+        # A daemon request (one sentence) is not interrupted; `cancel` is checked after it.
+        try:
+            response = tts_daemon.synthesize(text, "en", POCKET_TTS_SETTINGS, voice=voice)
+        except Exception as e:
+            logging.warning(f"TTS daemon request failed, falling back to subprocess: {e}")
+            response = None
+        check_cancelled(cancel)
+        if response is not None:
+            if response.get("ok") and response.get("audio"):
+                logging.info("Generated via TTS daemon.")
+                return AudioBuffer.from_wav_bytes(response["audio"])
+            logging.error(f"TTS daemon error: {response.get('error')}")
+
+        # The CLI can only write to a file: read it back once and always remove it
         with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
             output_path = f.name
-        
-        cmd = [
-            self.venv_python, "-m", "pocket_tts", "generate",
-            "--text", text,
-            "--voice", voice,
-            "--output-path", output_path,
-            "--device", "cpu",
-            "--temperature", "0.7",
-            "--lsd-decode-steps", "1",
-            "--eos-threshold", "-4.0"
-        ]
-        
-        logging.info(f"Running generation command: {cmd}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-        
-        if result.returncode != 0:
-            logging.error(f"pocket-tts failed: {result.stderr}")
-            return None
-            
-        self._fix_wav_header(output_path)
-        return output_path
+        try:
+            cmd = [
+                self.venv_python, "-m", "pocket_tts", "generate",
+                "--text", text,
+                "--voice", voice,
+                "--output-path", output_path,
+                "--device", "cpu",
+                "--temperature", "0.7",
+                "--lsd-decode-steps", "1",
+                "--eos-threshold", "-4.0"
+            ]
+
+            logging.info(f"Running generation command: {cmd}")
+            returncode, stderr = self._run_cancellable(cmd, cancel, timeout=120)
 
-    def _generate_system_tts(self, text, voice_name_fragment):
+            if returncode != 0:
+                logging.error(f"pocket-tts failed: {stderr}")
+                return None
+
+            # Reads up to the real end of the data, whatever frame count the header claims
+            return AudioBuffer.from_file(output_path)
+        finally:
+            self._remove_temp(output_path)
+
+    def _generate_pocket_tts_batch(self, texts, voice, cancel=None):
+        # Prefer the warm daemon, otherwise batch in this process
+        try:
+            response = tts_daemon.synthesize_batch(texts, "en", POCKET_TTS_SETTINGS, voice=voice)
+        except Exception as e:
+            logging.warning(f"TTS daemon batch request failed, generating in-process: {e}")
+            response = None
+        check_cancelled(cancel)
+        if response is not None:
+            if response.get("ok"):
+                logging.info(f"Generated batch of {len(texts)} via TTS daemon.")
+                audio = response.get("audio") or [None] * len(texts)
+                return [AudioBuffer.from_wav_bytes(data) if data else None for data in audio]
+            logging.error(f"TTS daemon error: {response.get('error')}")
+
+        import tts_engines
+        logging.info(f"Running batched Pocket TTS generation ({len(texts)} items)...")
+        results = tts_engines.generate_english_batch(texts, POCKET_TTS_SETTINGS, voice, cancel=cancel)
+        sample_rate = tts_engines.get_english_sample_rate(POCKET_TTS_SETTINGS)
+        return [AudioBuffer(audio, sample_rate) if audio is not None else None for audio in results]
+
+    def _generate_system_tts(self, text, voice_name_fragment, cancel=None):
         """Generates audio using Windows SAPI (System.Speech) via PowerShell."""
         with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
             output_path = f.name
@@ -223,32 +515,44 @@ class TTSEngineHandler:
         
         logging.info(f"Running System TTS generation (Voice filter: {voice_name_fragment})...")
         try:
-            subprocess.run(
-                ["powershell", "-c", ps_script],
-                check=True,
-                timeout=30
-            )
-            return output_path
+            returncode, stderr = self._run_cancellable(["powershell", "-c", ps_script], cancel, timeout=30)
+            if returncode != 0:
+                logging.error(f"System TTS failed: {stderr}")
+                return None
+            return AudioBuffer.from_file(output_path)
+        except Cancelled:
+            raise
         except Exception as e:
             logging.error(f"System TTS failed: {e}")
             return None
+        finally:
+            self._remove_temp(output_path)
+
+    @staticmethod
+    def _run_cancellable(cmd, cancel, timeout):
+        """
+        Run `cmd`, killing it if `cancel` is cancelled or `timeout` passes.
+        Returns (returncode, stderr); raises Cancelled or TimeoutExpired.
+        """
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        killer = cancel.on_cancel(process.kill) if cancel is not None else None
+        try:
+            _, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            if killer is not None:
+                killer()
+        check_cancelled(cancel)
+        return process.returncode, stderr
 
-    def _fix_wav_header(self, path):
+    @staticmethod
+    def _remove_temp(path):
         try:
-            with wave.open(path, 'rb') as wf:
-                params = wf.getparams()
-                frames = wf.getnframes()
-                
-                if frames >= 1000000000: # Corrupt frame count check
-                    logging.info(f"Fixing corrupt WAV header (frames={frames})")
-                    data = wf.readframes(frames)
-                    real_frames = len(data) // (params.nchannels * params.sampwidth)
-                    wf.close()
-                    
-                    with wave.open(path, 'wb') as fixed_wf:
-                        fixed_wf.setparams(params)
-                        fixed_wf.setnframes(real_frames)
-                        fixed_wf.writeframes(data)
-                    logging.info("WAV header fixed.")
-        except Exception as e:
-            logging.error(f"Error fixing WAV header: {e}")
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove temporary file {path}: {e}")
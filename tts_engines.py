@@ -1,80 +1,717 @@
 """
 Handles the generation of audio from different TTS engines.
 """
+import collections
+import contextlib
+import copy
+import functools
+import inspect
+import logging
 import os
 import subprocess
+import threading
+import time
 import torch
 import soundfile as sf
-from pocket_tts.models.tts_model import TTSModel
+from pocket_tts.models.tts_model import TTSModel, prepare_text_prompt, split_into_best_sentences
 from pocket_tts.default_parameters import (
     DEFAULT_TEMPERATURE,
     DEFAULT_LSD_DECODE_STEPS,
     DEFAULT_NOISE_CLAMP,
     DEFAULT_EOS_THRESHOLD
 )
-from pocket_tts.modules.stateful_module import init_states
+from pocket_tts.modules.stateful_module import increment_steps, init_states
+from pocket_tts.modules.transformer import StreamingMultiheadAttention
 from pocket_tts.utils.utils import PREDEFINED_VOICES
 import parkiet_engine
+from audio_buffer import AudioBuffer
+from audio_cache import voice_identity
+from cancellation import CancelToken, Cancelled
+from metrics import metrics
+from model_registry import POCKET_TTS, registry as models
+from wav_writer import WavWriter
 
 # --- English TTS Engine (PocketTTS) ---
 
-_english_tts_model = None  # Global model instance for efficiency
+DEFAULT_BATCH_SIZE = 8  # Sentence chunks per batched forward pass
 
-def generate_english(text_to_generate, settings, voice, full_output_path):
-    """Generate English speech using the Pocket TTS library directly."""
-    global _english_tts_model
 
-    print("Engine: Pocket TTS (English)")
+class StreamStats:
+    """Timing of one streamed generation. Times are in seconds."""
 
-    if _english_tts_model is None:
-        print("Loading Pocket TTS model (this may take a moment on first run)...")
-        gen_settings = settings.get("generation_settings", {})
-        
-        temp = gen_settings.get("temperature", DEFAULT_TEMPERATURE)
-        lsd_decode_steps = gen_settings.get("lsd_decode_steps", DEFAULT_LSD_DECODE_STEPS)
-        noise_clamp = gen_settings.get("noise_clamp", DEFAULT_NOISE_CLAMP)
-        eos_threshold = gen_settings.get("eos_threshold", DEFAULT_EOS_THRESHOLD)
-        device = gen_settings.get("device", "cpu")
-
-        _english_tts_model = TTSModel.load_model(
-            variant="b6369a24",  # Hardcoding variant as per README
-            temp=temp,
-            lsd_decode_steps=lsd_decode_steps,
-            noise_clamp=noise_clamp,
-            eos_threshold=eos_threshold,
-        ).to(device)
-        print(f"Pocket TTS model loaded on {device}")
-
-    # Initialize model state
-    model_state = init_states(_english_tts_model.flow_lm, batch_size=1, sequence_length=1000)
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.time_to_first_audio = None     # First PCM chunk out of the model
+        self.time_to_first_playback = None  # Set by the player when audio starts
+        self.total_time = None
+        self.audio_seconds = 0.0
+        self.chunks = 0
 
-    # Handle voice conditioning
+    @property
+    def real_time_factor(self):
+        """Seconds of compute per second of audio (lower is faster)."""
+        if not self.audio_seconds or self.total_time is None:
+            return None
+        return self.total_time / self.audio_seconds
+
+    def __repr__(self):
+        ttfa = f"{self.time_to_first_audio * 1000:.0f} ms" if self.time_to_first_audio is not None else "n/a"
+        return f"StreamStats(ttfa={ttfa}, audio={self.audio_seconds:.2f}s, chunks={self.chunks})"
+
+
+def _build_english_model(settings):
+    print("Loading Pocket TTS model (this may take a moment on first run)...")
+    gen_settings = settings.get("generation_settings", {})
+
+    temp = gen_settings.get("temperature", DEFAULT_TEMPERATURE)
+    lsd_decode_steps = gen_settings.get("lsd_decode_steps", DEFAULT_LSD_DECODE_STEPS)
+    noise_clamp = gen_settings.get("noise_clamp", DEFAULT_NOISE_CLAMP)
+    eos_threshold = gen_settings.get("eos_threshold", DEFAULT_EOS_THRESHOLD)
+    device = gen_settings.get("device", "cpu")
+
+    model = TTSModel.load_model(
+        variant="b6369a24",  # Hardcoding variant as per README
+        temp=temp,
+        lsd_decode_steps=lsd_decode_steps,
+        noise_clamp=noise_clamp,
+        eos_threshold=eos_threshold,
+    ).to(device)
+    print(f"Pocket TTS model loaded on {device}")
+    return model
+
+
+def _unload_english_model(model):
+    # Voice states and arena buffers belong to the unloaded model
+    global _voice_state_cache, _state_arena
+    _voice_state_cache = None
+    _state_arena = None
+
+
+def _load_english_model(settings):
+    """The resident Pocket TTS model (see model_registry)."""
+    return models.get(POCKET_TTS, lambda: _build_english_model(settings), _unload_english_model)
+
+
+def _pins_english_model(func):
+    """Keep the Pocket TTS model resident while `func` (or the generator it returns) runs."""
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            with models.pinned(POCKET_TTS):
+                yield from func(*args, **kwargs)
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with models.pinned(POCKET_TTS):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _state_nbytes(model_state):
+    return sum(
+        value.numel() * value.element_size()
+        for module_state in model_state.values()
+        for value in module_state.values()
+        if torch.is_tensor(value)
+    )
+
+
+def _clone_state(model_state):
+    """
+    Copy-on-use clone of a conditioned flow_lm state.
+
+    Attention caches are only ever read up to `current_end` (everything past it
+    is written before it is read), so only the conditioned prefix is copied.
+    """
+    clone = {}
+    for module_name, module_state in model_state.items():
+        cloned = {}
+        prefix = module_state["current_end"].shape[0] if "current_end" in module_state else None
+        for key, value in module_state.items():
+            if key == "cache" and prefix is not None:
+                buffer = torch.empty_like(value)
+                buffer[:, :, :prefix].copy_(value[:, :, :prefix])
+                cloned[key] = buffer
+            elif torch.is_tensor(value):
+                cloned[key] = value.clone()
+            else:
+                cloned[key] = copy.deepcopy(value)
+        clone[module_name] = cloned
+    return clone
+
+
+class VoiceStateCache:
+    """
+    Per-process LRU cache of voice-conditioned Pocket TTS model states.
+
+    Conditioning a custom WAV runs the audio prompt through the model, which is
+    wasted work when the same voice is used again. Entries are keyed by voice
+    name, or by path + mtime + content hash for custom WAVs, and are evicted
+    least-recently-used first once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # key -> (state, nbytes)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(voice):
+        if voice in PREDEFINED_VOICES:
+            return ("predefined", voice)
+        path = os.path.abspath(voice)
+        return ("file", path, os.stat(path).st_mtime_ns, voice_identity(path))
+
+    def get(self, model, voice):
+        """Return the shared conditioned state for `voice`. Callers must not modify it."""
+        key = self.make_key(voice)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        with metrics.span("voice_conditioning", engine=POCKET_TTS):
+            state = model.get_state_for_audio_prompt(voice)
+        nbytes = _state_nbytes(state)
+        with self._lock:
+            if key not in self._entries and nbytes <= self.max_bytes:
+                self._entries[key] = (state, nbytes)
+                self.total_bytes += nbytes
+                while self.total_bytes > self.max_bytes:
+                    _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                    self.total_bytes -= evicted_bytes
+        return state
+
+    def checkout(self, model, voice):
+        """Return a private clone of the conditioned state for `voice`."""
+        return _clone_state(self.get(model, voice))
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class FlowStateArena:
+    """
+    Pool of preallocated flow_lm states, reset in place between requests.
+
+    Allocating a fresh 1000-step attention cache per sentence chunk is wasted
+    work in a long-running process. The arena hands out the smallest free
+    state that fits the expected sequence length, resets it (copying in the
+    voice prefix if there is one) and takes it back afterwards. It only grows
+    when a longer text needs more room than any state it owns.
+    """
+
+    GRANULARITY = 256  # Capacities are rounded up to a multiple of this
+
+    def __init__(self, flow_lm, min_capacity=1000):
+        self.flow_lm = flow_lm
+        self.min_capacity = min_capacity
+        self.allocations = 0
+        self.reuses = 0
+        self._free = []  # list of (capacity, state)
+        self._lock = threading.Lock()
+        self._empty_end = torch.zeros((0,))
+
+    @staticmethod
+    def supports(model_state):
+        # In-place reset relies on the `current_end` cache layout of StreamingMultiheadAttention
+        return all("current_end" in module_state for module_state in model_state.values())
+
+    def _round_up(self, sequence_length):
+        capacity = max(sequence_length, self.min_capacity)
+        return -(-capacity // self.GRANULARITY) * self.GRANULARITY
+
+    def acquire(self, sequence_length, template=None):
+        """
+        Get a state with room for `sequence_length` steps, reset to `template`
+        (a conditioned voice state) or to empty if no template is given.
+        """
+        if template is not None:
+            prefix = max(m["current_end"].shape[0] for m in template.values())
+            sequence_length += prefix
+
+        state = None
+        with self._lock:
+            fitting = [entry for entry in self._free if entry[0] >= sequence_length]
+            if fitting:
+                entry = min(fitting, key=lambda e: e[0])
+                self._free.remove(entry)
+                state = entry[1]
+                self.reuses += 1
+            else:
+                self.allocations += 1
+
+        if state is None:
+            capacity = self._round_up(sequence_length)
+            logging.info(f"State arena: allocating flow_lm state with capacity {capacity}")
+            state = init_states(self.flow_lm, batch_size=1, sequence_length=capacity)
+
+        self._reset(state, template)
+        return state
+
+    def _reset(self, state, template):
+        for module_name, module_state in state.items():
+            if template is None:
+                module_state["current_end"] = self._empty_end.to(module_state["current_end"].device)
+                continue
+            source = template[module_name]
+            prefix = source["current_end"].shape[0]
+            module_state["cache"][:, :, :prefix].copy_(source["cache"][:, :, :prefix])
+            # increment_step replaces current_end rather than mutating it, so sharing is safe
+            module_state["current_end"] = source["current_end"]
+
+    def release(self, state):
+        capacity = min(m["cache"].shape[2] for m in state.values())
+        with self._lock:
+            self._free.append((capacity, state))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+                "free_states": len(self._free),
+                "free_capacities": sorted(entry[0] for entry in self._free),
+            }
+
+
+_voice_state_cache = None
+_state_arena = None
+
+
+def _resolve_english_voice(voice):
+    """Validate the voice once per request. Returns the voice to condition on, or None."""
     if voice:
         if voice in PREDEFINED_VOICES:
             print(f"Using predefined voice: {voice}")
-            model_state = _english_tts_model.get_state_for_audio_prompt(voice)
+            return voice
         elif os.path.exists(voice):
             print(f"Using custom voice from: {voice}")
-            model_state = _english_tts_model.get_state_for_audio_prompt(voice)
+            return voice
         else:
             print(f"Warning: Voice '{voice}' not found as a predefined voice or file path. Using default voice.")
     else:
         print("Using default Pocket TTS voice.")
+    return None
+
+
+def _estimate_sequence_length(model, chunk_text):
+    # Text prompt tokens plus the generation cap Pocket TTS uses (12.5 frames/s, 1s per word + 2s)
+    text_tokens = model.flow_lm.conditioner.prepare(chunk_text).tokens.shape[-1]
+    return text_tokens + int((len(chunk_text.split()) + 2.0) * 12.5) + 1
+
+
+def _get_voice_template(voice, settings):
+    """Shared voice-conditioned state for `voice` (None for the default voice). Read-only."""
+    global _voice_state_cache
+
+    if voice is None:
+        return None
+    # Handle voice conditioning
+    if _voice_state_cache is None:
+        max_megabytes = settings.get("voice_state_cache_megabytes", 256)
+        _voice_state_cache = VoiceStateCache(int(max_megabytes * 1024 * 1024))
+    return _voice_state_cache.get(_load_english_model(settings), voice)
+
+
+def _get_english_model_state(voice, settings, sequence_length=1000):
+    """
+    Returns (model_state, from_arena). States from the arena must be handed
+    back with _state_arena.release() once generation has finished.
+    """
+    global _state_arena
+
+    template = _get_voice_template(voice, settings)
+
+    if _state_arena is None:
+        _state_arena = FlowStateArena(_load_english_model(settings).flow_lm)
+
+    if template is None or FlowStateArena.supports(template):
+        return _state_arena.acquire(sequence_length, template), True
+
+    return _clone_state(template), False
+
+
+def _install_cancel_check(model):
+    """
+    Make every flow_lm step check `model._cancel_token` first.
+
+    The library runs the autoregressive loop on its own thread; raising
+    Cancelled there ends the loop, and generate_audio_stream re-raises it to
+    the consumer, so a cancelled generation stops within one decode step.
+    """
+    if getattr(model, "_cancel_check_installed", False):
+        return
+    step = model._run_flow_lm_and_increment_step
+
+    def checked_step(*args, **kwargs):
+        token = model._cancel_token
+        if token is not None:
+            token.check()
+        return step(*args, **kwargs)
+
+    model._cancel_token = None
+    model._run_flow_lm_and_increment_step = checked_step
+    model._cancel_check_installed = True
+
+
+@contextlib.contextmanager
+def _cancellable(model, cancel):
+    """Check `cancel` in the model's step loop while the block runs (one generation at a time)."""
+    _install_cancel_check(model)
+    model._cancel_token = cancel
+    try:
+        yield
+    finally:
+        model._cancel_token = None
+
+
+def _iter_english_chunks(model, text_to_generate, voice, settings, cancel=None):
+    """
+    Stream audio tensors for `text_to_generate`.
+
+    Pocket TTS restarts from the voice state for every sentence chunk. Doing the
+    split here lets each chunk reuse a preallocated arena state, reset to the
+    cached voice state, instead of the library deep-copying the full state.
+
+    Raises Cancelled once `cancel` is cancelled. If the consumer closes the
+    iterator early, the library's generation thread is stopped before
+    returning, so the model is free for the next caller.
+    """
+    voice = _resolve_english_voice(voice)
+    frames_after_eos = settings.get("generation_settings", {}).get("frames_after_eos")
+    stop = CancelToken(cancel)
+    try:
+        for chunk_text in split_into_best_sentences(model.flow_lm.conditioner.tokenizer, text_to_generate):
+            stop.check()
+            sequence_length = _estimate_sequence_length(model, chunk_text)
+            model_state, from_arena = _get_english_model_state(voice, settings, sequence_length)
+            stream = model.generate_audio_stream(
+                model_state=model_state,
+                text_to_generate=chunk_text,
+                frames_after_eos=frames_after_eos,
+                copy_state=False,
+            )
+            with _cancellable(model, stop):
+                try:
+                    for chunk in stream:
+                        yield chunk
+                except GeneratorExit:
+                    # Let the generation thread hit the cancelled token and exit
+                    stop.cancel("abandoned")
+                    try:
+                        for _ in stream:
+                            pass
+                    except Cancelled:
+                        pass
+                    raise
+            # Only reached when the chunk finished; a cancelled generation may
+            # have left the state half written, so it is not returned then.
+            if from_arena:
+                _state_arena.release(model_state)
+    finally:
+        stop.release()
+
+
+def get_state_arena_stats():
+    """Allocation counters of the flow_lm state arena (None before first use)."""
+    return _state_arena.stats() if _state_arena is not None else None
+
+
+def get_english_sample_rate(settings):
+    """Sample rate of the Pocket TTS model (loads the model if needed)."""
+    return _load_english_model(settings).sample_rate
+
+
+@_pins_english_model
+def stream_english(text_to_generate, settings, voice, stats=None, cancel=None):
+    """
+    Generate English speech with Pocket TTS, yielding audio as it is produced.
+
+    Args:
+        text_to_generate: Text to synthesize
+        settings: Settings dict (uses generation_settings)
+        voice: Predefined voice name or WAV path
+        stats: Optional StreamStats, filled in while streaming
+        cancel: Optional cancellation.CancelToken; generation stops within
+                one decode step of it being cancelled (raises Cancelled)
+
+    Yields:
+        numpy.ndarray: float32 PCM chunks (mono) at get_english_sample_rate()
+    """
+    model = _load_english_model(settings)
+
+    print("Generating English speech (streaming)...")
+    if stats is not None:
+        stats.started_at = time.perf_counter()
+
+    with contextlib.closing(_iter_english_chunks(model, text_to_generate, voice, settings, cancel)) as chunks:
+        for chunk in chunks:
+            pcm = chunk.cpu().numpy()
+            if stats is not None:
+                if stats.time_to_first_audio is None:
+                    stats.time_to_first_audio = time.perf_counter() - stats.started_at
+                stats.chunks += 1
+                stats.audio_seconds += len(pcm) / model.sample_rate
+            yield pcm
+
+    if stats is not None:
+        stats.total_time = time.perf_counter() - stats.started_at
+
+
+@_pins_english_model
+def synthesize_english(text_to_generate, settings, voice, cancel=None):
+    """Generate English speech with the Pocket TTS library, in memory. Returns an AudioBuffer."""
+    print("Engine: Pocket TTS (English)")
+
+    model = _load_english_model(settings)
 
     print("Generating English speech...")
-    audio_tensor = _english_tts_model.generate_audio(
-        model_state=model_state,
-        text_to_generate=text_to_generate,
-        frames_after_eos=settings.get("generation_settings", {}).get("frames_after_eos"),
-    )
+    audio_tensor = torch.cat(list(_iter_english_chunks(model, text_to_generate, voice, settings, cancel)), dim=0)
+    return AudioBuffer(audio_tensor.cpu().numpy(), model.sample_rate)
+
 
-    # Save the generated audio
-    audio_data = audio_tensor.cpu().numpy()
-    sf.write(full_output_path, audio_data, _english_tts_model.sample_rate)
+@_pins_english_model
+def generate_english(text_to_generate, settings, voice, full_output_path):
+    """
+    Generate English speech using the Pocket TTS library directly. Each
+    chunk is appended to the WAV file as soon as it is generated.
+    """
+    print("Engine: Pocket TTS (English)")
+
+    model = _load_english_model(settings)
+
+    print("Generating English speech...")
+    with WavWriter(full_output_path, model.sample_rate) as writer:
+        for chunk in _iter_english_chunks(model, text_to_generate, voice, settings):
+            writer.write(chunk.cpu().numpy())
 
     return os.path.exists(full_output_path)
 
 
+@contextlib.contextmanager
+def _key_padding_mask(flow_lm, padding):
+    """
+    Hide left-padding from attention while generating a batch.
+
+    Pocket TTS attention only applies a causal mask. `padding` is a
+    (batch, capacity) bool tensor marking cache positions each row must not
+    attend to. Only valid for batched steps, so callers hold the engine lock.
+    """
+    layers = [m for m in flow_lm.modules() if isinstance(m, StreamingMultiheadAttention)]
+
+    def get_mask(shape, shift, device):
+        num_queries, num_keys = shape
+        causal = torch.ones(shape, dtype=torch.bool, device=device).tril(diagonal=num_keys - num_queries)
+        allowed = causal[None] & ~padding[:, None, :num_keys]
+        mask = torch.zeros(allowed.shape, device=device).masked_fill_(~allowed, float("-inf"))
+        return mask[:, None]  # (batch, heads, queries, keys)
+
+    for layer in layers:
+        layer._get_mask = get_mask
+    try:
+        yield
+    finally:
+        for layer in layers:
+            del layer._get_mask
+
+
+def _prompt_batch_state(model, tokens, template, capacity):
+    """
+    Build a batched flow_lm state with every row's voice prefix and text prompt.
+
+    Each row is prompted on its own and then placed right-aligned in the batch
+    cache, so all rows share one `current_end`. Cached keys already carry
+    their RoPE rotation, so a row shifted by `pad` positions gets its keys
+    rotated by `pad` as well; relative positions, and thus outputs, are the
+    same as for an unbatched run. Returns (model_state, padding).
+    """
+    flow_lm = model.flow_lm
+    device = next(flow_lm.parameters()).device
+    batch_size = len(tokens)
+    prefix = max(m["current_end"].shape[0] for m in template.values()) if template else 0
+    prompt_length = prefix + max(t.shape[-1] for t in tokens)
+
+    model_state = init_states(flow_lm, batch_size=batch_size, sequence_length=capacity)
+    padding = torch.zeros((batch_size, capacity), dtype=torch.bool, device=device)
+    layers = dict(flow_lm.named_modules())
+
+    for row, row_tokens in enumerate(tokens):
+        row_length = prefix + row_tokens.shape[-1]
+        if template is not None:
+            row_state = _clone_state(template)
+        else:
+            row_state = init_states(flow_lm, batch_size=1, sequence_length=row_length)
+        model._run_flow_lm_and_increment_step(model_state=row_state, text_tokens=row_tokens)
+
+        pad = prompt_length - row_length
+        padding[row, :pad] = True
+        for module_name, module_state in model_state.items():
+            cache = row_state[module_name]["cache"][:, 0, :row_length]
+            keys = cache[0]
+            if pad:
+                # Treat each position as its own sequence so every key is rotated by `pad`
+                keys = layers[module_name].rope(keys[:, None], keys[:, None], offset=pad)[1][:, 0]
+            module_state["cache"][0, row, :pad] = 0  # Masked, but must not be NaN
+            module_state["cache"][1, row, :pad] = 0
+            module_state["cache"][0, row, pad:prompt_length] = keys
+            module_state["cache"][1, row, pad:prompt_length] = cache[1]
+
+    for module_state in model_state.values():
+        module_state["current_end"] = torch.zeros((prompt_length,), device=module_state["current_end"].device)
+    return model_state, padding
+
+
+@torch.no_grad()
+def _generate_english_chunk_batch(model, chunk_texts, template, cancel=None):
+    """
+    Generate several sentence chunks with one batched forward pass per step.
+
+    Mirrors TTSModel.generate_audio_stream for a single chunk: each row keeps
+    its own EOS step, frames-after-EOS and length cap, and the batch stops
+    once every row has finished. Returns one 1-D audio tensor per chunk.
+    Raises Cancelled at the next step once `cancel` is cancelled.
+    """
+    flow_lm = model.flow_lm
+    device = next(flow_lm.parameters()).device
+    batch_size = len(chunk_texts)
+
+    tokens = [flow_lm.conditioner.prepare(text).tokens for text in chunk_texts]
+    max_gen_lens = [int((len(text.split()) + 2.0) * 12.5) for text in chunk_texts]
+    frames_after_eos = [prepare_text_prompt(text)[1] + 2 for text in chunk_texts]
+
+    prefix = max(m["current_end"].shape[0] for m in template.values()) if template else 0
+    capacity = prefix + max(t.shape[-1] for t in tokens) + max(max_gen_lens) + 1
+    model_state, padding = _prompt_batch_state(model, tokens, template, capacity)
+
+    # The library defaults its empty inputs to batch size 1
+    no_tokens = torch.zeros((batch_size, 0), dtype=torch.int64, device=device)
+    no_conditioning = torch.empty((batch_size, 0, flow_lm.dim), dtype=flow_lm.dtype, device=device)
+
+    latents = []
+    frame_counts = [None] * batch_size
+    eos_steps = [None] * batch_size
+    with _key_padding_mask(flow_lm, padding):
+        backbone_input = torch.full((batch_size, 1, flow_lm.ldim), float("NaN"), dtype=flow_lm.dtype, device=device)
+        for step in range(max(max_gen_lens)):
+            if cancel is not None:
+                cancel.check()
+            next_latent, is_eos = model._run_flow_lm_and_increment_step(
+                model_state=model_state, text_tokens=no_tokens,
+                backbone_input_latents=backbone_input, audio_conditioning=no_conditioning,
+            )
+            is_eos = is_eos.view(batch_size).tolist()
+            for row in range(batch_size):
+                if frame_counts[row] is not None:
+                    continue
+                if is_eos[row] and eos_steps[row] is None:
+                    eos_steps[row] = step
+                if eos_steps[row] is not None and step >= eos_steps[row] + frames_after_eos[row]:
+                    frame_counts[row] = step
+                elif step + 1 >= max_gen_lens[row]:
+                    frame_counts[row] = step + 1
+            latents.append(next_latent)
+            backbone_input = next_latent
+            if all(count is not None for count in frame_counts):
+                break
+
+    for row, eos_step in enumerate(eos_steps):
+        if eos_step is None:
+            logging.warning(f"Batch item {row} reached maximum length without EOS")
+
+    # Decode all rows together; each row is trimmed to its own frame count
+    mimi_state = init_states(model.mimi, batch_size=batch_size, sequence_length=1000)
+    for module_state in mimi_state.values():
+        if "offset" in module_state:
+            # Rows advance in lockstep; RoPE only accepts one shared offset
+            module_state["offset"] = module_state["offset"][:1].clone()
+    frames = []
+    for latent in latents[:max(frame_counts)]:
+        mimi_input = (latent * flow_lm.emb_std + flow_lm.emb_mean).transpose(-1, -2)
+        frames.append(model.mimi.decode_from_latent(model.mimi.quantizer(mimi_input), mimi_state))
+        increment_steps(model.mimi, mimi_state, increment=16)
+    if not frames:
+        return [torch.zeros(0, device=device) for _ in chunk_texts]
+    audio = torch.cat(frames, dim=-1)
+    samples_per_frame = frames[0].shape[-1]
+    return [audio[row, 0, :count * samples_per_frame] for row, count in enumerate(frame_counts)]
+
+
+@_pins_english_model
+def generate_english_batch(texts, settings, voice, output_paths=None, max_batch_size=DEFAULT_BATCH_SIZE,
+                           cancel=None):
+    """
+    Generate English speech for several texts with batched Pocket TTS passes.
+
+    All sentence chunks of all texts share one voice and are generated in
+    batches of up to `max_batch_size`, grouped by token length to keep padding
+    small.
+
+    Args:
+        texts: List of texts to synthesize
+        settings: Settings dict (uses generation_settings)
+        voice: Predefined voice name or WAV path, shared by the whole batch
+        output_paths: Optional list of WAV paths, one per text
+        max_batch_size: Maximum number of chunks per forward pass
+        cancel: Optional cancellation.CancelToken, checked every decode step
+
+    Returns:
+        list: One float32 numpy array per text (None for texts without speech)
+    """
+    print(f"Engine: Pocket TTS (English, batch of {len(texts)})")
+    model = _load_english_model(settings)
+    voice = _resolve_english_voice(voice)
+    template = _get_voice_template(voice, settings)
+
+    chunks = []  # (text index, chunk text)
+    tokenizer = model.flow_lm.conditioner.tokenizer
+    for index, text in enumerate(texts):
+        if text and text.strip():
+            chunks.extend((index, chunk) for chunk in split_into_best_sentences(tokenizer, text))
+
+    chunk_audio = [None] * len(chunks)
+    if template is not None and not FlowStateArena.supports(template):
+        # Unknown state layout: fall back to one chunk at a time
+        for position, (_, chunk_text) in enumerate(chunks):
+            model_state = _clone_state(template)
+            with _cancellable(model, cancel):
+                chunk_audio[position] = torch.cat(list(model.generate_audio_stream(
+                    model_state=model_state, text_to_generate=chunk_text, copy_state=False)), dim=0)
+    else:
+        token_counts = [_estimate_sequence_length(model, chunk_text) for _, chunk_text in chunks]
+        order = sorted(range(len(chunks)), key=token_counts.__getitem__)
+        for start in range(0, len(order), max(1, max_batch_size)):
+            group = order[start:start + max_batch_size]
+            outputs = _generate_english_chunk_batch(model, [chunks[i][1] for i in group], template, cancel)
+            for position, output in zip(group, outputs):
+                chunk_audio[position] = output
+
+    results = [None] * len(texts)
+    for index in range(len(texts)):
+        pieces = [audio for (owner, _), audio in zip(chunks, chunk_audio) if owner == index]
+        if pieces:
+            results[index] = torch.cat(pieces, dim=0).cpu().numpy()
+
+    if output_paths:
+        for audio_data, output_path in zip(results, output_paths):
+            if audio_data is not None and output_path:
+                sf.write(output_path, audio_data, model.sample_rate)
+
+    return results
+
+
 # --- Dutch TTS Engine (Parkiet) ---
 
 def generate_dutch(text_to_generate, settings, full_output_path):
@@ -90,3 +727,30 @@ def generate_dutch(text_to_generate, settings, full_output_path):
         full_output_path,
         settings.get("parkiet_settings", {})
     )
+
+
+def synthesize_dutch(text_to_generate, settings, cancel=None):
+    """Generate Dutch speech using Parkiet, in memory. Returns an AudioBuffer, or None on failure."""
+    audio = generate_dutch_batch([text_to_generate], settings, cancel=cancel)[0]
+    return AudioBuffer(audio, parkiet_engine.SAMPLE_RATE) if audio is not None else None
+
+
+def generate_dutch_batch(texts, settings, output_paths=None, cancel=None):
+    """
+    Generate Dutch speech for several texts in one Parkiet generate call.
+
+    Returns:
+        list: One float32 numpy array per text (None where generation failed)
+    """
+    if not parkiet_engine.is_available():
+        print("Error: Parkiet dependencies not installed.")
+        print("Please run: pip install transformers soundfile torch")
+        return [None] * len(texts)
+
+    print(f"Engine: Parkiet (Dutch, batch of {len(texts)})")
+    return parkiet_engine.generate_dutch_speech_batch(
+        texts,
+        output_paths,
+        settings.get("parkiet_settings", {}),
+        cancel=cancel,
+    )
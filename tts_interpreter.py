@@ -1,7 +1,65 @@
 import json
 import os
+import re
 import logging
 
+import language_id
+from metrics import metrics
+
+# Sentence ends: . ! ? … (optionally followed by a closing quote/bracket) then whitespace
+_SENTENCE_END = re.compile(r'(?<=[.!?\u2026])\s+|(?<=[.!?\u2026]["\'\u201d\u2019)\]])\s+')
+_CLAUSE_END = re.compile(r'(?<=[,;:])\s+')
+
+
+def _split_long_sentence(sentence, max_chars):
+    # Greedily pack clauses into pieces of at most max_chars
+    pieces = []
+    current = ""
+    for clause in _CLAUSE_END.split(sentence):
+        if current and len(current) + 1 + len(clause) > max_chars:
+            pieces.append(current)
+            current = clause
+        else:
+            current = f"{current} {clause}" if current else clause
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_sentences(text, min_chars=20, max_chars=250):
+    """
+    Splits text into sentence-sized segments for pipelined synthesis.
+
+    Fragments shorter than `min_chars` are merged into the next segment so the
+    engines are not fed one-word utterances (which sound choppy). Sentences
+    longer than `max_chars` are split further at clause punctuation.
+    """
+    text = " ".join(text.split())
+    if not text:
+        return []
+
+    pieces = []
+    for sentence in _SENTENCE_END.split(text):
+        if len(sentence) > max_chars:
+            pieces.extend(_split_long_sentence(sentence, max_chars))
+        else:
+            pieces.append(sentence)
+
+    segments = []
+    current = ""
+    for piece in pieces:
+        current = f"{current} {piece}" if current else piece
+        if len(current) >= min_chars:
+            segments.append(current)
+            current = ""
+    if current:
+        if segments:
+            segments[-1] = f"{segments[-1]} {current}"
+        else:
+            segments.append(current)
+    return segments
+
+
 class TTSInterpreter:
     def __init__(self, config_path="tts_config.json"):
         self.config = self._load_config(config_path)
@@ -25,19 +83,13 @@ class TTSInterpreter:
         Determines the language/engine configuration for the given text.
         Returns: (config_dict, clean_text)
         """
-        # Simple heuristic or default for now
-        # Future: Add langdetect logic here
-        
-        # Check if user forced valid JSON as input (CLI override)
-        # Otherwise default logic
-        
-        lang_code = self.config.get("default_language", "en")
-        
-        # Basic Dutch detection (placeholder logic)
-        dutch_triggers = ["hallo", "ik ben", " goed", " en ", " het ", " de ", " een "]
-        if any(trigger in text.lower() for trigger in dutch_triggers):
-            lang_code = "nl"
-            
+        default_lang = self.config.get("default_language", "en")
+        # Below this confidence the default language is used
+        min_confidence = self.config.get("language_min_confidence", 0.6)
+        with metrics.span("language_detection"):
+            lang_code, confidence = language_id.detect_language(text, default_lang, min_confidence)
+        logging.debug(f"Detected language {lang_code} ({confidence:.2f}) for: {text[:40]!r}")
+
         lang_config = self.config["languages"].get(lang_code, self.config["languages"]["en"])
-        
+
         return lang_config, text